@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import (Announce, Comment, Follow, Idea, Like, Memo, Notification,
+from .models import (Announce, Comment, Follow, Idea, Job, Like, Memo,
+                     Notification, NotificationCounter, PersistedQuery,
                      Profile, Report, Thread, Topic, User)
 
 # Register your models here.
@@ -9,9 +10,12 @@ admin.site.register(Announce)
 admin.site.register(Comment)
 admin.site.register(Follow)
 admin.site.register(Idea)
+admin.site.register(Job)
 admin.site.register(Like)
 admin.site.register(Memo)
 admin.site.register(Notification)
+admin.site.register(NotificationCounter)
+admin.site.register(PersistedQuery)
 admin.site.register(Profile)
 admin.site.register(Report)
 admin.site.register(Thread)
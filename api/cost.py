@@ -0,0 +1,227 @@
+from django.conf import settings
+from graphene_django.settings import graphene_settings
+from graphql.backend.core import GraphQLCoreBackend
+from graphql.backend.base import GraphQLDocument
+from graphql.error import GraphQLError
+from graphql.execution import ExecutionResult, execute
+from graphql.language import ast
+from graphql.type.definition import (GraphQLList, GraphQLNonNull,
+                                     GraphQLObjectType, get_named_type)
+from graphql.validation import validate
+
+# 1件あたりの取得が重いフィールドの重み('型名.フィールド名'、既定は1)
+FIELD_WEIGHTS = {
+    'Query.searchIdeas': 10,
+    'Query.searchMemos': 10,
+    'Query.myTimeline': 5,
+}
+
+# ページングの引数がない一覧の件数の見積もり
+DEFAULT_LIST_SIZE = 100
+
+
+def _max_depth():
+    return getattr(settings, 'GRAPHQL_MAX_DEPTH', 12)
+
+
+def _max_cost():
+    return getattr(settings, 'GRAPHQL_MAX_COST', 5000)
+
+
+def _unwrap_non_null(type_):
+    while isinstance(type_, GraphQLNonNull):
+        type_ = type_.of_type
+    return type_
+
+
+def _is_connection(type_):
+    return isinstance(type_, GraphQLObjectType) and 'edges' in type_.fields \
+        and 'pageInfo' in type_.fields
+
+
+def _is_edge(type_):
+    return isinstance(type_, GraphQLObjectType) and 'node' in type_.fields \
+        and 'cursor' in type_.fields
+
+
+class CostAnalysis:
+    """
+    リクエストの文書から、実行前に深さとコストを見積もる
+    コストはオブジェクトを返すフィールドの解決回数の見積もりで、
+    コネクションのfirst/lastの件数を子のフィールドに掛けていく
+    """
+    def __init__(self, schema, document_ast, variables=None):
+        self.schema = schema
+        self.variables = variables or {}
+        self.fragments = {}
+        self.operations = {}
+        for definition in document_ast.definitions:
+            if isinstance(definition, ast.FragmentDefinition):
+                self.fragments[definition.name.value] = definition
+            elif isinstance(definition, ast.OperationDefinition):
+                name = definition.name.value if definition.name else None
+                self.operations[name] = definition
+        self.depth = 0
+        self.cost = 0
+        self.errors = []
+        # ルートのフィールド名と、選択されたオブジェクトの型
+        self.root_fields = set()
+        self.types = set()
+
+    def analyze(self, operation_name=None):
+        if operation_name is None and len(self.operations) == 1:
+            operation = next(iter(self.operations.values()))
+        else:
+            operation = self.operations.get(operation_name)
+        if operation is None:
+            return self
+        self.defaults = {
+            definition.variable.name.value: definition.default_value
+            for definition in operation.variable_definitions or []
+        }
+        root_type = {
+            'query': self.schema.get_query_type,
+            'mutation': self.schema.get_mutation_type,
+            'subscription': self.schema.get_subscription_type,
+        }[operation.operation]()
+        self._visit(operation.selection_set, root_type, 1, 1, set())
+        return self
+
+    def _fields(self, selection_set, parent_type, visited):
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.Field):
+                yield selection, parent_type
+            elif isinstance(selection, ast.InlineFragment):
+                type_ = parent_type
+                if selection.type_condition:
+                    type_ = self.schema.get_type(
+                        selection.type_condition.name.value)
+                yield from self._fields(selection.selection_set, type_,
+                                        visited)
+            elif isinstance(selection, ast.FragmentSpread):
+                name = selection.name.value
+                fragment = self.fragments.get(name)
+                # 循環するフラグメントはバリデーションで弾かれる
+                if fragment is None or name in visited:
+                    continue
+                type_name = fragment.type_condition.name.value
+                type_ = self.schema.get_type(type_name)
+                yield from self._fields(fragment.selection_set, type_,
+                                        visited | {name})
+
+    def _visit(self, selection_set, parent_type, depth, multiplier, visited):
+        self.depth = max(self.depth, depth)
+        for field, type_ in self._fields(selection_set, parent_type, visited):
+            name = field.name.value
+            if depth == 1:
+                self.root_fields.add(name)
+            # イントロスペクションはスキーマから返すだけなので数えない
+            if name.startswith('__') or not hasattr(type_, 'fields'):
+                continue
+            definition = type_.fields.get(name)
+            if definition is None or field.selection_set is None:
+                continue
+            field_type = _unwrap_non_null(definition.type)
+            named_type = get_named_type(field_type)
+            self.types.add(named_type)
+            child_multiplier = multiplier
+            if _is_connection(named_type):
+                child_multiplier *= self._page_size(field)
+            elif isinstance(field_type, GraphQLList) and \
+                    not _is_connection(type_):
+                child_multiplier *= DEFAULT_LIST_SIZE
+            # edges・node・pageInfoはコネクションの構造なので数えない
+            if not _is_connection(type_) and not _is_edge(type_):
+                self.cost += FIELD_WEIGHTS.get(type_.name + '.' + name,
+                                               1) * multiplier
+            self._visit(field.selection_set, named_type, depth + 1,
+                        child_multiplier, visited)
+
+    def _page_size(self, field):
+        max_limit = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+        for argument in field.arguments or []:
+            name = argument.name.value
+            if name not in ('first', 'last'):
+                continue
+            size = self._value(argument.value)
+            # 変数の型の誤りは実行時の変数の変換でエラーになる
+            if not isinstance(size, int) or isinstance(size, bool):
+                continue
+            # 負の件数でコストを打ち消せないよう、実行前に拒否する
+            if size < 0:
+                self.errors.append(
+                    GraphQLError('%s must not be negative' % name))
+                return 0
+            return min(size, max_limit or size)
+        return max_limit or DEFAULT_LIST_SIZE
+
+    def _value(self, value):
+        if isinstance(value, ast.Variable):
+            name = value.name.value
+            if self.variables.get(name) is not None:
+                return self.variables[name]
+            value = self.defaults.get(name)
+        if isinstance(value, ast.IntValue):
+            return int(value.value)
+        return None
+
+
+def cost_extensions(analysis):
+    return {
+        'cost': {
+            'requested': analysis.cost,
+            'maximum': _max_cost(),
+            'depth': analysis.depth,
+            'maxDepth': _max_depth(),
+        }
+    }
+
+
+def check_cost(schema, document_ast, variables=None, operation_name=None):
+    analysis = CostAnalysis(schema, document_ast,
+                            variables).analyze(operation_name)
+    errors = list(analysis.errors)
+    if analysis.depth > _max_depth():
+        errors.append(
+            GraphQLError('query depth %d exceeds the maximum depth %d' %
+                         (analysis.depth, _max_depth())))
+    if analysis.cost > _max_cost():
+        errors.append(
+            GraphQLError('query cost %d exceeds the maximum cost %d' %
+                         (analysis.cost, _max_cost())))
+    return analysis, errors
+
+
+def execute_with_cost(schema, document_ast, validation_errors, **kwargs):
+    if validation_errors:
+        return ExecutionResult(errors=validation_errors, invalid=True)
+
+    analysis, errors = check_cost(schema, document_ast,
+                                  kwargs.get('variable_values'),
+                                  kwargs.get('operation_name'))
+    if errors:
+        return ExecutionResult(errors=errors,
+                               invalid=True,
+                               extensions=cost_extensions(analysis))
+    result = execute(schema, document_ast, **kwargs)
+    if isinstance(result, ExecutionResult):
+        result.extensions.update(cost_extensions(analysis))
+    return result
+
+
+class CostAnalysisBackend(GraphQLCoreBackend):
+    """実行前に深さとコストを見積もり、上限を超えるリクエストを拒否するバックエンド"""
+    def document_from_string(self, schema, document_string):
+        document = super().document_from_string(schema, document_string)
+        document_ast = document.document_ast
+        # バリデーションは文書だけで決まるので、文書を作る時に1回だけ行う
+        validation_errors = validate(schema, document_ast)
+
+        def execute(**kwargs):
+            return execute_with_cost(schema, document_ast, validation_errors,
+                                     **dict(self.execute_params, **kwargs))
+
+        return GraphQLDocument(schema=schema,
+                               document_string=document.document_string,
+                               document_ast=document_ast,
+                               execute=execute)
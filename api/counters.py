@@ -0,0 +1,162 @@
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+
+from . import response_cache
+from .models import (Comment, Idea, Like, Memo, Notification,
+                     NotificationCounter, Topic, User)
+
+# いいねの対象の投稿タイプと、モデル・Likeの外部キーの対応
+LIKE_TARGETS = {
+    'Idea': (Idea, 'liked_idea'),
+    'Memo': (Memo, 'liked_memo'),
+    'Comment': (Comment, 'liked_comment'),
+}
+
+
+# 増減した値が0未満にならないようにするF式
+def _clamped(field_name, delta):
+    return Greatest(F(field_name) + delta, 0)
+
+
+# いいね数をF式で原子的に増減する(ずれていても0未満にはしない)
+def change_like_count(like: Like, delta: int):
+    if like.like_target_type not in LIKE_TARGETS:
+        return
+    model, field_name = LIKE_TARGETS[like.like_target_type]
+    target_id = getattr(like, field_name + '_id')
+    if target_id is None:
+        return
+    model.objects.filter(id=target_id).update(
+        like_count=_clamped('like_count', delta))
+    # updateではpost_saveが送られないので、キャッシュしたlikeCountを無効にする
+    response_cache.invalidate_on_commit(model.__name__)
+
+
+# 未読の通知数をF式で原子的に増減する(ずれていても0未満にはしない)
+def change_unread_notification_count(user_id, delta: int):
+    if delta == 0:
+        return
+    counters = NotificationCounter.objects.filter(user_id=user_id)
+    if delta < 0:
+        counters.update(unread_count=_clamped('unread_count', delta))
+        return
+    if not counters.update(unread_count=F('unread_count') + delta):
+        NotificationCounter.objects.get_or_create(user_id=user_id)
+        counters.update(unread_count=F('unread_count') + delta)
+
+
+# 複数のユーザーの未読の通知数をまとめて増やす(カウンタが無いユーザーは先に作る)
+def add_unread_notification_counts(user_ids, delta: int):
+    if not user_ids or delta <= 0:
+        return
+    counters = NotificationCounter.objects.filter(user_id__in=user_ids)
+    existing = set(counters.values_list('user_id', flat=True))
+    NotificationCounter.objects.bulk_create([
+        NotificationCounter(user_id=user_id)
+        for user_id in user_ids if user_id not in existing
+    ],
+                                            ignore_conflicts=True)
+    counters.update(unread_count=F('unread_count') + delta)
+
+
+# トピックの公開されたアイデア数をF式で原子的に増減する(ずれていても0未満にはしない)
+def change_topic_idea_counts(topic_ids, delta: int):
+    if not topic_ids or delta == 0:
+        return
+    Topic.objects.filter(id__in=topic_ids).update(
+        idea_count=_clamped('idea_count', delta))
+
+
+def get_unread_notification_count(user_id):
+    return NotificationCounter.objects.filter(user_id=user_id).values_list(
+        'unread_count', flat=True).first() or 0
+
+
+def _iter_id_batches(queryset, batch_size):
+    last_id = 0
+    while True:
+        ids = list(
+            queryset.filter(id__gt=last_id).order_by('id').values_list(
+                'id', flat=True)[:batch_size])
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+# 集計値と実際の行数がずれている行だけをまとめて更新し、更新した行数を返す
+def reconcile_counter(model, counter_field, count_queryset, group_field,
+                      batch_size):
+    fixed = 0
+    for ids in _iter_id_batches(model.objects.all(), batch_size):
+        counts = dict(
+            count_queryset.filter(**{
+                group_field + '__in': ids
+            }).order_by().values(group_field).annotate(
+                n=Count('id')).values_list(group_field, 'n'))
+        drifted = []
+        for obj in model.objects.filter(id__in=ids).only('id', counter_field):
+            actual = counts.get(obj.id, 0)
+            if getattr(obj, counter_field) != actual:
+                setattr(obj, counter_field, actual)
+                drifted.append(obj)
+        model.objects.bulk_update(drifted, [counter_field])
+        fixed += len(drifted)
+    if fixed:
+        response_cache.invalidate_on_commit(model.__name__)
+    return fixed
+
+
+def reconcile_like_counts(batch_size):
+    fixed = 0
+    for model, field_name in LIKE_TARGETS.values():
+        fixed += reconcile_counter(model, 'like_count',
+                                   Like.objects.filter(is_liked=True),
+                                   field_name + '_id', batch_size)
+    return fixed
+
+
+def reconcile_unread_notification_counts(batch_size):
+    fixed = 0
+    for ids in _iter_id_batches(User.objects.all(), batch_size):
+        counts = dict(
+            Notification.objects.filter(
+                notification_reciever_id__in=ids,
+                is_checked=False).order_by().values(
+                    'notification_reciever_id').annotate(
+                        n=Count('id')).values_list('notification_reciever_id',
+                                                   'n'))
+        counters = NotificationCounter.objects.in_bulk(ids)
+        drifted = []
+        missing = []
+        for user_id in ids:
+            actual = counts.get(user_id, 0)
+            counter = counters.get(user_id)
+            if counter is None:
+                if actual:
+                    missing.append(
+                        NotificationCounter(user_id=user_id,
+                                            unread_count=actual))
+            elif counter.unread_count != actual:
+                counter.unread_count = actual
+                drifted.append(counter)
+        NotificationCounter.objects.bulk_create(missing,
+                                                ignore_conflicts=True)
+        NotificationCounter.objects.bulk_update(drifted, ['unread_count'])
+        fixed += len(missing) + len(drifted)
+    return fixed
+
+
+def reconcile_topic_idea_counts(batch_size):
+    return reconcile_counter(
+        Topic, 'idea_count',
+        Idea.topics.through.objects.filter(idea__is_published=True),
+        'topic_id', batch_size)
+
+
+# reconcile_countersコマンドで補正できるカウンタ
+RECONCILERS = {
+    'like_count': reconcile_like_counts,
+    'unread_notification_count': reconcile_unread_notification_counts,
+    'topic_idea_count': reconcile_topic_idea_counts,
+}
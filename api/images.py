@@ -0,0 +1,161 @@
+import hashlib
+import io
+import logging
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from . import jobs, response_cache
+from .models import Profile
+
+logger = logging.getLogger(__name__)
+
+# プロフィール画像の一辺の大きさ(正方形に切り抜く)
+PROFILE_IMAGE_SIZES = (64, 128, 256)
+# 保存する形式と、Pillowの保存時の引数
+IMAGE_FORMATS = {
+    'webp': ('WEBP', {
+        'quality': 80,
+        'method': 4
+    }),
+    'jpeg': ('JPEG', {
+        'quality': 85,
+        'optimize': True,
+        'progressive': True
+    }),
+}
+DEFAULT_IMAGE_FORMAT = 'webp'
+
+
+def _open(file, max_size):
+    image = Image.open(file)
+    # JPEGは縮小して読み込むと、大きな写真でもデコードが速くメモリも少ない
+    image.draft('RGB', (max_size * 2, max_size * 2))
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
+        return image.convert('RGBA')
+    return image.convert('RGB')
+
+
+def _encode(image, image_format):
+    format_name, options = IMAGE_FORMATS[image_format]
+    if format_name == 'JPEG' and image.mode == 'RGBA':
+        # JPEGは透過できないので白の背景に重ねる
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    buffer = io.BytesIO()
+    image.save(buffer, format_name, **options)
+    return buffer.getvalue()
+
+
+# プロフィールの縮小画像を保存するディレクトリ
+# 他のプロフィールと共有しないので、前の画像の縮小画像を消しても他に影響しない
+def _variant_dir(profile_id):
+    return 'profiles/variants/%d/' % profile_id
+
+
+def _save(data, size, image_format, profile_id):
+    # 内容のハッシュをファイル名にし、同じプロフィールの同じ画像は1度だけ保存する
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    name = '%s%s_%d.%s' % (_variant_dir(profile_id), digest, size,
+                           image_format)
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(data))
+    return name
+
+
+def make_variants(file, profile_id):
+    """
+    画像の向きをEXIFに合わせて直し、大きさごとに正方形に切り抜いて形式ごとに保存する
+    {'大きさ': {'形式': 保存した名前}} を返す
+    """
+    sizes = sorted(PROFILE_IMAGE_SIZES, reverse=True)
+    image = _open(file, sizes[0])
+    variants = {}
+    for size in sizes:
+        # 大きい方から順に縮小する
+        image = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        variants[str(size)] = {
+            image_format: _save(_encode(image, image_format), size,
+                                image_format, profile_id)
+            for image_format in IMAGE_FORMATS
+        }
+    return variants
+
+
+def _variant_names(variants):
+    return {
+        name
+        for formats in (variants or {}).values() for name in formats.values()
+    }
+
+
+def process_profile_image(profile_id, image_name):
+    """
+    アップロードされた元の画像から縮小した画像を作り、プロフィールに保存する
+    処理中に別の画像がアップロードされていた場合は保存しない
+    """
+    profile = Profile.objects.filter(id=profile_id,
+                                     profile_image=image_name).first()
+    if profile is None:
+        return None
+    try:
+        with profile.profile_image.open('rb') as file:
+            variants = make_variants(file, profile_id)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logger.warning('could not process profile image %s',
+                       image_name,
+                       exc_info=True)
+        return None
+    with transaction.atomic():
+        updated = Profile.objects.filter(
+            id=profile_id,
+            profile_image=image_name).update(profile_image_variants=variants)
+        if updated:
+            response_cache.invalidate_on_commit('Profile')
+    if not updated:
+        return None
+    # 前の画像の縮小画像を消す
+    # 以前の内容のハッシュだけの名前は他のプロフィールと共有しているので消さない
+    names = [
+        name for name in _variant_names(profile.profile_image_variants) -
+        _variant_names(variants) if name.startswith(_variant_dir(profile_id))
+    ]
+    # ジョブのトランザクションがロールバックされても前の縮小画像が残るよう、コミット後に消す
+    transaction.on_commit(lambda: _delete_files(names))
+    return variants
+
+
+def _delete_files(names):
+    for name in names:
+        default_storage.delete(name)
+
+
+# 縮小画像を作るジョブを追加する(run_workerで実行する)
+def enqueue_profile_image(profile):
+    jobs.enqueue('process_profile_image', {
+        'profile_id': profile.id,
+        'image_name': profile.profile_image.name
+    })
+
+
+def profile_image_url(profile, size, image_format=DEFAULT_IMAGE_FORMAT):
+    """
+    指定の大きさ以上で最も小さい縮小画像のURLを返す
+    縮小画像がまだ無い場合は元の画像、それも無い場合はGoogleの画像のURLを返す
+    """
+    variants = profile.profile_image_variants or {}
+    if image_format not in IMAGE_FORMATS:
+        image_format = DEFAULT_IMAGE_FORMAT
+    if variants:
+        sizes = sorted(int(key) for key in variants)
+        chosen = next((s for s in sizes if s >= (size or 0)), sizes[-1])
+        name = variants[str(chosen)].get(image_format)
+        if name:
+            return default_storage.url(name)
+    if profile.profile_image:
+        return profile.profile_image.url
+    return profile.google_image_url
@@ -0,0 +1,260 @@
+import logging
+import random
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import Avg, Count, F, Max, Min
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import counters, notifications, timeline, trending
+from .models import Idea, Job, User
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# ジョブの名前と実行する関数(payloadをキーワード引数として渡す)
+HANDLERS = {
+    'send_welcome_email': 'api.jobs.send_welcome_email',
+    'process_profile_image': 'api.images.process_profile_image',
+    'fan_out_idea': 'api.jobs.fan_out_idea',
+    'delete_timeline_entries': 'api.jobs.delete_timeline_entries',
+    'notify_followers': 'api.jobs.notify_followers',
+    'refresh_trending': 'api.jobs.refresh_trending',
+    'reconcile_counters': 'api.jobs.reconcile_counters',
+}
+
+# 1回分ずつコミットするので、トランザクションで囲まずに実行するジョブ
+NON_ATOMIC = {'notify_followers'}
+
+
+def enqueue(name, payload=None, key=None, run_at=None, max_attempts=5):
+    """
+    ジョブを追加する
+    リクエストのトランザクションの中で追加すれば、ロールバックされた時にジョブも消える
+    keyが同じジョブが既にある場合は追加せずにNoneを返す
+    """
+    if name not in HANDLERS:
+        raise ValueError('unknown job: %s' % name)
+    job = Job(name=name,
+              payload=payload or {},
+              key=key,
+              run_at=run_at or timezone.now(),
+              max_attempts=max_attempts)
+    if key is None:
+        job.save()
+        return job
+    try:
+        with transaction.atomic(using=router.db_for_write(Job)):
+            job.save()
+    except IntegrityError:
+        return None
+    return job
+
+
+def _retry_delay(attempts):
+    # 失敗するたびに待ち時間を2倍にし、同時に失敗したジョブがずれるように揺らす
+    base = getattr(settings, 'JOB_RETRY_BASE_DELAY', 10)
+    delay = min(base * 2**(attempts - 1),
+                getattr(settings, 'JOB_RETRY_MAX_DELAY', 3600))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def claim(worker_id, limit=1):
+    """
+    実行できるジョブを取得して実行中にする
+    SELECT ... FOR UPDATE SKIP LOCKEDが使えるDBでは他のワーカーがロックした行を飛ばし、
+    使えないDB(SQLite)では待機中のままの行だけを更新できたものを取得する
+    """
+    alias = router.db_for_write(Job)
+    now = timezone.now()
+    queued = Job.objects.using(alias).filter(
+        status=QUEUED, run_at__lte=now).order_by('run_at', 'id')
+    running = dict(status=RUNNING,
+                   locked_by=worker_id,
+                   locked_at=now,
+                   started_at=now,
+                   attempts=F('attempts') + 1)
+    if connections[alias].features.has_select_for_update_skip_locked:
+        with transaction.atomic(using=alias):
+            ids = list(
+                queued.select_for_update(skip_locked=True).values_list(
+                    'id', flat=True)[:limit])
+            Job.objects.using(alias).filter(id__in=ids).update(**running)
+    else:
+        # 1行ずつ待機中のままなら実行中にする更新だけで取り合い、
+        # 他のワーカーに取られた場合は次の行を試す
+        ids = []
+        while len(ids) < limit:
+            candidates = list(
+                queued.values_list('id', flat=True)[:limit * 10])
+            if not candidates:
+                break
+            for job_id in candidates:
+                if Job.objects.using(alias).filter(
+                        id=job_id, status=QUEUED).update(**running):
+                    ids.append(job_id)
+                    if len(ids) >= limit:
+                        break
+    return list(Job.objects.using(alias).filter(id__in=ids).order_by('id'))
+
+
+def supports_concurrency():
+    # SQLiteは書き込みが1つずつで、読み込んでから書き込むトランザクション同士が
+    # ロックの競合で失敗するので、ジョブを同時に実行しない
+    alias = router.db_for_write(Job)
+    return connections[alias].features.has_select_for_update_skip_locked
+
+
+def run(job, worker_id):
+    """
+    ジョブを実行して結果を記録する
+    失敗した場合はmax_attemptsに達するまで待ち時間を空けて待機中に戻す
+    """
+    started = time.perf_counter()
+    error = None
+    try:
+        handler = import_string(HANDLERS[job.name])
+        if job.name in NON_ATOMIC:
+            handler(**job.payload)
+        else:
+            with transaction.atomic(using=router.db_for_write(Job)):
+                handler(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+    duration_ms = (time.perf_counter() - started) * 1000
+    now = timezone.now()
+    fields = dict(locked_by='',
+                  locked_at=None,
+                  finished_at=now,
+                  duration_ms=duration_ms)
+    if error is None:
+        fields.update(status=DONE, last_error='')
+        outcome = DONE
+    elif job.attempts < job.max_attempts:
+        delay = _retry_delay(job.attempts)
+        fields.update(status=QUEUED,
+                      last_error=error,
+                      run_at=now + timedelta(seconds=delay))
+        outcome = 'retry'
+    else:
+        fields.update(status=FAILED, last_error=error)
+        outcome = FAILED
+    Job.objects.filter(id=job.id, locked_by=worker_id).update(**fields)
+    log = logger.warning if error else logger.info
+    log('job %s %d %s attempt=%d duration_ms=%.1f', job.name, job.id,
+        outcome, job.attempts, duration_ms)
+    return outcome
+
+
+def release_stale(timeout=None):
+    """
+    止まったワーカーが実行中のまま残したジョブを待機中に戻す
+    (試行回数を使い切っている場合は失敗にする)
+    """
+    timeout = timeout or getattr(settings, 'JOB_LOCK_TIMEOUT', 600)
+    now = timezone.now()
+    stale = Job.objects.filter(status=RUNNING,
+                               locked_at__lt=now - timedelta(seconds=timeout))
+    released = dict(locked_by='', locked_at=None, last_error='lock timeout')
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=FAILED, **released)
+    return failed + stale.update(status=QUEUED, run_at=now, **released)
+
+
+# 完了したジョブのうち保持期間を過ぎたものを消す
+def prune(hours=None):
+    hours = hours or getattr(settings, 'JOB_RETENTION_HOURS', 168)
+    return Job.objects.filter(status=DONE,
+                              finished_at__lt=timezone.now() -
+                              timedelta(hours=hours)).delete()[0]
+
+
+def periodic_jobs():
+    # 定期的に追加するジョブの名前と間隔(秒、0の場合は追加しない)
+    intervals = {
+        'refresh_trending': getattr(settings, 'TRENDING_REFRESH_INTERVAL', 0),
+        'reconcile_counters': getattr(settings, 'COUNTER_RECONCILE_INTERVAL',
+                                      0),
+    }
+    return {name: seconds for name, seconds in intervals.items() if seconds}
+
+
+def schedule_periodic(now=None):
+    """
+    定期的なジョブを間隔ごとに1件ずつ追加する
+    間隔ごとのkeyで重複を防ぐので、複数のワーカーから呼んでもよい
+    """
+    timestamp = (now or timezone.now()).timestamp()
+    added = 0
+    for name, seconds in periodic_jobs().items():
+        key = '%s:%d' % (name, timestamp // seconds)
+        if enqueue(name, key=key, max_attempts=1) is not None:
+            added += 1
+    return added
+
+
+def stats():
+    """
+    ジョブの名前・状態ごとの件数と実行時間、待機中のジョブの待ち時間を返す
+    """
+    now = timezone.now()
+    rows = Job.objects.values('name', 'status').annotate(
+        count=Count('id'),
+        avg_ms=Avg('duration_ms'),
+        max_ms=Max('duration_ms'),
+        avg_attempts=Avg('attempts'),
+        oldest_run_at=Min('run_at')).order_by('name', 'status')
+    result = []
+    for row in rows:
+        lag = None
+        if row['status'] == QUEUED and row['oldest_run_at'] <= now:
+            lag = (now - row['oldest_run_at']).total_seconds()
+        result.append(dict(row, lag_seconds=lag))
+    return result
+
+
+def send_welcome_email(user_id):
+    user = User.objects.filter(id=user_id).first()
+    if user is None:
+        return
+    send_mail(subject='サンプルアプリ | 本登録のお知らせ',
+              message='ユーザー作成時にメール送信しています' + user.email,
+              from_email='sample@email.com',
+              recipient_list=[user.email],
+              fail_silently=False)
+
+
+def fan_out_idea(idea_id):
+    idea = Idea.objects.filter(id=idea_id).first()
+    if idea is not None:
+        timeline.fan_out_idea(idea)
+
+
+# 読み込み時に取得するようになったユーザーのエントリを消す(残っていれば続きを追加する)
+def delete_timeline_entries(author_id):
+    if timeline.delete_author_entries(author_id):
+        enqueue('delete_timeline_entries', {'author_id': author_id})
+
+
+def notify_followers(idea_id):
+    idea = Idea.objects.filter(id=idea_id).first()
+    if idea is not None:
+        notifications.notify_followers(idea)
+
+
+def refresh_trending(batch_size=2000):
+    trending.refresh(batch_size)
+
+
+def reconcile_counters(names=None, batch_size=1000):
+    for name in names or sorted(counters.RECONCILERS):
+        counters.RECONCILERS[name](batch_size)
@@ -0,0 +1,94 @@
+from django.contrib.auth import get_user_model
+from promise import Promise
+from promise.dataloader import DataLoader
+
+from . import tracing
+from .models import Comment, Idea, Memo, Profile, Thread
+
+
+# idのリストを受け取り、1回のIN (...)クエリでまとめて取得する
+class ModelLoader(DataLoader):
+    def __init__(self, model, field='id'):
+        super().__init__()
+        self.model = model
+        self.field = field
+
+    def batch_load_fn(self, keys):
+        with tracing.span('DataLoader.' + self.model.__name__):
+            objects = {
+                getattr(obj, self.field): obj
+                for obj in self.model.objects.filter(
+                    **{self.field + '__in': keys})
+            }
+        return Promise.resolve([objects.get(key) for key in keys])
+
+
+# 親のidのリストを受け取り、多対多の関連を中間テーブルから1回のクエリでまとめて取得する
+class ManyToManyLoader(DataLoader):
+    def __init__(self, model, field_name):
+        super().__init__()
+        field = model._meta.get_field(field_name)
+        self.through = field.remote_field.through
+        self.source = field.m2m_field_name()
+        self.target = field.m2m_reverse_field_name()
+
+    def batch_load_fn(self, keys):
+        related = {key: [] for key in keys}
+        with tracing.span('DataLoader.' + self.through.__name__):
+            rows = self.through.objects.filter(**{
+                self.source + '_id__in': keys
+            }).select_related(self.target).order_by(self.target + '_id')
+            for row in rows:
+                related[getattr(row, self.source + '_id')].append(
+                    getattr(row, self.target))
+        return Promise.resolve([related[key] for key in keys])
+
+
+# リクエスト単位でDataLoaderを保持する
+class Loaders:
+    def __init__(self):
+        self.user = ModelLoader(get_user_model())
+        # ユーザーのidからプロフィールを取得する(逆参照の1対1)
+        self.profile_by_user = ModelLoader(Profile, field='related_user_id')
+        self.idea = ModelLoader(Idea)
+        self.memo = ModelLoader(Memo)
+        self.thread = ModelLoader(Thread)
+        self.comment = ModelLoader(Comment)
+        self.idea_topics = ManyToManyLoader(Idea, 'topics')
+
+
+def get_loaders(info):
+    loaders = getattr(info.context, 'loaders', None)
+    if loaders is None:
+        loaders = Loaders()
+        info.context.loaders = loaders
+    return loaders
+
+
+# 外部キーのidからDataLoader経由で取得するリゾルバを作る
+# select_relatedなどで取得済みの場合はそのまま返す
+def load_related(loader_name, field_name, cache_name=None):
+    if cache_name is None:
+        cache_name = field_name[:-len('_id')]
+
+    def resolver(root, info, **kwargs):
+        if cache_name in root._state.fields_cache:
+            return root._state.fields_cache[cache_name]
+        key = getattr(root, field_name)
+        if key is None:
+            return None
+        return getattr(get_loaders(info), loader_name).load(key)
+
+    return resolver
+
+
+# 多対多の関連をDataLoader経由で取得するリゾルバを作る
+# prefetch_relatedで取得済みの場合はそのまま返す
+def load_many(loader_name, field_name):
+    def resolver(root, info, **kwargs):
+        prefetched = getattr(root, '_prefetched_objects_cache', {})
+        if field_name in prefetched:
+            return list(prefetched[field_name])
+        return getattr(get_loaders(info), loader_name).load(root.id)
+
+    return resolver
@@ -0,0 +1,294 @@
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from api.management.commands.benchmark_graphql import (Workload, _free_port,
+                                                       _git_revision,
+                                                       _summary)
+from api.seed import seed_dataset
+from api.validation import verified_tokens
+
+# 同時接続数を変えて送る読み込みの操作
+OPERATIONS = ('feed', 'ideaDetail', 'notifications')
+SERVERS = ('wsgi', 'asgi')
+
+
+# Procfileと同じgunicornのsyncワーカーで計測する
+# (gunicornが無い環境では接続ごとにスレッドで処理するDjangoのWSGIサーバーを使う)
+def _wsgi_server():
+    if importlib.util.find_spec('gunicorn') is not None:
+        return 'gunicorn'
+    return 'django'
+
+
+def _http_request(body, token):
+    body = json.dumps(body).encode()
+    headers = ('POST /graphql/ HTTP/1.1\r\n'
+               'Host: 127.0.0.1\r\n'
+               'Content-Type: application/json\r\n'
+               'Authorization: Bearer %s\r\n'
+               'Content-Length: %d\r\n'
+               'Connection: close\r\n\r\n' % (token, len(body))).encode()
+    return headers, body
+
+
+class Client:
+    """
+    1つの接続で1件ずつリクエストを送るクライアント
+    slowの秒数だけ、ヘッダを送ってから本文を送るまで待つ(遅い回線のクライアント)
+    """
+    def __init__(self, port, token, slow):
+        self.port = port
+        self.token = token
+        self.slow = slow
+        self.timings = []
+        self.errors = 0
+
+    async def run(self, requests):
+        while requests:
+            headers, body = _http_request(requests.pop(), self.token)
+            started = time.perf_counter()
+            try:
+                reader, writer = await asyncio.open_connection(
+                    '127.0.0.1', self.port)
+                writer.write(headers)
+                if self.slow:
+                    await writer.drain()
+                    await asyncio.sleep(self.slow)
+                writer.write(body)
+                await writer.drain()
+                response = await reader.read()
+                writer.close()
+            except OSError:
+                self.errors += 1
+                continue
+            status = response[9:12]
+            payload = response.partition(b'\r\n\r\n')[2]
+            if status != b'200' or b'"errors"' in payload:
+                self.errors += 1
+                continue
+            self.timings.append((time.perf_counter() - started) * 1000)
+
+
+async def _run_level(port, token, requests, connections, slow):
+    clients = [Client(port, token, slow) for _ in range(connections)]
+    started = time.perf_counter()
+    await asyncio.gather(*(client.run(requests) for client in clients))
+    elapsed = time.perf_counter() - started
+    timings = [timing for client in clients for timing in client.timings]
+    result = _summary(timings, elapsed) if timings else {'requests': 0}
+    result['errors'] = sum(client.errors for client in clients)
+    return result
+
+
+class Command(BaseCommand):
+    help = ('ベンチマーク用のDBにデータを投入し、同じ/graphql/をWSGIとASGIのサーバーで起動して'
+            '同時接続数ごとのスループットとレイテンシをJSONで出力する')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--ideas', type=int, default=20000)
+        parser.add_argument('--comments', type=int, default=40000)
+        parser.add_argument('--likes', type=int, default=100000)
+        parser.add_argument('--notifications', type=int, default=40000)
+        parser.add_argument('--connections',
+                            default='8,64,256',
+                            help='同時接続数(カンマ区切り)')
+        parser.add_argument('--requests',
+                            type=int,
+                            default=1000,
+                            help='同時接続数ごとのリクエスト数')
+        parser.add_argument('--slow-client-ms',
+                            type=int,
+                            default=0,
+                            help='クライアントがヘッダから本文を送るまでの待ち時間')
+        parser.add_argument('--workers',
+                            type=int,
+                            default=8,
+                            help='ASGIのサーバーでGraphQLを実行するスレッド数')
+        parser.add_argument('--wsgi-workers',
+                            type=int,
+                            default=4,
+                            help='gunicornのsyncワーカーのプロセス数')
+        parser.add_argument('--servers',
+                            default=','.join(SERVERS),
+                            help='計測するサーバー(wsgi,asgi)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='レポートの出力先(省略時は標準出力)')
+        # サーバープロセスとして起動する時の引数(内部用)
+        parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+        parser.add_argument('--server', help=argparse.SUPPRESS)
+        parser.add_argument('--database-name', help=argparse.SUPPRESS)
+        parser.add_argument('--token', help=argparse.SUPPRESS)
+        parser.add_argument('--email', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['serve']:
+            return self._serve(options)
+
+        settings_dict = connection.settings_dict
+        tmpdir = None
+        if connection.vendor == 'sqlite':
+            # サーバープロセスからも開けるよう、ファイルのDBにする
+            tmpdir = tempfile.mkdtemp()
+            settings_dict['TEST']['NAME'] = os.path.join(
+                tmpdir, 'benchmark.sqlite3')
+        old_name = settings_dict['NAME']
+        database_name = connection.creation.create_test_db(verbosity=0,
+                                                           autoclobber=True,
+                                                           serialize=False)
+        try:
+            report = self._run(options, database_name)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            if tmpdir:
+                os.rmdir(tmpdir)
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stderr.write('report written to %s' % options['output'])
+        else:
+            self.stdout.write(output)
+
+    def _run(self, options, database_name):
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        ids = seed_dataset(rng,
+                           users=options['users'],
+                           ideas=options['ideas'],
+                           comments=options['comments'],
+                           likes=options['likes'],
+                           notifications=options['notifications'])
+        self.stderr.write('seeded in %.1fs' % (time.perf_counter() - started))
+
+        user = get_user_model().objects.get(id=ids['users'][0])
+        token = secrets.token_urlsafe()
+        levels = [int(n) for n in options['connections'].split(',')]
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'git_revision': _git_revision(),
+            'database': connection.vendor,
+            'options': {
+                key: options[key]
+                for key in ('users', 'ideas', 'comments', 'likes',
+                            'notifications', 'connections', 'requests',
+                            'slow_client_ms', 'workers', 'wsgi_workers',
+                            'seed')
+            },
+            'wsgi_server': _wsgi_server(),
+        }
+        for server in options['servers'].split(','):
+            report[server] = self._run_server(options, server, ids, token,
+                                              user.email, database_name,
+                                              levels)
+        return report
+
+    def _run_server(self, options, server, ids, token, email, database_name,
+                    levels):
+        port = _free_port()
+        env = dict(os.environ,
+                   GRAPHQL_ASYNC=str(server == 'asgi'),
+                   GRAPHQL_ASYNC_WORKERS=str(options['workers']),
+                   GRAPHQL_TRACING='False')
+        process = subprocess.Popen([
+            sys.executable,
+            os.path.join(settings.BASE_DIR, 'manage.py'), 'benchmark_asgi',
+            '--serve',
+            str(port), '--server', server, '--database-name', database_name,
+            '--token', token, '--email', email, '--wsgi-workers',
+            str(options['wsgi_workers'])
+        ],
+                                   env=env,
+                                   stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL)
+        try:
+            self._wait_for_server(process, port)
+            workload = Workload(random.Random(options['seed']), ids)
+            operations = [
+                OPERATIONS[i % len(OPERATIONS)]
+                for i in range(options['requests'])
+            ]
+            results = {}
+            # 最初の接続でスキーマやDBの接続を準備する
+            asyncio.run(
+                _run_level(port, token,
+                           [workload.request(op) for op in OPERATIONS], 1, 0))
+            for level in levels:
+                requests = [workload.request(op) for op in operations]
+                results[str(level)] = asyncio.run(
+                    _run_level(port, token, requests, level,
+                               options['slow_client_ms'] / 1000))
+                self.stderr.write('%s %d connections: %s' %
+                                  (server, level, results[str(level)]))
+            return results
+        finally:
+            process.terminate()
+            process.wait()
+
+    def _wait_for_server(self, process, port, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and process.poll() is None:
+            try:
+                socket.create_connection(('127.0.0.1', port), 0.5).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError('server did not start')
+
+    # ベンチマーク用のDBとトークンで、WSGIかASGIのサーバーを起動する
+    def _serve(self, options):
+        connection.close()
+        connection.settings_dict['NAME'] = options['database_name']
+        verified_tokens.set(options['token'], {
+            'email': options['email'],
+            'exp': time.time() + 24 * 3600
+        })
+        if options['server'] == 'asgi':
+            # Twistedのreactorより先にdaphneのasyncioのreactorを入れる
+            from daphne.endpoints import build_endpoint_description_strings
+            from daphne.server import Server
+
+            from project.asgi import application
+            Server(application,
+                   endpoints=build_endpoint_description_strings(
+                       host='127.0.0.1', port=options['serve']),
+                   verbosity=0).run()
+        elif _wsgi_server() == 'gunicorn':
+            from django.core.wsgi import get_wsgi_application
+            from gunicorn.app.base import BaseApplication
+
+            class Application(BaseApplication):
+                def load_config(self):
+                    self.cfg.set('bind', '127.0.0.1:%d' % options['serve'])
+                    self.cfg.set('workers', options['wsgi_workers'])
+                    self.cfg.set('worker_class', 'sync')
+
+                def load(self):
+                    return get_wsgi_application()
+
+            # トークンを入れたプロセスからワーカーをforkする
+            Application().run()
+        else:
+            from django.core.servers.basehttp import run
+            from django.core.wsgi import get_wsgi_application
+            run('127.0.0.1',
+                options['serve'],
+                get_wsgi_application(),
+                threading=True)
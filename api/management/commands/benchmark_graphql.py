@@ -0,0 +1,367 @@
+import argparse
+import functools
+import json
+import os
+import random
+import secrets
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.core.servers.basehttp import run
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from graphql_relay import to_global_id
+
+from api.seed import seed_dataset
+from api.validation import verified_tokens
+
+FEED_QUERY = '''
+query Feed {
+  allIdeas(first: 20) {
+    edges { node { id title likeCount createdAt
+      ideaCreator { id relatedUser { profileName } }
+      topics(first: 3) { edges { node { displayName } } } } }
+    pageInfo { endCursor hasNextPage }
+  }
+}'''
+IDEA_DETAIL_QUERY = '''
+query IdeaDetail($id: ID!) {
+  idea(id: $id) {
+    id title content likeCount
+    ideaCreator { id relatedUser { profileName } }
+    targetIdea(first: 1) { edges { node {
+      targetThread(first: 20) { edges { node { id content createdAt
+        commentor { id relatedUser { profileName } } } } } } } }
+  }
+}'''
+CREATE_LIKE_MUTATION = '''
+mutation CreateLike($ideaId: ID!) {
+  createLike(input: {likeTargetType: "Idea", likedIdeaId: $ideaId}) {
+    like { id isLiked }
+  }
+}'''
+UPDATE_LIKE_MUTATION = '''
+mutation UpdateLike($likeId: ID!) {
+  updateLike(input: {likeId: $likeId, isLiked: false}) { like { id isLiked } }
+}'''
+NOTIFICATIONS_QUERY = '''
+query Notifications {
+  myUnreadNotificationCount
+  allMyNotifications(first: 20, isChecked: false) {
+    edges { node { id notificationType notifiedItemType notifiedItemId
+      notificator { id relatedUser { profileName } } } }
+  }
+}'''
+
+OPERATIONS = ('feed', 'ideaDetail', 'likeToggle', 'notifications')
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def _summary(timings, elapsed, sql_counts=None):
+    result = {
+        'requests': len(timings),
+        'p50_ms': round(_percentile(timings, 0.5), 3),
+        'p95_ms': round(_percentile(timings, 0.95), 3),
+        'p99_ms': round(_percentile(timings, 0.99), 3),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'throughput_rps': round(len(timings) / elapsed, 1),
+    }
+    if sql_counts is not None:
+        result['sql_queries'] = round(statistics.mean(sql_counts), 2)
+    return result
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              capture_output=True,
+                              text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Workload:
+    """代表的な操作のリクエストを、同じ乱数の列から順に作る"""
+    def __init__(self, rng, ids):
+        self.rng = rng
+        self.idea_ids = ids['ideas']
+        self.like_ids = []
+
+    def request(self, operation):
+        if operation == 'feed':
+            return {'query': FEED_QUERY}
+        if operation == 'ideaDetail':
+            return {
+                'query': IDEA_DETAIL_QUERY,
+                'variables': {
+                    'id': to_global_id('IdeaNode',
+                                       self.rng.choice(self.idea_ids))
+                }
+            }
+        if operation == 'likeToggle':
+            # いいねといいねの取り消しを交互に行う
+            if self.like_ids:
+                return {
+                    'query': UPDATE_LIKE_MUTATION,
+                    'variables': {
+                        'likeId': self.like_ids.pop()
+                    }
+                }
+            return {
+                'query': CREATE_LIKE_MUTATION,
+                'variables': {
+                    'ideaId':
+                    to_global_id('IdeaNode', self.rng.choice(self.idea_ids))
+                }
+            }
+        return {'query': NOTIFICATIONS_QUERY}
+
+    def record(self, operation, data):
+        if operation == 'likeToggle':
+            like = ((data.get('data') or {}).get('createLike') or {}).get(
+                'like')
+            if like:
+                self.like_ids.append(like['id'])
+
+
+class Command(BaseCommand):
+    help = ('ベンチマーク用のDBにデータを投入し、代表的な操作を/graphql/に送って'
+            'レイテンシ・スループット・SQLの件数をJSONで出力する')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--ideas', type=int, default=20000)
+        parser.add_argument('--comments', type=int, default=40000)
+        parser.add_argument('--likes', type=int, default=100000)
+        parser.add_argument('--notifications', type=int, default=40000)
+        parser.add_argument('--requests',
+                            type=int,
+                            default=200,
+                            help='操作ごとのリクエスト数')
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--concurrency',
+                            type=int,
+                            default=8,
+                            help='サーバーに同時に送るリクエスト数')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='レポートの出力先(省略時は標準出力)')
+        parser.add_argument('--skip-server',
+                            action='store_true',
+                            help='サーバープロセスでの計測を省略する')
+        # サーバープロセスとして起動する時の引数(内部用)
+        parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+        parser.add_argument('--database-name', help=argparse.SUPPRESS)
+        parser.add_argument('--token', help=argparse.SUPPRESS)
+        parser.add_argument('--email', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['serve']:
+            return self._serve(options)
+
+        settings_dict = connection.settings_dict
+        tmpdir = None
+        if connection.vendor == 'sqlite':
+            # サーバープロセスからも開けるよう、ファイルのDBにする
+            tmpdir = tempfile.mkdtemp()
+            settings_dict['TEST']['NAME'] = os.path.join(
+                tmpdir, 'benchmark.sqlite3')
+        old_name = settings_dict['NAME']
+        database_name = connection.creation.create_test_db(verbosity=0,
+                                                           autoclobber=True,
+                                                           serialize=False)
+        try:
+            report = self._run(options, database_name)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            if tmpdir:
+                os.rmdir(tmpdir)
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stderr.write('report written to %s' % options['output'])
+        else:
+            self.stdout.write(output)
+
+    def _run(self, options, database_name):
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        ids = seed_dataset(rng,
+                           users=options['users'],
+                           ideas=options['ideas'],
+                           comments=options['comments'],
+                           likes=options['likes'],
+                           notifications=options['notifications'])
+        self.stderr.write('seeded in %.1fs' % (time.perf_counter() - started))
+
+        # 最もフォロー・通知の多いユーザーとして操作する
+        user = get_user_model().objects.get(id=ids['users'][0])
+        token = secrets.token_urlsafe()
+        verified_tokens.set(token, {
+            'email': user.email,
+            'exp': time.time() + 24 * 3600
+        })
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'git_revision': _git_revision(),
+            'database': connection.vendor,
+            'options': {
+                key: options[key]
+                for key in ('users', 'ideas', 'comments', 'likes',
+                            'notifications', 'requests', 'warmup',
+                            'concurrency', 'seed')
+            },
+            'test_client': self._run_test_client(options, ids, token),
+        }
+        if not options['skip_server']:
+            report['server'] = self._run_server(options, ids, token,
+                                                user.email, database_name)
+        return report
+
+    def _run_test_client(self, options, ids, token):
+        client = Client(HTTP_AUTHORIZATION='Bearer ' + token)
+        workload = Workload(random.Random(options['seed']), ids)
+        results = {}
+        for operation in OPERATIONS:
+            timings = []
+            sql_counts = []
+            elapsed = 0
+            for i in range(options['warmup'] + options['requests']):
+                body = json.dumps(workload.request(operation))
+                with CaptureQueriesContext(connection) as context:
+                    request_started = time.perf_counter()
+                    response = client.post('/graphql/',
+                                           body,
+                                           content_type='application/json')
+                    duration = time.perf_counter() - request_started
+                data = response.json()
+                if data.get('errors'):
+                    raise RuntimeError('%s: %s' % (operation, data['errors']))
+                workload.record(operation, data)
+                if i >= options['warmup']:
+                    timings.append(duration * 1000)
+                    sql_counts.append(len(context.captured_queries))
+                    elapsed += duration
+            results[operation] = _summary(timings, elapsed, sql_counts)
+            self.stderr.write('test client %s: %s' %
+                              (operation, results[operation]))
+        return results
+
+    def _run_server(self, options, ids, token, email, database_name):
+        port = _free_port()
+        process = subprocess.Popen([
+            sys.executable,
+            os.path.join(settings.BASE_DIR, 'manage.py'), 'benchmark_graphql',
+            '--serve',
+            str(port), '--database-name', database_name, '--token', token,
+            '--email', email
+        ],
+                                   stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL)
+        try:
+            url = 'http://127.0.0.1:%d/graphql/' % port
+            self._wait_for_server(process, port)
+            workload = Workload(random.Random(options['seed']), ids)
+            results = {}
+            for operation in OPERATIONS:
+                # いいねの取り消しには作成したいいねのidが要るので順に送る
+                if operation == 'likeToggle':
+                    concurrency = 1
+                else:
+                    concurrency = options['concurrency']
+                for _ in range(options['warmup']):
+                    workload.record(
+                        operation,
+                        self._post(url, token, workload.request(operation))[1])
+                started = time.perf_counter()
+                timings = []
+                if concurrency == 1:
+                    for _ in range(options['requests']):
+                        duration, data = self._post(
+                            url, token, workload.request(operation))
+                        workload.record(operation, data)
+                        timings.append(duration * 1000)
+                else:
+                    requests = [
+                        workload.request(operation)
+                        for _ in range(options['requests'])
+                    ]
+                    with ThreadPoolExecutor(concurrency) as executor:
+                        for duration, _ in executor.map(
+                                functools.partial(self._post, url, token),
+                                requests):
+                            timings.append(duration * 1000)
+                results[operation] = _summary(timings,
+                                              time.perf_counter() - started)
+                results[operation]['concurrency'] = concurrency
+                self.stderr.write('server %s: %s' %
+                                  (operation, results[operation]))
+            return results
+        finally:
+            process.terminate()
+            process.wait()
+
+    def _wait_for_server(self, process, port, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and process.poll() is None:
+            try:
+                socket.create_connection(('127.0.0.1', port), 0.5).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError('server did not start')
+
+    def _post(self, url, token, body):
+        request = urllib.request.Request(url,
+                                         data=json.dumps(body).encode(),
+                                         headers={
+                                             'Content-Type':
+                                             'application/json',
+                                             'Authorization':
+                                             'Bearer ' + token,
+                                         })
+        started = time.perf_counter()
+        with urllib.request.urlopen(request) as response:
+            data = json.loads(response.read())
+        duration = time.perf_counter() - started
+        if data.get('errors'):
+            raise RuntimeError(data['errors'])
+        return duration, data
+
+    # ベンチマーク用のDBとトークンで、スレッドで並行に処理するWSGIサーバーを起動する
+    def _serve(self, options):
+        connection.close()
+        connection.settings_dict['NAME'] = options['database_name']
+        verified_tokens.set(options['token'], {
+            'email': options['email'],
+            'exp': time.time() + 24 * 3600
+        })
+        run('127.0.0.1',
+            options['serve'],
+            get_wsgi_application(),
+            threading=True)
@@ -0,0 +1,98 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from api import jobs, notifications
+from api.counters import change_unread_notification_count
+from api.models import Follow, Idea, Notification
+
+
+class Command(BaseCommand):
+    help = ('フォロワーの多いユーザーがアイデアを公開した時の通知の書き込みを、'
+            'まとめて書き込む件数ごとと1件ずつ保存する場合とで計測する(データはロールバックする)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--followers', type=int, default=50000)
+        parser.add_argument('--batch-sizes',
+                            default='500,1000,5000',
+                            help='まとめて書き込む件数(カンマ区切り)')
+        parser.add_argument('--naive-sample',
+                            type=int,
+                            default=2000,
+                            help='1件ずつ保存する場合に計測する件数')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self._run(options)
+            transaction.set_rollback(True)
+
+    def _run(self, options):
+        User = get_user_model()
+        password = make_password(None)
+        started = time.perf_counter()
+        author = User.objects.create(email='notify-author@example.com',
+                                     username='notify-author',
+                                     password=password)
+        User.objects.bulk_create([
+            User(email='notify%d@example.com' % i,
+                 username='notify%d' % i,
+                 password=password) for i in range(options['followers'])
+        ],
+                                 batch_size=2000)
+        follower_ids = list(
+            User.objects.filter(email__startswith='notify').exclude(
+                id=author.id).values_list('id', flat=True))
+        Follow.objects.bulk_create([
+            Follow(following_user_id=follower_id, followed_user=author)
+            for follower_id in follower_ids
+        ],
+                                   batch_size=5000)
+        self.stdout.write('created %d followers in %.1fs' %
+                          (len(follower_ids), time.perf_counter() - started))
+
+        def publish(title):
+            return Idea.objects.create(idea_creator=author,
+                                       title=title,
+                                       content='content',
+                                       is_published=True)
+
+        # リクエストで行うのはジョブの追加だけになる
+        idea = publish('enqueue')
+        started = time.perf_counter()
+        jobs.enqueue('notify_followers', {'idea_id': idea.id},
+                     key='notify_followers:%d' % idea.id)
+        self.stdout.write('enqueue in request: %.2fms' %
+                          ((time.perf_counter() - started) * 1000))
+
+        for batch_size in [int(n) for n in options['batch_sizes'].split(',')]:
+            idea = publish('batch %d' % batch_size)
+            started = time.perf_counter()
+            with CaptureQueriesContext(connection) as queries:
+                written = notifications.notify_followers(idea, batch_size)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                'batch_size=%-5d %d notifications in %.2fs '
+                '(%.0f/s, %d queries)' % (batch_size, written, elapsed,
+                                          written / elapsed, len(queries)))
+
+        # 以前のように1件ずつ保存して未読数を増やす場合
+        idea = publish('naive')
+        sample = follower_ids[:options['naive_sample']]
+        started = time.perf_counter()
+        for follower_id in sample:
+            Notification(notificator=author,
+                         notification_reciever_id=follower_id,
+                         notification_type='Idea',
+                         notified_item_type='Idea',
+                         notified_item_id=idea.id).save()
+            change_unread_notification_count(follower_id, 1)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            'one at a time: %d notifications in %.2fs (%.0f/s, '
+            'estimated %.1fs for %d followers)' %
+            (len(sample), elapsed, len(sample) / elapsed, elapsed /
+             len(sample) * len(follower_ids), len(follower_ids)))
@@ -0,0 +1,108 @@
+import itertools
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api import search
+from api.models import Idea, Memo
+
+WORDS = [
+    'アイデア', '共有', 'アプリ', '料理', 'レシピ', '旅行', '写真', '音楽', '学習', '機械学習',
+    'プログラミング', 'Python', 'デザイン', '健康', '運動', '読書', '映画', '地図', '天気',
+    '家計簿', '日記', 'ゲーム', '子育て', '農業', '翻訳', '配達', '通知', '予約', '在庫',
+    'チャット', 'カレンダー', '睡眠', '猫', '犬', '植物', 'マッチング', 'ボランティア'
+]
+QUERIES = ['アイデア', '機械学習', '料理 レシピ', 'python', '猫', '在庫 通知', '睡眠']
+KANA = 'アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモヤユヨラリルレロワン'
+# 実際の投稿に近づけるため、語彙を増やしてZipf分布で出現させる
+VOCABULARY_SIZE = 20000
+
+
+def _vocabulary(rng):
+    words = list(WORDS)
+    while len(words) < VOCABULARY_SIZE:
+        words.append(''.join(
+            rng.choice(KANA) for _ in range(rng.randint(2, 5))))
+    rng.shuffle(words)
+    cum_weights = list(
+        itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    return words, cum_weights
+
+
+def _sentence(rng, vocabulary, n_words):
+    words = rng.choices(vocabulary[0], cum_weights=vocabulary[1], k=n_words)
+    return ''.join(word + rng.choice(['', 'の', 'を', 'で', '、'])
+                   for word in words)
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class Command(BaseCommand):
+    help = '合成データを投入して全文検索と部分一致検索のレイテンシを比較する(データはロールバックする)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ideas', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--skip-icontains',
+                            action='store_true',
+                            help='比較用のicontainsによる検索を省略する')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            self._run(rng, options)
+            transaction.set_rollback(True)
+
+    def _run(self, rng, options):
+        user = get_user_model().objects.create(email='benchmark@example.com',
+                                               username='benchmark')
+        vocabulary = _vocabulary(rng)
+        started = time.perf_counter()
+        batch = []
+        for i in range(options['ideas']):
+            batch.append(
+                Idea(idea_creator=user,
+                     title=_sentence(rng, vocabulary, 3)[:30],
+                     content=_sentence(rng, vocabulary,
+                                       rng.randint(20, 200))[:3000],
+                     is_published=True))
+            if len(batch) >= options['batch_size']:
+                Idea.objects.bulk_create(batch)
+                batch = []
+        Idea.objects.bulk_create(batch)
+        self.stdout.write('inserted %d ideas in %.1fs' %
+                          (options['ideas'], time.perf_counter() - started))
+
+        started = time.perf_counter()
+        search.rebuild_index(Idea, Memo)
+        self.stdout.write('built index in %.1fs' %
+                          (time.perf_counter() - started))
+
+        for query in QUERIES:
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                ids = search.search_idea_ids(query, limit=21)
+                list(Idea.objects.in_bulk(ids))
+                timings.append((time.perf_counter() - started) * 1000)
+            line = '%-12s search p50=%.2fms p95=%.2fms' % (
+                query, statistics.median(timings), _percentile(timings, 0.95))
+
+            if not options['skip_icontains']:
+                started = time.perf_counter()
+                ideas = Idea.objects.filter(is_published=True)
+                for term in query.split():
+                    ideas = ideas.filter(content__icontains=term)
+                list(ideas.order_by('-created_at')[:21])
+                line += ' icontains=%.2fms' % (
+                    (time.perf_counter() - started) * 1000)
+            self.stdout.write(line)
@@ -0,0 +1,162 @@
+import itertools
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+
+from api import timeline
+from api.models import Follow, Idea
+
+FOLLOWER_BUCKETS = (100, 1000, 10000)
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def _bucket(followers):
+    for limit in FOLLOWER_BUCKETS:
+        if followers < limit:
+            return '<%d' % limit
+    return '>=%d' % FOLLOWER_BUCKETS[-1]
+
+
+class Command(BaseCommand):
+    help = ('フォロワー数が偏ったデータでタイムラインへの書き込みと読み込みを計測する'
+            '(データはロールバックする)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20000)
+        parser.add_argument('--followings',
+                            type=int,
+                            default=50,
+                            help='1ユーザーあたりの平均フォロー数')
+        parser.add_argument('--ideas', type=int, default=2000)
+        parser.add_argument('--max-followers',
+                            type=int,
+                            default=5000,
+                            help='これを超えるユーザーは読み込み時に取得する')
+        parser.add_argument('--readers', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with override_settings(
+                TIMELINE_FANOUT_MAX_FOLLOWERS=options['max_followers']):
+            with transaction.atomic():
+                self._run(rng, options)
+                transaction.set_rollback(True)
+
+    def _run(self, rng, options):
+        User = get_user_model()
+        password = make_password(None)
+        users = User.objects.bulk_create([
+            User(email='timeline%d@example.com' % i,
+                 username='timeline%d' % i,
+                 password=password) for i in range(options['users'])
+        ],
+                                         batch_size=2000)
+        user_ids = [user.id for user in users]
+        if not user_ids[0]:
+            user_ids = list(
+                User.objects.filter(
+                    email__startswith='timeline').order_by('id').values_list(
+                        'id', flat=True))
+
+        # Zipf分布でフォロー先を選び、一部のユーザーにフォロワーを集中させる
+        cum_weights = list(
+            itertools.accumulate(1 / (rank + 1)
+                                 for rank in range(len(user_ids))))
+        started = time.perf_counter()
+        follows = []
+        for follower_id in user_ids:
+            followed = set(
+                rng.choices(user_ids,
+                            cum_weights=cum_weights,
+                            k=rng.randint(1, options['followings'] * 2)))
+            followed.discard(follower_id)
+            follows.extend(
+                Follow(following_user_id=follower_id, followed_user_id=id)
+                for id in followed)
+        Follow.objects.bulk_create(follows, batch_size=5000)
+        followers = {}
+        for follow in follows:
+            followers[follow.followed_user_id] = followers.get(
+                follow.followed_user_id, 0) + 1
+        self.stdout.write(
+            'created %d users, %d follows in %.1fs (max followers %d)' %
+            (len(user_ids), len(follows), time.perf_counter() - started,
+             max(followers.values())))
+
+        fanout = {}
+        started = time.perf_counter()
+        for i in range(options['ideas']):
+            author_id = rng.choices(user_ids, cum_weights=cum_weights)[0]
+            idea = Idea.objects.create(idea_creator_id=author_id,
+                                       title='idea %d' % i,
+                                       content='content',
+                                       is_published=True)
+            idea_started = time.perf_counter()
+            timeline.fan_out_idea(idea)
+            fanout.setdefault(_bucket(followers.get(author_id, 0)), []).append(
+                (time.perf_counter() - idea_started) * 1000)
+        self.stdout.write('published %d ideas in %.1fs' %
+                          (options['ideas'], time.perf_counter() - started))
+        for bucket, timings in sorted(fanout.items()):
+            self.stdout.write(
+                '  fan-out followers %-7s n=%-5d p50=%.2fms p95=%.2fms '
+                'max=%.2fms' %
+                (bucket, len(timings), statistics.median(timings),
+                 _percentile(timings, 0.95), max(timings)))
+
+        # フォロー数の多いユーザーから順に読み込みを計測する
+        following_counts = {}
+        for follow in follows:
+            following_counts[follow.following_user_id] = following_counts.get(
+                follow.following_user_id, 0) + 1
+        readers = sorted(following_counts,
+                         key=following_counts.get,
+                         reverse=True)[:options['readers']]
+        # 1ページ目と、1ページ目の最後をカーソルにした2ページ目をそれぞれ計測する
+        timings = {'myTimeline': ([], []), 'Follow JOIN Idea': ([], [])}
+        for reader_id in readers:
+            pages = timings['myTimeline']
+            started = time.perf_counter()
+            ideas = timeline.get_timeline(reader_id, 21)
+            pages[0].append((time.perf_counter() - started) * 1000)
+            if len(ideas) == 21:
+                started = time.perf_counter()
+                timeline.get_timeline(reader_id, 21,
+                                      (ideas[-1].created_at, ideas[-1].id))
+                pages[1].append((time.perf_counter() - started) * 1000)
+
+            pages = timings['Follow JOIN Idea']
+            joined = Idea.objects.filter(
+                is_published=True,
+                idea_creator__followed_user__following_user_id=reader_id,
+                idea_creator__followed_user__is_following=True).order_by(
+                    '-created_at', '-id')
+            started = time.perf_counter()
+            ideas = list(joined[:21])
+            pages[0].append((time.perf_counter() - started) * 1000)
+            if len(ideas) == 21:
+                started = time.perf_counter()
+                list(
+                    joined.filter(
+                        timeline._keyset((ideas[-1].created_at, ideas[-1].id),
+                                         'created_at', 'id'))[:21])
+                pages[1].append((time.perf_counter() - started) * 1000)
+        for name, (first_page, second_page) in timings.items():
+            second_page = second_page or [0]
+            self.stdout.write(
+                '%-16s page 1 p50=%.2fms p95=%.2fms / '
+                'page 2 p50=%.2fms p95=%.2fms' %
+                (name, statistics.median(first_page),
+                 _percentile(first_page, 0.95), statistics.median(second_page),
+                 _percentile(second_page, 0.95)))
@@ -0,0 +1,135 @@
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count, Q
+
+from api import trending
+from api.models import Comment, Idea, Like, TrendingEvent
+from api.seed import Seeder
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+class Command(BaseCommand):
+    help = ('ベンチマーク用のDBにいいね・コメントを投入し、話題度の全体の作成と'
+            '差分の集計、trendingIdeasの取得を計測する')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20000)
+        parser.add_argument('--ideas', type=int, default=100000)
+        parser.add_argument('--comments', type=int, default=100000)
+        parser.add_argument('--likes', type=int, default=1000000)
+        parser.add_argument('--new-likes',
+                            type=int,
+                            default=10000,
+                            help='差分の集計の前に追加するいいね数')
+        parser.add_argument('--new-comments', type=int, default=2000)
+        parser.add_argument('--rounds',
+                            type=int,
+                            default=5,
+                            help='差分の集計を繰り返す回数')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        settings_dict = connection.settings_dict
+        tmpdir = None
+        if connection.vendor == 'sqlite':
+            # 実際の運用に近づけるため、メモリ上ではなくファイルのDBにする
+            tmpdir = tempfile.mkdtemp()
+            settings_dict['TEST']['NAME'] = os.path.join(
+                tmpdir, 'benchmark.sqlite3')
+        old_name = settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0,
+                                           autoclobber=True,
+                                           serialize=False)
+        try:
+            self._run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            if tmpdir:
+                os.rmdir(tmpdir)
+
+    def _run(self, options):
+        seeder = Seeder(random.Random(options['seed']), batch_size=5000)
+        started = time.perf_counter()
+        seeder.users(options['users'])
+        seeder.ideas(options['ideas'])
+        seeder.comments(options['comments'])
+        seeder.likes(options['likes'])
+        self.stdout.write('seeded in %.1fs' % (time.perf_counter() - started))
+
+        started = time.perf_counter()
+        counts = trending.refresh(options['batch_size'])
+        self.stdout.write('full build: %s in %.2fs' %
+                          (counts, time.perf_counter() - started))
+
+        def last_id(model):
+            return model.objects.order_by('-id').values_list(
+                'id', flat=True).first() or 0
+
+        def add_likes_and_comments(likes, comments):
+            # 一括作成した行はミューテーションやシグナルを通らないので、増減の記録も作る
+            last_like_id = last_id(Like)
+            last_comment_id = last_id(Comment)
+            seeder.likes(likes)
+            seeder.comments(comments)
+            events = [
+                TrendingEvent(idea_id=idea_id,
+                              kind='Like',
+                              delta=1,
+                              occurred_at=liked_at)
+                for idea_id, liked_at in Like.objects.filter(
+                    id__gt=last_like_id,
+                    liked_idea__isnull=False).values_list(
+                        'liked_idea_id', 'liked_at')
+            ]
+            events += [
+                TrendingEvent(idea_id=idea_id,
+                              kind='Comment',
+                              delta=1,
+                              occurred_at=created_at)
+                for idea_id, created_at in Comment.objects.filter(
+                    id__gt=last_comment_id,
+                    target_thread__target_idea__isnull=False).values_list(
+                        'target_thread__target_idea_id', 'created_at')
+            ]
+            TrendingEvent.objects.bulk_create(events, batch_size=5000)
+
+        durations = []
+        for _ in range(options['rounds']):
+            add_likes_and_comments(options['new_likes'],
+                                   options['new_comments'])
+            started = time.perf_counter()
+            counts = trending.refresh(options['batch_size'])
+            durations.append(time.perf_counter() - started)
+            self.stdout.write('incremental: %s in %.3fs' %
+                              (counts, durations[-1]))
+        self.stdout.write('incremental mean: %.3fs' %
+                          statistics.mean(durations))
+
+        def timing(function, repeat=20):
+            function()
+            started = time.perf_counter()
+            for _ in range(repeat):
+                function()
+            return _ms((time.perf_counter() - started) / repeat)
+
+        # スコアの表を使わずに、リクエストごとにいいねを集計する場合と比べる
+        aggregate = Idea.objects.filter(is_published=True).annotate(
+            n=Count('liked_idea', filter=Q(
+                liked_idea__is_liked=True))).order_by('-n', '-id')
+        self.stdout.write('trendingIdeas first page: %sms' %
+                          timing(lambda: trending.get_trending(21)))
+        last = trending.get_trending(21)[-1]
+        self.stdout.write('trendingIdeas second page: %sms' % timing(
+            lambda: trending.get_trending(21, [last.score, last.idea_id])))
+        self.stdout.write('aggregate likes per request: %sms' %
+                          timing(lambda: list(aggregate[:21]), repeat=1))
@@ -0,0 +1,288 @@
+import asyncio
+import json
+import os
+import secrets
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from graphql_relay import to_global_id
+
+from api.management.commands.benchmark_asgi import SERVERS, _wsgi_server
+from api.management.commands.benchmark_graphql import (_free_port,
+                                                       _git_revision,
+                                                       _summary)
+from api.models import Profile
+
+UPDATE_PROFILE_MUTATION = '''
+mutation UpdateProfile($profileId: ID!, $image: Upload) {
+  updateProfile(input: {profileId: $profileId, profileImage: $image}) {
+    profile { id profileImage }
+  }
+}'''
+BOUNDARY = 'benchmarkboundary'
+CHUNK_SIZE = 64 * 1024
+MB = 1000 * 1000
+
+
+def _multipart(profile_id, size):
+    operations = json.dumps({
+        'query': UPDATE_PROFILE_MUTATION,
+        'variables': {
+            'profileId': profile_id,
+            'image': None
+        }
+    })
+    head = ('--{b}\r\n'
+            'Content-Disposition: form-data; name="operations"\r\n\r\n'
+            '{operations}\r\n'
+            '--{b}\r\n'
+            'Content-Disposition: form-data; name="map"\r\n\r\n'
+            '{{"0": ["variables.image"]}}\r\n'
+            '--{b}\r\n'
+            'Content-Disposition: form-data; name="0"; '
+            'filename="image.jpg"\r\n'
+            'Content-Type: image/jpeg\r\n\r\n').format(b=BOUNDARY,
+                                                       operations=operations)
+    return head.encode(), ('\r\n--%s--\r\n' % BOUNDARY).encode()
+
+
+def _headers(token, content_length):
+    return ('POST /graphql/ HTTP/1.1\r\n'
+            'Host: 127.0.0.1\r\n'
+            'Content-Type: multipart/form-data; boundary=%s\r\n'
+            'Authorization: Bearer %s\r\n'
+            'Content-Length: %d\r\n'
+            'Connection: close\r\n\r\n' %
+            (BOUNDARY, token, content_length)).encode()
+
+
+def _body_chunks(head, tail, size):
+    yield head
+    chunk = os.urandom(CHUNK_SIZE)
+    sent = 0
+    while sent < size:
+        yield chunk[:size - sent]
+        sent += len(chunk)
+    yield tail
+
+
+async def _upload(port, token, head, tail, size):
+    """
+    本文をチャンクごとに送り、レスポンスのステータスと
+    レスポンスを受け取るまでに送れた本文のバイト数を返す
+    """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(_headers(token, len(head) + size + len(tail)))
+    response = asyncio.ensure_future(reader.read())
+    sent = 0
+    try:
+        for chunk in _body_chunks(head, tail, size):
+            if response.done():
+                break
+            writer.write(chunk)
+            await writer.drain()
+            sent += len(chunk)
+    except OSError:
+        # サーバーが本文を読まずに接続を閉じた
+        pass
+    try:
+        data = await asyncio.wait_for(response, 60)
+    except (OSError, asyncio.TimeoutError):
+        data = b''
+    writer.close()
+    return data[9:12].decode() or None, sent
+
+
+def _rss_kb(pid, field):
+    # プロセスとその子プロセス(gunicornのワーカー)のメモリ使用量の合計
+    total = 0
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    total += int(line.split()[1])
+        with open('/proc/%d/task/%d/children' % (pid, pid)) as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        return None
+    for child in children:
+        total += _rss_kb(child, field) or 0
+    return total
+
+
+async def _sample_peak(pid, stop, interval=0.02):
+    peak = 0
+    while not stop.is_set():
+        peak = max(peak, _rss_kb(pid, 'VmRSS') or 0)
+        await asyncio.sleep(interval)
+    return peak
+
+
+async def _run_concurrent(port, token, head, tail, size, count, pid):
+    stop = asyncio.Event()
+    sampler = asyncio.ensure_future(_sample_peak(pid, stop))
+    started = time.perf_counter()
+
+    async def timed():
+        begin = time.perf_counter()
+        status, sent = await _upload(port, token, head, tail, size)
+        return status, (time.perf_counter() - begin) * 1000
+
+    results = await asyncio.gather(*(timed() for _ in range(count)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    peak = await sampler
+    timings = [timing for status, timing in results if status == '200']
+    result = _summary(timings, elapsed) if timings else {'requests': 0}
+    result['errors'] = sum(status != '200' for status, _ in results)
+    result['peak_rss_mb'] = round(peak / 1024, 1)
+    return result
+
+
+class Command(BaseCommand):
+    help = ('WSGIとASGIのサーバーに大きなファイルを同時にアップロードし、'
+            'サーバーのメモリ使用量と上限を超えるアップロードを拒否するまでの時間をJSONで出力する')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb',
+                            type=int,
+                            default=20,
+                            help='アップロードするファイルの大きさ')
+        parser.add_argument('--concurrency',
+                            default='1,8,32',
+                            help='同時にアップロードする数(カンマ区切り)')
+        parser.add_argument('--oversize-mb',
+                            type=int,
+                            default=200,
+                            help='リクエスト全体の上限を超えるアップロードの大きさ')
+        parser.add_argument('--oversize-file-mb',
+                            type=int,
+                            default=22,
+                            help='ファイルの上限だけを超えるアップロードの大きさ')
+        parser.add_argument('--servers',
+                            default=','.join(SERVERS),
+                            help='計測するサーバー(wsgi,asgi)')
+        parser.add_argument('--wsgi-workers', type=int, default=4)
+        parser.add_argument('--output', help='レポートの出力先(省略時は標準出力)')
+
+    def handle(self, *args, **options):
+        settings_dict = connection.settings_dict
+        tmpdir = tempfile.mkdtemp()
+        if connection.vendor == 'sqlite':
+            # サーバープロセスからも開けるよう、ファイルのDBにする
+            settings_dict['TEST']['NAME'] = os.path.join(
+                tmpdir, 'benchmark.sqlite3')
+        old_name = settings_dict['NAME']
+        database_name = connection.creation.create_test_db(verbosity=0,
+                                                           autoclobber=True,
+                                                           serialize=False)
+        try:
+            report = self._run(options, database_name, tmpdir)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stderr.write('report written to %s' % options['output'])
+        else:
+            self.stdout.write(output)
+
+    def _run(self, options, database_name, tmpdir):
+        user = get_user_model().objects.create_user(
+            email='benchmark@example.com',
+            username='benchmark',
+            password=secrets.token_urlsafe())
+        profile = Profile.objects.create(related_user=user,
+                                         profile_name='benchmark')
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'git_revision': _git_revision(),
+            'options': {
+                key: options[key]
+                for key in ('size_mb', 'concurrency', 'oversize_mb',
+                            'oversize_file_mb', 'wsgi_workers')
+            },
+            'limits': {
+                'max_file_size': settings.GRAPHQL_UPLOAD_MAX_FILE_SIZE,
+                'max_request_size': settings.GRAPHQL_UPLOAD_MAX_REQUEST_SIZE,
+            },
+            'wsgi_server': _wsgi_server(),
+        }
+        for server in options['servers'].split(','):
+            report[server] = self._run_server(
+                options, server, to_global_id('ProfileNode', profile.id),
+                user.email, database_name, os.path.join(tmpdir, server))
+        return report
+
+    def _run_server(self, options, server, profile_id, email, database_name,
+                    media_root):
+        port = _free_port()
+        token = secrets.token_urlsafe()
+        env = dict(os.environ,
+                   GRAPHQL_ASYNC=str(server == 'asgi'),
+                   GRAPHQL_TRACING='False',
+                   MEDIA_ROOT=media_root)
+        process = subprocess.Popen([
+            sys.executable,
+            os.path.join(settings.BASE_DIR, 'manage.py'), 'benchmark_asgi',
+            '--serve',
+            str(port), '--server', server, '--database-name', database_name,
+            '--token', token, '--email', email, '--wsgi-workers',
+            str(options['wsgi_workers'])
+        ],
+                                   env=env,
+                                   stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL)
+        head, tail = _multipart(profile_id, options['size_mb'] * MB)
+        try:
+            self._wait_for_server(port, process)
+            # 最初のリクエストでスキーマやDBの接続を準備する
+            asyncio.run(_upload(port, token, head, tail, 1024))
+            results = {'idle_rss_mb': round(
+                (_rss_kb(process.pid, 'VmRSS') or 0) / 1024, 1)}
+            for count in [int(n) for n in options['concurrency'].split(',')]:
+                results[str(count)] = asyncio.run(
+                    _run_concurrent(port, token, head, tail,
+                                    options['size_mb'] * MB, count,
+                                    process.pid))
+                self.stderr.write('%s %d uploads: %s' %
+                                  (server, count, results[str(count)]))
+
+            # Content-Lengthで拒否される場合と、ファイルを読み込み中に拒否される場合
+            for name in ('oversize', 'oversize_file'):
+                started = time.perf_counter()
+                status, sent = asyncio.run(
+                    _upload(port, token, head, tail,
+                            options[name + '_mb'] * MB))
+                results[name] = {
+                    'status': status,
+                    'sent_mb': round(sent / MB, 2),
+                    'ms': round((time.perf_counter() - started) * 1000, 1),
+                }
+                self.stderr.write('%s %s: %s' % (server, name, results[name]))
+            return results
+        finally:
+            process.terminate()
+            process.wait()
+
+    def _wait_for_server(self, port, process, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and process.poll() is None:
+            try:
+                socket.create_connection(('127.0.0.1', port), 0.5).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError('server did not start')
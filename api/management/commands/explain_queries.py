@@ -0,0 +1,109 @@
+import secrets
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from graphql_relay import to_global_id
+
+from api.models import Idea, Memo, Topic
+from api.validation import verified_tokens
+from project.schema import schema
+
+# Queryの各フィールドを実際に解決するときのオペレーション
+FIELD_QUERIES = {
+    'user': 'query($userId: ID!) { user(id: $userId) { id } }',
+    'allUsers': '{ allUsers(first: 20) { edges { node { id } } } }',
+    'myUserInfo': '{ myUserInfo { id } }',
+    'allProfiles': '{ allProfiles(first: 20) { edges { node { id } } } }',
+    'myFollowings': '{ myFollowings(first: 20, isFollowing: true) '
+    '{ edges { node { id } } } }',
+    'topic': 'query($topicName: String!) '
+    '{ topic(topicName: $topicName) { id } }',
+    'allTopics': '{ allTopics(first: 20) { edges { node { id } } } }',
+    'ideasByTopic': 'query($topicName: String!) '
+    '{ ideasByTopic(topicName: $topicName, first: 20) '
+    '{ edges { node { id } } } }',
+    'myLikeIdeas': '{ myLikeIdeas(first: 20) { edges { node { id } } } }',
+    'myLikeMemos': '{ myLikeMemos(first: 20) { edges { node { id } } } }',
+    'idea': 'query($ideaId: ID!) { idea(id: $ideaId) { id } }',
+    'allIdeas': '{ allIdeas(first: 20) { edges { node { id } } } }',
+    'myAllIdeas': '{ myAllIdeas(first: 20) { edges { node { id } } } }',
+    'searchIdeas': '{ searchIdeas(query: "アイデア", first: 20) '
+    '{ edges { node { id } } } }',
+    'memo': 'query($memoId: ID!) { memo(id: $memoId) { id } }',
+    'allMemos': '{ allMemos(first: 20) { edges { node { id } } } }',
+    'myAllMemos': '{ myAllMemos(first: 20) { edges { node { id } } } }',
+    'searchMemos': '{ searchMemos(query: "アイデア", first: 20) '
+    '{ edges { node { id } } } }',
+    'allMyNotifications': '{ allMyNotifications(first: 20, isChecked: false) '
+    '{ edges { node { id } } } }',
+    'myTimeline': '{ myTimeline(first: 20) { edges { node { id } } } }',
+    'trendingIdeas': '{ trendingIdeas(first: 20) { edges { node { id } } } }',
+    'allAnnounce': '{ allAnnounce(first: 20) { edges { node { id } } } }',
+}
+
+
+class Command(BaseCommand):
+    help = ('Queryの各リゾルバが発行するSQLのEXPLAINを表示する'
+            '(マイグレーションの前後で実行して比較する)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--email', help='my系のフィールドを解決するユーザー')
+        parser.add_argument('--field',
+                            action='append',
+                            choices=sorted(FIELD_QUERIES),
+                            help='対象のフィールド(省略時はすべて)')
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by('id')
+        if options['email']:
+            users = users.filter(email=options['email'])
+        user = users.first()
+        if user is None:
+            raise CommandError('user not found')
+
+        # このプロセス内でだけ有効なトークンで認証済みのリクエストを作る
+        token = secrets.token_urlsafe()
+        verified_tokens.set(token, {
+            'email': user.email,
+            'exp': time.time() + 3600
+        })
+        idea = Idea.objects.order_by('id').first()
+        memo = Memo.objects.order_by('id').first()
+        topic = Topic.objects.order_by('id').first()
+        variables = {
+            'userId': to_global_id('UserNode', user.id),
+            'ideaId': to_global_id('IdeaNode', idea.id if idea else 0),
+            'memoId': to_global_id('MemoNode', memo.id if memo else 0),
+            'topicName': topic.name if topic else '',
+        }
+
+        for field in options['field'] or FIELD_QUERIES:
+            request = RequestFactory().post(
+                '/graphql/', HTTP_AUTHORIZATION='Bearer ' + token)
+            request.user = AnonymousUser()
+            with CaptureQueriesContext(connection) as context:
+                schema.execute(FIELD_QUERIES[field],
+                               variable_values=variables,
+                               context_value=request)
+            self.stdout.write(self.style.MIGRATE_HEADING(field))
+            for query in context.captured_queries:
+                self.stdout.write('  ' + query['sql'])
+                for line in self._explain(query['sql']):
+                    self.stdout.write('    ' + line)
+
+    def _explain(self, sql):
+        if connection.vendor == 'sqlite':
+            prefix = 'EXPLAIN QUERY PLAN '
+        else:
+            prefix = 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql)
+            return [
+                ' '.join(str(column) for column in row)
+                for row in cursor.fetchall()
+            ]
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api import jobs
+
+
+def _ms(value):
+    return '-' if value is None else '%.1fms' % value
+
+
+class Command(BaseCommand):
+    help = 'ジョブの名前・状態ごとの件数と実行時間、待機中のジョブの待ち時間を表示する'
+
+    def handle(self, *args, **options):
+        for row in jobs.stats():
+            line = (f"{row['name']} {row['status']}: {row['count']} jobs, "
+                    f"avg {_ms(row['avg_ms'])}, max {_ms(row['max_ms'])}, "
+                    f"avg attempts {row['avg_attempts']:.2f}")
+            if row['lag_seconds'] is not None:
+                line += f", oldest waiting {row['lag_seconds']:.1f}s"
+            self.stdout.write(line)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.counters import RECONCILERS
+
+
+class Command(BaseCommand):
+    help = '非正規化したカウンタを実際の行数から再計算して補正する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--counter',
+                            action='append',
+                            choices=sorted(RECONCILERS),
+                            help='補正するカウンタ(省略時はすべて)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        counters = options['counter'] or sorted(RECONCILERS)
+        for counter in counters:
+            fixed = RECONCILERS[counter](options['batch_size'])
+            self.stdout.write(f'{counter}: {fixed} rows fixed')
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import trending
+
+
+class Command(BaseCommand):
+    help = '前回の集計以降のアイデア・いいね・コメントをアイデアの話題度に加える'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--rebuild',
+                            action='store_true',
+                            help='スコアを消してすべての行から作り直す')
+        parser.add_argument('--interval',
+                            type=int,
+                            help='指定した秒数ごとに繰り返す(省略時は1回だけ)')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            trending.reset()
+        while True:
+            started = time.perf_counter()
+            counts = trending.refresh(options['batch_size'])
+            self.stdout.write(
+                f"ideas: {counts['ideas']}, likes: {counts['likes']}, "
+                f"comments: {counts['comments']} "
+                f'({time.perf_counter() - started:.2f}s)')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,75 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from graphql import parse
+from graphql.error import GraphQLSyntaxError
+from graphql.language import ast
+from graphql.validation import validate
+
+from api.models import PersistedQuery
+from api.persisted import clear_persisted_queries, query_hash
+from project.schema import schema
+
+
+def _load_manifest(path):
+    with open(path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    # Apolloのマニフェスト({"operations": [{"id", "body", "name"}]})と
+    # ハッシュからクエリへの対応({"<sha256>": "query ..."})を受け付ける
+    if isinstance(manifest, dict) and 'operations' in manifest:
+        return [(operation.get('id'), operation['body'])
+                for operation in manifest['operations']]
+    if isinstance(manifest, dict):
+        return list(manifest.items())
+    raise CommandError('unsupported manifest format')
+
+
+def _operation_name(document_ast):
+    for definition in document_ast.definitions:
+        if isinstance(definition, ast.OperationDefinition) and definition.name:
+            return definition.name.value
+    return ''
+
+
+class Command(BaseCommand):
+    help = 'フロントエンドのクエリのマニフェストを登録済みクエリとして保存する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('manifest', help='マニフェストのJSONファイル')
+        parser.add_argument('--prune',
+                            action='store_true',
+                            help='マニフェストに無い登録済みクエリを削除する')
+
+    def handle(self, *args, **options):
+        queries = []
+        for sha256_hash, query in _load_manifest(options['manifest']):
+            if sha256_hash and sha256_hash != query_hash(query):
+                raise CommandError(
+                    '%s does not match the sha256 of its query' % sha256_hash)
+            try:
+                document_ast = parse(query)
+            except GraphQLSyntaxError as e:
+                raise CommandError('%s: %s' % (sha256_hash, e))
+            errors = validate(schema, document_ast)
+            if errors:
+                raise CommandError('%s: %s' % (sha256_hash, errors[0].message))
+            queries.append(
+                PersistedQuery(sha256_hash=query_hash(query),
+                               query=query,
+                               operation_name=_operation_name(document_ast)))
+
+        with transaction.atomic():
+            existing = set(
+                PersistedQuery.objects.values_list('sha256_hash', flat=True))
+            created = [q for q in queries if q.sha256_hash not in existing]
+            PersistedQuery.objects.bulk_create(created)
+            pruned = 0
+            if options['prune']:
+                pruned, _ = PersistedQuery.objects.exclude(sha256_hash__in=[
+                    q.sha256_hash for q in queries
+                ]).delete()
+        # 他のプロセスにはGRAPHQL_PERSISTED_QUERY_CACHE_TIMEOUTの秒数のうちに反映される
+        clear_persisted_queries()
+        self.stdout.write(f'{len(queries)} queries registered '
+                          f'({len(created)} new, {pruned} pruned)')
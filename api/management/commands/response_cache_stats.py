@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api import response_cache
+
+
+class Command(BaseCommand):
+    help = '未ログインのクエリのレスポンスキャッシュのヒット数・ミス数を表示する'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='表示した後に0に戻す')
+
+    def handle(self, *args, **options):
+        stats = response_cache.stats()
+        total = stats['hits'] + stats['misses']
+        ratio = stats['hits'] / total if total else 0
+        self.stdout.write(f"hits: {stats['hits']}, misses: {stats['misses']}, "
+                          f'hit ratio: {ratio:.1%}')
+        if options['reset']:
+            response_cache.reset_stats()
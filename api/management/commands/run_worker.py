@@ -0,0 +1,102 @@
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections, connections
+
+from api import jobs
+
+logger = logging.getLogger('api.jobs')
+
+# 止まったジョブの回収・古いジョブの削除・定期的なジョブの追加を行う間隔(秒)
+MAINTENANCE_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = 'DBのジョブを取得して実行する(SIGTERM・SIGINTで実行中のジョブを終えてから止まる)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency',
+                            type=int,
+                            default=settings.JOB_WORKER_CONCURRENCY,
+                            help='同時に実行するジョブ数')
+        parser.add_argument('--poll-interval',
+                            type=float,
+                            default=settings.JOB_POLL_INTERVAL,
+                            help='実行できるジョブが無い時に待つ秒数')
+        parser.add_argument('--once',
+                            action='store_true',
+                            help='実行できるジョブが無くなったら終了する')
+        parser.add_argument('--no-periodic',
+                            action='store_true',
+                            help='定期的なジョブを追加しない')
+
+    def handle(self, *args, **options):
+        self.stopping = threading.Event()
+        self.options = options
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *args: self.stopping.set())
+
+        concurrency = options['concurrency']
+        if concurrency > 1 and not jobs.supports_concurrency():
+            self.stderr.write('this database does not support concurrent '
+                              'jobs; running one at a time')
+            concurrency = 1
+        worker_id = '%s:%d' % (socket.gethostname(), os.getpid())
+        threads = [
+            threading.Thread(target=self._loop,
+                             args=('%s:%d' % (worker_id, i), ),
+                             name='worker-%d' % i)
+            for i in range(concurrency)
+        ]
+        self.stdout.write('worker %s started with %d threads' %
+                          (worker_id, len(threads)))
+        self._maintain()
+        for thread in threads:
+            thread.start()
+        next_maintenance = time.monotonic() + MAINTENANCE_INTERVAL
+        while any(thread.is_alive() for thread in threads):
+            if time.monotonic() >= next_maintenance:
+                self._maintain()
+                next_maintenance = time.monotonic() + MAINTENANCE_INTERVAL
+            self.stopping.wait(min(1, options['poll_interval']))
+        for thread in threads:
+            thread.join()
+        connections.close_all()
+
+    def _maintain(self):
+        released = jobs.release_stale()
+        pruned = jobs.prune()
+        added = 0 if self.options['no_periodic'] else \
+            jobs.schedule_periodic()
+        if released or pruned or added:
+            self.stdout.write('released: %d, pruned: %d, scheduled: %d' %
+                              (released, pruned, added))
+        close_old_connections()
+
+    def _loop(self, worker_id):
+        try:
+            while not self.stopping.is_set():
+                # 長く動くので、ジョブごとに期限切れや壊れた接続を閉じる
+                close_old_connections()
+                try:
+                    claimed = jobs.claim(worker_id)
+                except DatabaseError:
+                    logger.exception('could not claim jobs')
+                    self.stopping.wait(self.options['poll_interval'])
+                    continue
+                if not claimed:
+                    if self.options['once']:
+                        self.stopping.set()
+                        return
+                    self.stopping.wait(self.options['poll_interval'])
+                    continue
+                for job in claimed:
+                    jobs.run(job, worker_id)
+        finally:
+            connections.close_all()
@@ -0,0 +1,86 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.seed import Seeder
+
+
+class Command(BaseCommand):
+    help = ('負荷試験用の合成データを全モデルに投入する'
+            '(同じ--seedと件数なら同じデータになる)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--follows',
+                            type=int,
+                            default=20,
+                            help='1ユーザーあたりの平均フォロー数')
+        parser.add_argument('--topics', type=int, default=50)
+        parser.add_argument('--ideas', type=int, default=100000)
+        parser.add_argument('--memos', type=int, default=50000)
+        parser.add_argument('--comments', type=int, default=200000)
+        parser.add_argument('--likes', type=int, default=500000)
+        parser.add_argument('--notifications', type=int, default=200000)
+        parser.add_argument('--announces', type=int, default=20)
+        parser.add_argument('--author-exponent',
+                            type=float,
+                            default=1.0,
+                            help='投稿するユーザーの偏り(べき乗分布の指数)')
+        parser.add_argument('--follow-exponent',
+                            type=float,
+                            default=1.0,
+                            help='フォローされるユーザーの偏り')
+        parser.add_argument('--popularity-exponent',
+                            type=float,
+                            default=1.0,
+                            help='いいね・コメントされる投稿の偏り')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--email-prefix',
+                            default='seed',
+                            help='作成するユーザーのメールアドレスの接頭辞(既存のデータと重ならないようにする)')
+        parser.add_argument('--skip-derived',
+                            action='store_true',
+                            help='検索の索引とカウンタの再計算を省略する')
+
+    def handle(self, *args, **options):
+        self._last_report = 0
+        seeder = Seeder(random.Random(options['seed']),
+                        batch_size=options['batch_size'],
+                        progress=self._progress,
+                        email_prefix=options['email_prefix'],
+                        author_exponent=options['author_exponent'],
+                        follow_exponent=options['follow_exponent'],
+                        popularity_exponent=options['popularity_exponent'])
+        started = time.perf_counter()
+        # 途中で失敗した場合に中途半端なデータを残さない
+        with transaction.atomic():
+            seeder.users(options['users'])
+            seeder.follows(options['users'] * options['follows'])
+            seeder.topics(options['topics'])
+            seeder.ideas(options['ideas'])
+            seeder.memos(options['memos'])
+            seeder.comments(options['comments'])
+            seeder.likes(options['likes'])
+            seeder.notifications(options['notifications'])
+            seeder.announces(options['announces'])
+            if not options['skip_derived']:
+                seeder.rebuild_derived()
+        self.stdout.write(
+            self.style.SUCCESS('done in %.1fs' %
+                               (time.perf_counter() - started)))
+
+    # 進捗は2秒に1回と、各モデルの完了時に表示する
+    def _progress(self, label, done, total, elapsed):
+        now = time.monotonic()
+        if done < total and now - self._last_report < 2:
+            return
+        self._last_report = now
+        if total <= 1:
+            self.stdout.write(f'{label}: {elapsed:.1f}s')
+            return
+        rate = done / elapsed if elapsed else 0
+        self.stdout.write(f'{label}: {done}/{total} ({elapsed:.1f}s, '
+                          f'{rate:,.0f} rows/s)')
@@ -0,0 +1,29 @@
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from api.routers import replica_aliases
+
+
+class Command(BaseCommand):
+    help = ('ローカルでレプリカの振り分けを試すため、'
+            'SQLiteのプライマリの内容をDATABASE_REPLICA_URLSのSQLiteにコピーする')
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        aliases = replica_aliases()
+        if not aliases:
+            raise CommandError('DATABASE_REPLICA_URLS is not set')
+        if primary.vendor != 'sqlite' or any(
+                connections[alias].vendor != 'sqlite' for alias in aliases):
+            raise CommandError('only SQLite databases can be copied')
+        primary.ensure_connection()
+        for alias in aliases:
+            connections[alias].close()
+            with sqlite3.connect(
+                    connections[alias].settings_dict['NAME']) as target:
+                primary.connection.backup(target)
+            target.close()
+            self.stdout.write(f"{alias}: copied to "
+                              f"{connections[alias].settings_dict['NAME']}")
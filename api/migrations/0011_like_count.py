@@ -0,0 +1,45 @@
+# Generated by Django 3.2.7 on 2026-10-18 10:36
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_like_count(apps, schema_editor):
+    Like = apps.get_model('api', 'Like')
+    for model_name, field_name in (('Idea', 'liked_idea'),
+                                   ('Memo', 'liked_memo'),
+                                   ('Comment', 'liked_comment')):
+        model = apps.get_model('api', model_name)
+        counts = Like.objects.filter(**{
+            field_name: OuterRef('pk'),
+            'is_liked': True
+        }).order_by().values(field_name).annotate(n=Count('id')).values('n')
+        model.objects.update(like_count=Coalesce(
+            Subquery(counts, output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_topic_display_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='idea',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='memo',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_like_count, migrations.RunPython.noop),
+    ]
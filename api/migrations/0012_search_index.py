@@ -0,0 +1,25 @@
+from django.db import migrations
+
+from api import search
+
+
+def create_search_index(apps, schema_editor):
+    search.create_index(schema_editor)
+    search.rebuild_index(apps.get_model('api', 'Idea'),
+                         apps.get_model('api', 'Memo'),
+                         using=schema_editor.connection.alias)
+
+
+def drop_search_index(apps, schema_editor):
+    search.drop_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_like_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
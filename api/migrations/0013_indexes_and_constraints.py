@@ -0,0 +1,107 @@
+# Generated by Django 3.2.7 on 2026-10-18 11:01
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+# いいねの外部キーと、いいね数を持つモデル
+LIKE_TARGETS = (('liked_idea', 'Idea'), ('liked_memo', 'Memo'),
+                ('liked_comment', 'Comment'))
+
+
+def recount_likes(apps, Like, field_name, model_name, target_ids):
+    model = apps.get_model('api', model_name)
+    counts = Like.objects.filter(**{
+        field_name: OuterRef('pk'),
+        'is_liked': True
+    }).order_by().values(field_name).annotate(n=Count('id')).values('n')
+    model.objects.filter(id__in=target_ids).update(like_count=Coalesce(
+        Subquery(counts, output_field=IntegerField()), 0))
+
+
+def delete_duplicates(apps, schema_editor):
+    # 一意制約を付ける前に、重複している行は最後に作られた1行だけを残す
+    Follow = apps.get_model('api', 'Follow')
+    Like = apps.get_model('api', 'Like')
+    models_and_fields = [(Follow, ('following_user', 'followed_user'))]
+    models_and_fields += [(Like, ('liked_user', field_name))
+                          for field_name, _ in LIKE_TARGETS]
+    deleted_targets = {}
+    for model, fields in models_and_fields:
+        duplicates = model.objects.filter(**{
+            fields[1] + '__isnull': False
+        }).values(*fields).annotate(n=Count('id'),
+                                    last_id=Max('id')).filter(n__gt=1)
+        for duplicate in duplicates:
+            model.objects.filter(**{
+                field: duplicate[field]
+                for field in fields
+            }).exclude(id=duplicate['last_id']).delete()
+            deleted_targets.setdefault(fields[1], set()).add(
+                duplicate[fields[1]])
+
+    # 消したいいねを数えていた投稿のいいね数を、残った行から数え直す
+    for field_name, model_name in LIKE_TARGETS:
+        target_ids = sorted(deleted_targets.get(field_name, ()))
+        for i in range(0, len(target_ids), 500):
+            recount_likes(apps, Like, field_name, model_name,
+                          target_ids[i:i + 500])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['followed_user', 'is_following'], name='follow_followed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='idea',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['created_at', 'id'], name='idea_published_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='idea',
+            index=models.Index(fields=['idea_creator', 'created_at'], name='idea_creator_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(fields=['liked_user', 'like_target_type'], name='like_user_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='memo',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['created_at', 'id'], name='memo_published_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='memo',
+            index=models.Index(fields=['memo_creator', 'created_at'], name='memo_creator_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['notification_reciever', 'is_checked', 'created_at'], name='notification_reciever_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_checked', False)), fields=['notification_reciever', 'created_at'], name='notification_unchecked_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(fields=('following_user', 'followed_user'), name='unique_follow'),
+        ),
+        migrations.AddConstraint(
+            model_name='like',
+            constraint=models.UniqueConstraint(condition=models.Q(('liked_idea__isnull', False)), fields=('liked_user', 'liked_idea'), name='unique_like_idea'),
+        ),
+        migrations.AddConstraint(
+            model_name='like',
+            constraint=models.UniqueConstraint(condition=models.Q(('liked_memo__isnull', False)), fields=('liked_user', 'liked_memo'), name='unique_like_memo'),
+        ),
+        migrations.AddConstraint(
+            model_name='like',
+            constraint=models.UniqueConstraint(condition=models.Q(('liked_comment__isnull', False)), fields=('liked_user', 'liked_comment'), name='unique_like_comment'),
+        ),
+    ]
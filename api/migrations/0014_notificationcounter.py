@@ -0,0 +1,36 @@
+# Generated by Django 3.2.7 on 2026-10-18 11:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+
+
+def backfill_unread_count(apps, schema_editor):
+    Notification = apps.get_model('api', 'Notification')
+    NotificationCounter = apps.get_model('api', 'NotificationCounter')
+    counts = Notification.objects.filter(is_checked=False).order_by().values(
+        'notification_reciever').annotate(n=Count('id'))
+    NotificationCounter.objects.bulk_create([
+        NotificationCounter(user_id=count['notification_reciever'],
+                            unread_count=count['n']) for count in counts
+    ],
+                                            batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_indexes_and_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='notification_counter', serialize=False, to='api.user')),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_unread_count,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.7 on 2026-10-18 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_persistedquery'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='topic',
+            name='idea_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        # 自動で作られる中間テーブルにはMeta.indexesを指定できないのでSQLで作る
+        # トピックのアイデアをidの降順に、並べ替えずに取得するための索引
+        migrations.RunSQL(
+            'CREATE INDEX api_idea_topics_topic_idea_idx '
+            'ON api_idea_topics (topic_id, idea_id)',
+            'DROP INDEX api_idea_topics_topic_idea_idx',
+        ),
+        # 既存のアイデアから件数を入れる
+        migrations.RunSQL(
+            'UPDATE api_topic SET idea_count = ('
+            'SELECT COUNT(*) FROM api_idea_topics '
+            'INNER JOIN api_idea ON api_idea.id = api_idea_topics.idea_id '
+            'WHERE api_idea_topics.topic_id = api_topic.id '
+            'AND api_idea.is_published)',
+            migrations.RunSQL.noop,
+        ),
+    ]
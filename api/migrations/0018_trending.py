@@ -0,0 +1,36 @@
+# Generated by Django 3.2.7 on 2026-10-18 11:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_topic_idea_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_idea_id', models.BigIntegerField(default=0)),
+                ('last_like_id', models.BigIntegerField(default=0)),
+                ('last_comment_id', models.BigIntegerField(default=0)),
+                ('epoch', models.DateTimeField(null=True)),
+                ('refreshed_at', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TrendingScore',
+            fields=[
+                ('idea', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending_score', serialize=False, to='api.idea')),
+                ('score', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='trendingscore',
+            index=models.Index(fields=['score', 'idea'], name='trending_score_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.2.7 on 2026-10-18 12:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_job'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='notification_type',
+            field=models.CharField(choices=[('Comment', 'コメント'), ('Follow', 'フォロー'), ('Like', 'いいね'), ('Announce', 'お知らせ'), ('Idea', '新しいアイデア')], max_length=50),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['notified_item_type', 'notified_item_id'], name='notification_item_idx'),
+        ),
+    ]
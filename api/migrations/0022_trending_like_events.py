@@ -0,0 +1,39 @@
+# Generated by Django 3.2.7 on 2026-10-18 12:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# いいねは増減の記録から加えるようになるので、次の集計で今のいいねから作り直す
+def reset_trending(apps, schema_editor):
+    apps.get_model('api', 'TrendingCheckpoint').objects.all().delete()
+    apps.get_model('api', 'TrendingScore').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_notify_followers'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='trendingcheckpoint',
+            name='last_like_id',
+        ),
+        migrations.AddField(
+            model_name='like',
+            name='liked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='TrendingLikeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.SmallIntegerField()),
+                ('liked_at', models.DateTimeField(null=True)),
+                ('idea', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trending_like_events', to='api.idea')),
+            ],
+        ),
+        migrations.RunPython(reset_trending, migrations.RunPython.noop),
+    ]
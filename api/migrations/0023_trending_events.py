@@ -0,0 +1,42 @@
+# Generated by Django 3.2.7 on 2026-10-18 13:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# アイデア・コメントも増減の記録から加えるようになるので、次の集計で今ある行から作り直す
+def reset_trending(apps, schema_editor):
+    apps.get_model('api', 'TrendingCheckpoint').objects.all().delete()
+    apps.get_model('api', 'TrendingScore').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_trending_like_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('Idea', 'アイデア'), ('Like', 'いいね'), ('Comment', 'コメント')], max_length=10)),
+                ('delta', models.SmallIntegerField()),
+                ('occurred_at', models.DateTimeField(null=True)),
+                ('idea', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='trending_events', to='api.idea')),
+            ],
+        ),
+        migrations.RemoveField(
+            model_name='trendingcheckpoint',
+            name='last_comment_id',
+        ),
+        migrations.RemoveField(
+            model_name='trendingcheckpoint',
+            name='last_idea_id',
+        ),
+        migrations.DeleteModel(
+            name='TrendingLikeEvent',
+        ),
+        migrations.RunPython(reset_trending, migrations.RunPython.noop),
+    ]
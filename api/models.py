@@ -3,6 +3,8 @@ from django.contrib.auth.models import (AbstractBaseUser, BaseUserManager,
                                         PermissionsMixin)
 from django.core.mail import send_mail
 from django.db import models
+from django.db.models import Q
+from django.utils import timezone
 
 
 def upload_profile_path(instance, filename):
@@ -29,6 +31,7 @@ NOTIFICATION_CHOICES = (
     ('Follow', 'フォロー'),
     ('Like', 'いいね'),
     ('Announce', 'お知らせ'),
+    ('Idea', '新しいアイデア'),
 )
 # 通知を受けたアイテムの種類
 NOTIFIED_ITEM_CHOICES = (
@@ -42,6 +45,21 @@ NOTIFIED_ITEM_CHOICES = (
 # 通報の種類
 REPORT_CHOICES = (('', ''))
 
+# 話題度に加える増減の種類
+TRENDING_EVENT_CHOICES = (
+    ('Idea', 'アイデア'),
+    ('Like', 'いいね'),
+    ('Comment', 'コメント'),
+)
+
+# バックグラウンドのジョブの状態
+JOB_STATUS_CHOICES = (
+    ('queued', '待機中'),
+    ('running', '実行中'),
+    ('done', '完了'),
+    ('failed', '失敗'),
+)
+
 
 class UserManager(BaseUserManager):
     def create_user(
@@ -61,18 +79,22 @@ class UserManager(BaseUserManager):
 
             user.save(using=self._db)
 
-            # ユーザー作成時にメールを送信 superuser作成時はコメントアウト
-            # send_mail(subject='サンプルアプリ | 本登録のお知らせ',
-            #           message=f'ユーザー作成時にメール送信しています' + email,
-            #           from_email="sample@email.com",
-            #           recipient_list=[email],
-            #           fail_silently=False)
+            # ユーザー作成時に本登録のお知らせのメールを送信するジョブを追加する
+            # superuser作成時は送らない
+            if kwargs.get('send_welcome_email',
+                          getattr(settings, 'SEND_WELCOME_EMAIL', False)):
+                from .jobs import enqueue
+                enqueue('send_welcome_email', {'user_id': user.id})
             return user
         except:
             raise
 
     def create_superuser(self, email, password):
-        user = self.create_user(**{'email': email, 'password': password})
+        user = self.create_user(**{
+            'email': email,
+            'password': password,
+            'send_welcome_email': False
+        })
         user.is_staff = True
         user.is_superuser = True
         user.save(using=self._db)
@@ -113,6 +135,8 @@ class Profile(models.Model):
     profile_image = models.ImageField(blank=True,
                                       null=True,
                                       upload_to=upload_profile_path)
+    # プロフィール画像を縮小した画像の名前({'大きさ': {'形式': 名前}})
+    profile_image_variants = models.JSONField(default=dict, blank=True)
     # 自己紹介
     self_introduction = models.CharField(max_length=200, null=True, blank=True)
     # GitHubとTwitterのユーザーネーム
@@ -138,6 +162,17 @@ class Follow(models.Model):
     # フォローしているかの判定フラグ
     is_following = models.BooleanField(default=True)
 
+    class Meta:
+        constraints = [
+            # 同じユーザーの組み合わせのフォローは1行だけにする
+            models.UniqueConstraint(fields=['following_user', 'followed_user'],
+                                    name='unique_follow'),
+        ]
+        indexes = [
+            models.Index(fields=['followed_user', 'is_following'],
+                         name='follow_followed_idx'),
+        ]
+
     def __str__(self) -> str:
         str = self.following_user.related_user.profile_name + ' -> ' + self.followed_user.related_user.profile_name + ' : '
         if self.is_following:
@@ -156,6 +191,8 @@ class Topic(models.Model):
                                     unique=True,
                                     null=False,
                                     blank=False)
+    # 公開されたアイデア数(アイデアのトピック・公開状態の変更時に更新する)
+    idea_count = models.PositiveIntegerField(default=0)
 
     def __str__(self) -> str:
         return self.name
@@ -176,9 +213,21 @@ class Idea(models.Model):
     title = models.CharField(max_length=30)
     content = models.TextField(max_length=3000)
     is_published = models.BooleanField(default=False)
+    # いいね数(Likeの作成・更新時に更新する)
+    like_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # 公開されている行だけの部分インデックス
+            models.Index(fields=['created_at', 'id'],
+                         condition=Q(is_published=True),
+                         name='idea_published_created_idx'),
+            models.Index(fields=['idea_creator', 'created_at'],
+                         name='idea_creator_created_idx'),
+        ]
+
     def __str__(self) -> str:
         return self.title
 
@@ -191,6 +240,18 @@ class Memo(models.Model):
     title = models.CharField(max_length=50)
     created_at = models.DateTimeField(auto_now_add=True)
     is_published = models.BooleanField(default=False)
+    # いいね数(Likeの作成・更新時に更新する)
+    like_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # 公開されている行だけの部分インデックス
+            models.Index(fields=['created_at', 'id'],
+                         condition=Q(is_published=True),
+                         name='memo_published_created_idx'),
+            models.Index(fields=['memo_creator', 'created_at'],
+                         name='memo_creator_created_idx'),
+        ]
 
     def __str__(self) -> str:
         return self.title
@@ -232,6 +293,8 @@ class Comment(models.Model):
     is_modified = models.BooleanField(default=False)
     # 公開されているか(デフォルトでは普通に公開されている)
     is_published = models.BooleanField(default=True)
+    # いいね数(Likeの作成・更新時に更新する)
+    like_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -267,6 +330,26 @@ class Like(models.Model):
                                       on_delete=models.CASCADE)
     # いいねをしているかのフラグ
     is_liked = models.BooleanField(default=True)
+    # 最後にいいねした時刻(話題度の換算に使う。以前からの行はNone)
+    liked_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # 同じ投稿へのいいねはユーザーごとに1行だけにする
+            models.UniqueConstraint(fields=['liked_user', 'liked_idea'],
+                                    condition=Q(liked_idea__isnull=False),
+                                    name='unique_like_idea'),
+            models.UniqueConstraint(fields=['liked_user', 'liked_memo'],
+                                    condition=Q(liked_memo__isnull=False),
+                                    name='unique_like_memo'),
+            models.UniqueConstraint(fields=['liked_user', 'liked_comment'],
+                                    condition=Q(liked_comment__isnull=False),
+                                    name='unique_like_comment'),
+        ]
+        indexes = [
+            models.Index(fields=['liked_user', 'like_target_type'],
+                         name='like_user_type_idx'),
+        ]
 
     def __str__(self) -> str:
         if self.like_target_type == 'Idea':
@@ -319,10 +402,123 @@ class Notification(models.Model):
     is_checked = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['notification_reciever', 'is_checked', 'created_at'],
+                name='notification_reciever_idx'),
+            # 未読の通知だけの部分インデックス
+            models.Index(fields=['notification_reciever', 'created_at'],
+                         condition=Q(is_checked=False),
+                         name='notification_unchecked_idx'),
+            # アイテムごとの通知を探すためのインデックス
+            models.Index(fields=['notified_item_type', 'notified_item_id'],
+                         name='notification_item_idx'),
+        ]
+
     def __str__(self) -> str:
         return self.notificator.related_user.profile_name + ' : ' + self.notification_type
 
 
+# ユーザーごとの未読の通知数(通知の作成・確認時に更新する)
+class NotificationCounter(models.Model):
+    user = models.OneToOneField(settings.AUTH_USER_MODEL,
+                                primary_key=True,
+                                related_name='notification_counter',
+                                on_delete=models.CASCADE)
+    unread_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self) -> str:
+        return self.user.email + ' : ' + str(self.unread_count)
+
+
+# フォローしているユーザーのアイデアのタイムライン(公開時に書き込む)
+class TimelineEntry(models.Model):
+    # タイムラインを見るユーザー
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL,
+                              related_name='timeline_owner',
+                              on_delete=models.CASCADE)
+    idea = models.ForeignKey(Idea,
+                             related_name='timeline_idea',
+                             on_delete=models.CASCADE)
+    # フォロー解除時にまとめて消すためにアイデアの作成者を持つ
+    idea_creator = models.ForeignKey(settings.AUTH_USER_MODEL,
+                                     related_name='timeline_idea_creator',
+                                     on_delete=models.CASCADE)
+    # アイデアのcreated_atと同じ値(アイデアと同じキーでページングする)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'idea'],
+                                    name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', 'created_at', 'idea'],
+                         name='timeline_owner_created_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return self.owner.email + ' : ' + self.idea.title
+
+
+# フォロワーが多く、タイムラインへ書き込まずに読み込み時に取得するユーザー
+class TimelinePullAuthor(models.Model):
+    user = models.OneToOneField(settings.AUTH_USER_MODEL,
+                                primary_key=True,
+                                related_name='timeline_pull_author',
+                                on_delete=models.CASCADE)
+
+    def __str__(self) -> str:
+        return self.user.email
+
+
+# アイデアの話題度(いいね・コメント・投稿を新しさで指数関数的に減衰させて合計したスコア)
+# スコアはTrendingCheckpoint.epochの時点の値に換算して保持し、順位は時間が経っても変わらない
+class TrendingScore(models.Model):
+    idea = models.OneToOneField(Idea,
+                                primary_key=True,
+                                related_name='trending_score',
+                                on_delete=models.CASCADE)
+    score = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['score', 'idea'], name='trending_score_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return '%d : %f' % (self.idea_id, self.score)
+
+
+# まだ話題度に加えていない、アイデアの投稿・いいね・コメント(delta=1)と
+# いいねの取り消し・コメントの削除(delta=-1)
+# 減らす場合もいいね・コメントした時刻で換算して、加えた分と同じだけ減らす
+# アイデアと一緒に消えるコメントの削除も記録されるので、外部キーの制約は付けない
+class TrendingEvent(models.Model):
+    idea = models.ForeignKey(Idea,
+                             related_name='trending_events',
+                             on_delete=models.CASCADE,
+                             db_constraint=False)
+    kind = models.CharField(choices=TRENDING_EVENT_CHOICES, max_length=10)
+    delta = models.SmallIntegerField()
+    occurred_at = models.DateTimeField(null=True)
+
+    def __str__(self) -> str:
+        return '%d : %s %+d' % (self.idea_id, self.kind, self.delta)
+
+
+# 話題度の集計の基準と最後に集計した時刻(1行だけ使う)
+class TrendingCheckpoint(models.Model):
+    # スコアを換算する基準の時刻
+    epoch = models.DateTimeField(null=True)
+    # 最後に集計した時刻
+    refreshed_at = models.DateTimeField(null=True)
+
+    def __str__(self) -> str:
+        return str(self.refreshed_at)
+
+
 # 全体へのお知らせ
 class Announce(models.Model):
     title = models.CharField(max_length=100)
@@ -346,3 +542,53 @@ class Report(models.Model):
 
     def __str__(self) -> str:
         return self.title
+
+
+# フロントエンドが登録したクエリ(クライアントはSHA-256のハッシュだけを送る)
+class PersistedQuery(models.Model):
+    sha256_hash = models.CharField(max_length=64, unique=True)
+    query = models.TextField()
+    operation_name = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return self.operation_name or self.sha256_hash
+
+
+# バックグラウンドで実行する処理(api/jobs.pyのenqueueで追加し、run_workerで実行する)
+class Job(models.Model):
+    # 実行する処理の名前(api.jobs.HANDLERSのキー)
+    name = models.CharField(max_length=100)
+    # 処理に渡すキーワード引数
+    payload = models.JSONField(default=dict, blank=True)
+    # 同じ処理を重複して追加しないためのキー
+    key = models.CharField(max_length=200, null=True, blank=True, unique=True)
+    status = models.CharField(choices=JOB_STATUS_CHOICES,
+                              max_length=20,
+                              default='queued')
+    # この時刻以降に実行する(リトライ時は待ち時間だけ後ろにずらす)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    # 実行中のワーカーと取得した時刻(止まったワーカーのジョブをやり直すため)
+    locked_by = models.CharField(max_length=100, blank=True, default='')
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    # 最後の実行の開始・終了時刻と実行時間(ミリ秒)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration_ms = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # 待機中のジョブだけの部分インデックス
+            models.Index(fields=['run_at', 'id'],
+                         condition=Q(status='queued'),
+                         name='job_queued_idx'),
+            models.Index(fields=['status', 'locked_at'],
+                         name='job_status_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return '%s : %s' % (self.name, self.status)
@@ -0,0 +1,141 @@
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+from .counters import add_unread_notification_counts
+from .models import Follow, Idea, Notification
+
+# フォロワーへの通知をまとめて書き込む件数
+NOTIFY_BATCH_SIZE = 1000
+
+
+# 通知を受け取るユーザーごとのグループ名
+def notification_group(user_id):
+    return 'notifications_%s' % user_id
+
+
+def publish_notification(notification_id, reciever_id):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(notification_group(reciever_id), {
+        'type': 'notification.created',
+        'notification_id': notification_id,
+    })
+
+
+# トランザクションがコミットされてから購読中のクライアントに配信する
+def publish_notification_on_commit(notification: Notification):
+    notification_id = notification.id
+    reciever_id = notification.notification_reciever_id
+    transaction.on_commit(
+        lambda: publish_notification(notification_id, reciever_id))
+
+
+def _get_notification(notification_id):
+    # 非同期のリゾルバからはDBを引けないため、関連も合わせて取得しておく
+    return Notification.objects.select_related(
+        'notificator__related_user',
+        'notification_reciever__related_user').filter(
+            id=notification_id).first()
+
+
+# ユーザーのグループに参加し、新しい通知を順に返す
+async def subscribe_notifications(user_id):
+    channel_layer = get_channel_layer()
+    channel_name = await channel_layer.new_channel()
+    group = notification_group(user_id)
+    await channel_layer.group_add(group, channel_name)
+    try:
+        while True:
+            message = await channel_layer.receive(channel_name)
+            notification = await database_sync_to_async(_get_notification)(
+                message['notification_id'])
+            if notification is not None:
+                yield notification
+    finally:
+        await channel_layer.group_discard(group, channel_name)
+
+
+def _idea_notifications(receiver_ids, idea):
+    return [
+        Notification(notificator_id=idea.idea_creator_id,
+                     notification_reciever_id=receiver_id,
+                     notification_type='Idea',
+                     notified_item_type='Idea',
+                     notified_item_id=idea.id) for receiver_id in receiver_ids
+    ]
+
+
+def _publish_notifications(notifications):
+    for notification_id, reciever_id in notifications:
+        publish_notification(notification_id, reciever_id)
+
+
+def _write_idea_notifications(receiver_ids, idea):
+    """
+    まだ通知していないユーザーに通知と未読数を書き込み、書き込んだ件数を返す
+    1回分ずつコミットし、コミットしてから購読中のクライアントに配信する
+    アイデアが非公開にされていた場合はNoneを返す
+    """
+    with transaction.atomic():
+        # 同じアイデアのジョブが同時に実行されても、通知の有無の確認と書き込みを1つずつ行う
+        is_published = Idea.objects.select_for_update().filter(
+            id=idea.id).values_list('is_published', flat=True).first()
+        if not is_published:
+            return None
+        notifications = Notification.objects.filter(
+            notified_item_type='Idea',
+            notified_item_id=idea.id,
+            notification_type='Idea')
+        notified = set(
+            notifications.filter(
+                notification_reciever_id__in=receiver_ids).values_list(
+                    'notification_reciever_id', flat=True))
+        receiver_ids = [
+            receiver_id for receiver_id in receiver_ids
+            if receiver_id not in notified
+        ]
+        if not receiver_ids:
+            return 0
+        Notification.objects.bulk_create(
+            _idea_notifications(receiver_ids, idea))
+        add_unread_notification_counts(receiver_ids, 1)
+        # bulk_createではpost_saveが送られず、DBによってはidも設定されないので取得し直す
+        created = list(
+            notifications.filter(
+                notification_reciever_id__in=receiver_ids).values_list(
+                    'id', 'notification_reciever_id'))
+        transaction.on_commit(lambda: _publish_notifications(created))
+    return len(receiver_ids)
+
+
+def notify_followers(idea: Idea, batch_size=NOTIFY_BATCH_SIZE):
+    """
+    公開されたアイデアをフォロワー全員に通知し、通知した件数を返す
+    フォロワーをiteratorで少しずつ読み込み、通知と未読数をbatch_size件ずつ
+    別のトランザクションで書き込むので、ロックを持つのは1回分の書き込みの間だけになる
+    やり直した場合や同時に実行された場合も、通知済みのフォロワーには通知しない
+    """
+    if not idea.is_published:
+        return 0
+    followers = Follow.objects.filter(
+        followed_user_id=idea.idea_creator_id,
+        is_following=True).exclude(following_user_id=idea.idea_creator_id)
+
+    written = 0
+    receiver_ids = []
+    for receiver_id in followers.values_list('following_user_id',
+                                             flat=True).iterator(
+                                                 chunk_size=batch_size):
+        receiver_ids.append(receiver_id)
+        if len(receiver_ids) >= batch_size:
+            count = _write_idea_notifications(receiver_ids, idea)
+            if count is None:
+                return written
+            written += count
+            receiver_ids = []
+    if receiver_ids:
+        written += _write_idea_notifications(receiver_ids, idea) or 0
+    return written
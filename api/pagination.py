@@ -0,0 +1,164 @@
+import base64
+import datetime
+import json
+from functools import reduce
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from graphene.relay import PageInfo
+from graphene_django.filter import DjangoFilterConnectionField
+from graphene_django.settings import graphene_settings
+
+
+def get_page_size(first, max_limit=None, argument='first'):
+    """
+    first(lastの場合はargumentに指定する)から1ページに取得する件数を返す
+    省略した場合と上限を超える場合はmax_limit、0の場合は0件にし、負の値はエラーにする
+    """
+    if max_limit is None:
+        max_limit = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+    if first is None:
+        return max_limit
+    if first < 0:
+        raise ValueError('%s must not be negative' % argument)
+    return min(first, max_limit)
+
+
+# 前からだけページングできるコネクションで、last・beforeが指定された場合はエラーにする
+def reject_backward_paging(args):
+    if args.get('last') is not None or args.get('before') is not None:
+        raise ValueError(
+            'last and before are not supported on this connection')
+
+
+class KeysetConnectionField(DjangoFilterConnectionField):
+    """
+    OFFSETを使わずに、最後に取得した行のキーをカーソルにしてページングするコネクション
+    keyset_fieldsの降順で並べ、何ページ目でも1ページ目と同じコストで取得できる
+    """
+    keyset_fields = ('created_at', 'id')
+
+    @classmethod
+    def encode_cursor(cls, obj):
+        values = []
+        for field_name in cls.keyset_fields:
+            value = getattr(obj, field_name)
+            if isinstance(value, datetime.datetime):
+                value = value.isoformat()
+            values.append(value)
+        return base64.b64encode(
+            json.dumps(values).encode('utf-8')).decode('ascii')
+
+    @classmethod
+    def decode_cursor(cls, model, cursor):
+        try:
+            values = json.loads(base64.b64decode(cursor).decode('utf-8'))
+        except ValueError:
+            raise ValueError('invalid cursor')
+        if not isinstance(values, list) or len(values) != len(
+                cls.keyset_fields):
+            raise ValueError('invalid cursor')
+        try:
+            values = [
+                model._meta.get_field(field_name).to_python(value)
+                for field_name, value in zip(cls.keyset_fields, values)
+            ]
+        except ValidationError:
+            raise ValueError('invalid cursor')
+        # nullはto_pythonがそのままNoneを返すので、ここで弾く
+        if None in values:
+            raise ValueError('invalid cursor')
+        return values
+
+    @classmethod
+    def keyset_filter(cls, values, lookup):
+        # (a, b) < (va, vb) を a < va OR (a = va AND b < vb) に展開する
+        conditions = []
+        for i, field_name in enumerate(cls.keyset_fields):
+            condition = {
+                name: value
+                for name, value in zip(cls.keyset_fields[:i], values[:i])
+            }
+            condition[field_name + '__' + lookup] = values[i]
+            conditions.append(Q(**condition))
+        return reduce(lambda a, b: a | b, conditions)
+
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        if args.get('offset'):
+            raise ValueError('offset is not supported on this connection')
+        queryset = iterable
+        model = queryset.model
+        after = args.get('after')
+        before = args.get('before')
+        first = args.get('first')
+        last = args.get('last')
+
+        if after:
+            queryset = queryset.filter(
+                cls.keyset_filter(cls.decode_cursor(model, after), 'lt'))
+        if before:
+            queryset = queryset.filter(
+                cls.keyset_filter(cls.decode_cursor(model, before), 'gt'))
+
+        descending = ['-' + field_name for field_name in cls.keyset_fields]
+        ascending = list(cls.keyset_fields)
+        if last is not None and first is None:
+            # 後ろからページングする場合は昇順で取得して並べ直す
+            last = get_page_size(last, max_limit, 'last')
+            rows = list(queryset.order_by(*ascending)[:last + 1])
+            has_more = len(rows) > last
+            rows = list(reversed(rows[:last]))
+            has_next_page = bool(before)
+            has_previous_page = has_more
+        else:
+            first = get_page_size(first, max_limit)
+            queryset = queryset.order_by(*descending)
+            rows = list(queryset[:first + 1])
+            has_more = len(rows) > first
+            rows = rows[:first]
+            has_next_page = has_more
+            has_previous_page = bool(after)
+
+        resolved = cls.connection_from_rows(connection, rows,
+                                            has_previous_page, has_next_page)
+        resolved.iterable = iterable
+        return resolved
+
+    @classmethod
+    def connection_from_rows(cls, connection, rows, has_previous_page,
+                             has_next_page):
+        edges = [
+            connection.Edge(node=row, cursor=cls.encode_cursor(row))
+            for row in rows
+        ]
+        return connection(edges=edges,
+                          page_info=PageInfo(
+                              start_cursor=edges[0].cursor if edges else None,
+                              end_cursor=edges[-1].cursor if edges else None,
+                              has_previous_page=has_previous_page,
+                              has_next_page=has_next_page,
+                          ))
+
+
+class IdKeysetConnectionField(KeysetConnectionField):
+    """idの降順でページングするコネクション(作成順の一覧を中間テーブルの索引から取得する場合など)"""
+    keyset_fields = ('id', )
+
+
+class ScoreKeysetConnectionField(KeysetConnectionField):
+    """
+    話題度のスコアの行をスコアの降順(同じスコアはアイデアのidの降順)でページングし、
+    行のアイデアをノードにするコネクション
+    """
+    keyset_fields = ('score', 'idea_id')
+
+    @classmethod
+    def connection_from_rows(cls, connection, rows, has_previous_page,
+                             has_next_page):
+        resolved = super().connection_from_rows(connection, rows,
+                                                has_previous_page,
+                                                has_next_page)
+        for edge in resolved.edges:
+            edge.node = edge.node.idea
+        return resolved
@@ -0,0 +1,106 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .cost import CostAnalysisBackend
+from .models import PersistedQuery
+
+# パース・バリデーション済みの文書を保持する最大件数
+DOCUMENT_CACHE_SIZE = getattr(settings, 'GRAPHQL_DOCUMENT_CACHE_SIZE', 1000)
+# 登録済みクエリの有無をプロセス内に保持する秒数
+# 削除(--prune)・追加した登録済みクエリは、この秒数のうちに全てのプロセスに反映される
+PERSISTED_QUERY_CACHE_TIMEOUT = getattr(
+    settings, 'GRAPHQL_PERSISTED_QUERY_CACHE_TIMEOUT', 60)
+
+
+class LRUCache:
+    """キーごとに値を保持し、最大件数を超えたら最も使われていないものから捨てるLRU"""
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+# クエリのハッシュから、パース・バリデーション済みの文書
+documents = LRUCache(DOCUMENT_CACHE_SIZE)
+# 登録済みクエリのハッシュから、(クエリの文字列, 期限)
+registered_queries = LRUCache(DOCUMENT_CACHE_SIZE)
+# 未登録のハッシュから、期限
+# 未登録のハッシュを大量に送られても登録済みのものが追い出されないよう分けて保持する
+missing_queries = LRUCache(DOCUMENT_CACHE_SIZE)
+
+
+def _cached(cache, key, now):
+    entry = cache.get(key)
+    if entry is None or entry[-1] <= now:
+        return None
+    return entry
+
+
+# 登録済みのクエリを返す(未登録の場合はNone)
+def get_persisted_query(sha256_hash):
+    now = time.monotonic()
+    entry = _cached(registered_queries, sha256_hash, now)
+    if entry is not None:
+        return entry[0]
+    if _cached(missing_queries, sha256_hash, now) is not None:
+        return None
+    query = PersistedQuery.objects.filter(
+        sha256_hash=sha256_hash).values_list('query', flat=True).first()
+    expires_at = now + PERSISTED_QUERY_CACHE_TIMEOUT
+    if query is None:
+        missing_queries.set(sha256_hash, (expires_at, ))
+    else:
+        registered_queries.set(sha256_hash, (query, expires_at))
+    return query
+
+
+# 登録済みクエリを変更したプロセスのキャッシュを捨てる
+def clear_persisted_queries():
+    registered_queries.clear()
+    missing_queries.clear()
+
+
+def is_registered(query):
+    return get_persisted_query(query_hash(query)) is not None
+
+
+class CachedDocumentBackend(CostAnalysisBackend):
+    """パース・バリデーション済みの文書をクエリのハッシュをキーにプロセス内に保持するバックエンド"""
+    def document_from_string(self, schema, document_string):
+        if not isinstance(document_string, str):
+            return super().document_from_string(schema, document_string)
+        key = query_hash(document_string)
+        document = documents.get(key)
+        if document is None or document.schema is not schema:
+            document = super().document_from_string(schema, document_string)
+            documents.set(key, document)
+        return document
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from graphql.language.printer import print_ast
+
+from .cost import CostAnalysis
+from .persisted import DOCUMENT_CACHE_SIZE, LRUCache, query_hash
+
+# キャッシュしてよいルートのフィールド
+CACHEABLE_FIELDS = {
+    'allIdeas', 'allMemos', 'allTopics', 'allAnnounce', 'idea', 'ideasByTopic'
+}
+# 保存・削除をシグナルで検知して無効化するモデル
+# これ以外のモデルを読むクエリはキャッシュしない
+CACHED_MODELS = {'Idea', 'Memo', 'Topic', 'Announce', 'User', 'Profile'}
+
+KEY_PREFIX = 'graphql_response'
+
+# クエリのハッシュから、(正規化したクエリのハッシュ, 読むモデル)
+# キャッシュできないクエリはNoneを保持する
+_plans = LRUCache(DOCUMENT_CACHE_SIZE)
+_UNCACHEABLE = ()
+
+
+def _cache():
+    return caches[getattr(settings, 'GRAPHQL_RESPONSE_CACHE_ALIAS',
+                          'default')]
+
+
+def _timeout():
+    return getattr(settings, 'GRAPHQL_RESPONSE_CACHE_TIMEOUT', 60)
+
+
+def _tag_key(tag):
+    return '%s:tag:%s' % (KEY_PREFIX, tag)
+
+
+def _model_name(graphql_type):
+    graphene_type = getattr(graphql_type, 'graphene_type', None)
+    model = getattr(getattr(graphene_type, '_meta', None), 'model', None)
+    return model.__name__ if model is not None else None
+
+
+def _plan(document, operation_name):
+    if document.get_operation_type(operation_name) != 'query':
+        return _UNCACHEABLE
+    analysis = CostAnalysis(document.schema,
+                            document.document_ast).analyze(operation_name)
+    if not analysis.root_fields or \
+            not analysis.root_fields <= CACHEABLE_FIELDS:
+        return _UNCACHEABLE
+    tags = set()
+    for graphql_type in analysis.types:
+        model_name = _model_name(graphql_type)
+        if model_name is None:
+            continue
+        if model_name not in CACHED_MODELS:
+            return _UNCACHEABLE
+        tags.add(model_name)
+    normalized = hashlib.sha256(
+        print_ast(document.document_ast).encode('utf-8')).hexdigest()
+    return normalized, tuple(sorted(tags))
+
+
+def is_cacheable_request(request):
+    return request.method in ('GET', 'POST') and \
+        not request.META.get('HTTP_AUTHORIZATION') and \
+        not request.GET.get('pretty')
+
+
+class ResponseCacheEntry:
+    """1件のリクエストに対応するキャッシュのキー"""
+    def __init__(self, key):
+        self.key = key
+
+    def get(self):
+        response = _cache().get(self.key)
+        _count('hits' if response is not None else 'misses')
+        return response
+
+    def set(self, response):
+        _cache().set(self.key, response, _timeout())
+
+
+# キャッシュできるリクエストならキーを返す(できない場合はNone)
+# キーにはクエリが読むモデルごとのバージョンを含め、モデルの更新で別のキーになる
+def get_entry(document, variables, operation_name):
+    key = query_hash(document.document_string) + ':' + (operation_name or '')
+    plan = _plans.get(key)
+    if plan is None:
+        plan = _plan(document, operation_name)
+        _plans.set(key, plan)
+    if plan is _UNCACHEABLE:
+        return None
+    normalized, tags = plan
+    versions = _get_versions(tags)
+    digest = hashlib.sha256(
+        json.dumps([
+            normalized, operation_name, variables or {},
+            [versions[tag] for tag in tags]
+        ],
+                   sort_keys=True,
+                   default=str).encode('utf-8')).hexdigest()
+    return ResponseCacheEntry('%s:%s' % (KEY_PREFIX, digest))
+
+
+def _get_versions(tags):
+    cache = _cache()
+    keys = [_tag_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    missing = {key: _new_version() for key in keys if key not in versions}
+    if missing:
+        # 共有キャッシュから追い出された場合も以前と重ならない値から始める
+        for key, version in missing.items():
+            cache.add(key, version, None)
+        versions.update(cache.get_many(list(missing)))
+    return {tag: versions.get(_tag_key(tag), 0) for tag in tags}
+
+
+def _new_version():
+    return int(time.time() * 1000)
+
+
+# モデルのバージョンを上げ、そのモデルを読むキャッシュをまとめて無効にする
+def invalidate(*model_names):
+    cache = _cache()
+    for model_name in model_names:
+        key = _tag_key(model_name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_version(), None)
+
+
+# トランザクションのコミット後に無効化する
+# (コミット前に無効化すると、古い行を読んだ結果が新しいキーで保存されうる)
+def invalidate_on_commit(*model_names, using=None):
+    transaction.on_commit(lambda: invalidate(*model_names), using=using)
+
+
+def _count(name):
+    cache = _cache()
+    key = '%s:stats:%s' % (KEY_PREFIX, name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def stats():
+    cache = _cache()
+    counts = cache.get_many(
+        ['%s:stats:%s' % (KEY_PREFIX, name) for name in ('hits', 'misses')])
+    return {
+        name: counts.get('%s:stats:%s' % (KEY_PREFIX, name), 0)
+        for name in ('hits', 'misses')
+    }
+
+
+def reset_stats():
+    _cache().delete_many(
+        ['%s:stats:%s' % (KEY_PREFIX, name) for name in ('hits', 'misses')])
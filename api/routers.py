@@ -0,0 +1,133 @@
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+# 実行中のGraphQLのリクエストのRequestScope
+current_scope = ContextVar('current_db_scope', default=None)
+
+
+class RequestScope:
+    """
+    1件のリクエストの間、プライマリに固定するかどうかと、読み込むレプリカを保持する
+    レプリカはリクエストの最初の読み込みで選び、以降の読み込みでも同じものを使う
+    """
+    def __init__(self, primary=False):
+        self.primary = primary
+        self._replica = None
+        self._replica_chosen = False
+
+    # このリクエストで読み込むレプリカ(正常なレプリカが無い場合はNone)
+    def replica(self):
+        if not self._replica_chosen:
+            self._replica = choose_replica()
+            self._replica_chosen = True
+        return self._replica
+
+
+def replica_aliases():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def _check_interval():
+    return getattr(settings, 'DATABASE_REPLICA_CHECK_INTERVAL', 10)
+
+
+class ReplicaHealth:
+    """
+    レプリカごとに、最後に確認した時刻と接続できたかを保持する
+    確認は間隔を空けて、選ばれた時にそのスレッドの接続で行う
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked = {}
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        with self._lock:
+            checked_at, healthy = self._checked.get(alias, (None, True))
+            if checked_at is not None and \
+                    now - checked_at < _check_interval():
+                return healthy
+            # 確認中に他のスレッドが同じレプリカを確認しないよう先に時刻を入れる
+            self._checked[alias] = (now, healthy)
+        healthy = _ping(alias)
+        with self._lock:
+            self._checked[alias] = (now, healthy)
+        return healthy
+
+
+def _ping(alias):
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT 1')
+        return True
+    except DatabaseError:
+        # 壊れた接続は次の確認で作り直す
+        connections[alias].close()
+        return False
+
+
+health = ReplicaHealth()
+_counter = itertools.count()
+
+
+# 正常なレプリカを順番に選ぶ(全て停止している場合はNone)
+def choose_replica():
+    aliases = replica_aliases()
+    if not aliases:
+        return None
+    start = next(_counter)
+    for i in range(len(aliases)):
+        alias = aliases[(start + i) % len(aliases)]
+        if health.is_healthy(alias):
+            return alias
+    return None
+
+
+@contextmanager
+def request_scope(primary=False):
+    scope = RequestScope(primary)
+    token = current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        current_scope.reset(token)
+
+
+# 以降のこのリクエストの読み込みをプライマリで行う
+def pin_primary():
+    scope = current_scope.get()
+    if scope is not None:
+        scope.primary = True
+
+
+class ReplicaRouter:
+    """
+    GraphQLのクエリの読み込みをレプリカに振り分けるルーター
+    ミューテーションと、同じリクエストで書き込んだ後の読み込みはプライマリで行う
+    GraphQLのリクエストの外(管理画面・コマンドなど)は全てプライマリで行う
+    """
+    def db_for_read(self, model, **hints):
+        scope = current_scope.get()
+        if scope is None or scope.primary:
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return scope.replica() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        pin_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # レプリカはプライマリと同じデータを持つ
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replica_aliases()
@@ -3,17 +3,29 @@ import asyncio
 import graphene
 import graphql_social_auth
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
 from graphene import relay
 from graphene_django.filter import DjangoFilterConnectionField
 from graphene_django.types import DjangoObjectType
 from graphene_file_upload.scalars import Upload
 from graphql_relay import from_global_id
-
+from graphql_relay.connection.arrayconnection import (
+    connection_from_list_slice, get_offset_with_default)
+
+from api import images, jobs, search, timeline, topics, trending
+from api.counters import (change_like_count, change_unread_notification_count,
+                          get_unread_notification_count)
+from api.loaders import load_many, load_related
+from api.notifications import subscribe_notifications
+from api.pagination import (IdKeysetConnectionField, KeysetConnectionField,
+                            ScoreKeysetConnectionField, get_page_size,
+                            reject_backward_paging)
 from api.validation import validate_token
 
 from .models import (LIKE_CHOICES, THREAD_CHOICES, Announce, Comment, Follow,
                      Idea, Like, Memo, Notification, Profile, Report, Thread,
-                     Topic, User)
+                     Topic, TrendingScore, User)
 
 
 # ユーザー
@@ -29,6 +41,9 @@ class UserNode(DjangoObjectType):
         }
         interfaces = (relay.Node, )
 
+    resolve_related_user = load_related('profile_by_user', 'id',
+                                        'related_user')
+
 
 class ProfileNode(DjangoObjectType):
     class Meta:
@@ -42,6 +57,16 @@ class ProfileNode(DjangoObjectType):
         }
         interfaces = (relay.Node, )
 
+    # 縮小した画像のURL(処理が終わるまでは元の画像のURL)
+    profile_image_url = graphene.String(
+        size=graphene.Int(default_value=128),
+        image_format=graphene.String(default_value='webp'))
+
+    resolve_related_user = load_related('user', 'related_user_id')
+
+    def resolve_profile_image_url(self, info, size, image_format):
+        return images.profile_image_url(self, size, image_format)
+
 
 class FollowNode(DjangoObjectType):
     class Meta:
@@ -53,6 +78,9 @@ class FollowNode(DjangoObjectType):
         }
         interfaces = (relay.Node, )
 
+    resolve_following_user = load_related('user', 'following_user_id')
+    resolve_followed_user = load_related('user', 'followed_user_id')
+
 
 class TopicNode(DjangoObjectType):
     class Meta:
@@ -74,6 +102,12 @@ class IdeaNode(DjangoObjectType):
         }
         interfaces = (relay.Node, )
 
+    # アイデアごとに引かず、ページのアイデアのトピックをまとめて取得する
+    topics = relay.ConnectionField(TopicNode._meta.connection)
+
+    resolve_idea_creator = load_related('user', 'idea_creator_id')
+    resolve_topics = load_many('idea_topics', 'topics')
+
 
 class MemoNode(DjangoObjectType):
     class Meta:
@@ -85,6 +119,8 @@ class MemoNode(DjangoObjectType):
         }
         interfaces = (relay.Node, )
 
+    resolve_memo_creator = load_related('user', 'memo_creator_id')
+
 
 class ThreadNode(DjangoObjectType):
     class Meta:
@@ -94,6 +130,9 @@ class ThreadNode(DjangoObjectType):
         }
         interfaces = (relay.Node, )
 
+    resolve_target_idea = load_related('idea', 'target_idea_id')
+    resolve_target_memo = load_related('memo', 'target_memo_id')
+
 
 class CommentNode(DjangoObjectType):
     class Meta:
@@ -104,6 +143,9 @@ class CommentNode(DjangoObjectType):
         }
         interfaces = (relay.Node, )
 
+    resolve_commentor = load_related('user', 'commentor_id')
+    resolve_target_thread = load_related('thread', 'target_thread_id')
+
 
 class LikeNode(DjangoObjectType):
     class Meta:
@@ -115,6 +157,11 @@ class LikeNode(DjangoObjectType):
         }
         interfaces = (relay.Node, )
 
+    resolve_liked_user = load_related('user', 'liked_user_id')
+    resolve_liked_idea = load_related('idea', 'liked_idea_id')
+    resolve_liked_memo = load_related('memo', 'liked_memo_id')
+    resolve_liked_comment = load_related('comment', 'liked_comment_id')
+
 
 class NotificationNode(DjangoObjectType):
     class Meta:
@@ -127,6 +174,10 @@ class NotificationNode(DjangoObjectType):
         }
         interfaces = (relay.Node, )
 
+    resolve_notificator = load_related('user', 'notificator_id')
+    resolve_notification_reciever = load_related('user',
+                                                 'notification_reciever_id')
+
 
 class AnnounceNode(DjangoObjectType):
     class Meta:
@@ -148,6 +199,30 @@ class ReportNode(DjangoObjectType):
         }
         interfaces = (relay.Node, )
 
+    resolve_reporter = load_related('user', 'reporter_id')
+
+
+# 検索結果のidを関連度順のままコネクションに変換する
+def resolve_search_connection(connection_type, model, search_ids, query,
+                              **kwargs):
+    reject_backward_paging(kwargs)
+    first = get_page_size(kwargs.get('first'))
+    after = kwargs.get('after')
+    offset = get_offset_with_default(after, -1) + 1
+    # 次のページの有無を知るために1件多く取得する
+    ids = search_ids(query, offset=offset, limit=first + 1)
+    objects = model.objects.in_bulk(ids)
+    nodes = [objects[id] for id in ids if id in objects]
+    return connection_from_list_slice(nodes, {
+        'first': first,
+        'after': after,
+    },
+                                      connection_type=connection_type,
+                                      edge_type=connection_type.Edge,
+                                      pageinfo_type=relay.PageInfo,
+                                      slice_start=offset,
+                                      list_length=offset + len(nodes))
+
 
 # プロフィール
 class CreateProfileMutation(relay.ClientIDMutation):
@@ -219,6 +294,9 @@ class UpdateProfileMutation(relay.ClientIDMutation):
                 profile.website_url = website_url
 
             profile.save()
+            # リクエストでは元の画像だけを保存し、縮小はバックグラウンドで行う
+            if profile_image is not None:
+                images.enqueue_profile_image(profile)
 
             return UpdateProfileMutation(profile=profile)
         except:
@@ -236,13 +314,16 @@ class CreateFollowMutation(relay.ClientIDMutation):
     def mutate_and_get_payload(root, info, **input):
         try:
             followed_user_id = input.get('followed_user_id')
-            following_user = get_user_model().objects.get(
-                email=info.context.user.email)
+            following_user = info.context.current_user
             followed_user = get_user_model().objects.get(
                 id=from_global_id(followed_user_id)[1])
-            follow = Follow(following_user=following_user,
-                            followed_user=followed_user)
-            follow.save()
+            # 一度フォローを外した組み合わせは既存の行を再利用する
+            with transaction.atomic():
+                follow, _ = Follow.objects.update_or_create(
+                    following_user=following_user,
+                    followed_user=followed_user,
+                    defaults={'is_following': True})
+                timeline.follow(following_user.id, followed_user.id)
             return CreateFollowMutation(follow=follow)
         except:
             raise
@@ -260,16 +341,31 @@ class UpdateFollowMutation(relay.ClientIDMutation):
         try:
             follow_id = input.get('follow_id')
             is_following = input.get('is_following')
-            follow: Follow = Follow.objects.get(
-                id=from_global_id(follow_id)[1])
-            follow.is_following = is_following
-            follow.save()
+            with transaction.atomic():
+                follow: Follow = Follow.objects.get(
+                    id=from_global_id(follow_id)[1])
+                follow.is_following = is_following
+                follow.save()
+                if is_following:
+                    timeline.follow(follow.following_user_id,
+                                    follow.followed_user_id)
+                else:
+                    timeline.unfollow(follow.following_user_id,
+                                      follow.followed_user_id)
             return UpdateFollowMutation(follow=follow)
         except:
             raise
 
 
 # アイデア
+# 公開されたアイデアのタイムラインへの書き込みとフォロワーへの通知はジョブで行う
+# 通知は公開し直しても1度だけにする
+def enqueue_published_idea(idea):
+    jobs.enqueue('fan_out_idea', {'idea_id': idea.id})
+    jobs.enqueue('notify_followers', {'idea_id': idea.id},
+                 key='notify_followers:%d' % idea.id)
+
+
 class CreateIdeaMutation(relay.ClientIDMutation):
     class Input:
         title = graphene.String(required=True)
@@ -282,7 +378,7 @@ class CreateIdeaMutation(relay.ClientIDMutation):
     @validate_token
     def mutate_and_get_payload(root, info, **input):
         try:
-            user = get_user_model().objects.get(email=info.context.user.email)
+            user = info.context.current_user
 
             title = input.get('title')
             content = input.get('content')
@@ -291,14 +387,17 @@ class CreateIdeaMutation(relay.ClientIDMutation):
 
             if title == '':
                 raise ValueError('title is must')
+            topic_ids = topics.parse_topic_ids(topic_ids or [])
             idea = Idea(idea_creator=user,
                         title=title,
                         content=content,
                         is_published=is_published)
-            # TODO
-            # for topic_id in topic_ids:
-            #     pass
-            idea.save()
+            with transaction.atomic():
+                idea.save()
+                topics.update_idea_topics(idea, topic_ids, created=True)
+                # 公開されたらフォロワーのタイムラインへの書き込みと通知のジョブを追加する
+                if idea.is_published:
+                    enqueue_published_idea(idea)
             return CreateIdeaMutation(idea=idea)
         except:
             raise
@@ -325,8 +424,11 @@ class UpdateIdeaMutation(relay.ClientIDMutation):
 
             if title == '':
                 raise ValueError('title is must')
+            if topic_ids is not None:
+                topic_ids = topics.parse_topic_ids(topic_ids)
 
             idea: Idea = Idea.objects.get(id=from_global_id(idea_id)[1])
+            was_published = idea.is_published
             if title is not None:
                 idea.title = title
             if content is not None:
@@ -334,7 +436,15 @@ class UpdateIdeaMutation(relay.ClientIDMutation):
             if is_published is not None:
                 idea.is_published = is_published
 
-            idea.save()
+            with transaction.atomic():
+                idea.save()
+                topics.update_idea_topics(idea, topic_ids, was_published)
+                # 公開・非公開が切り替わったらタイムラインを更新する
+                if idea.is_published and not was_published:
+                    enqueue_published_idea(idea)
+                elif was_published and not idea.is_published:
+                    # 実行中のfan_out_ideaが後から書いた分は、そちらで確かめて消す
+                    timeline.remove_idea(idea.id)
             return CreateIdeaMutation(idea=idea)
         except:
             raise
@@ -351,7 +461,9 @@ class DeleteIdeaMutation(relay.ClientIDMutation):
         try:
             idea_id = input.get('idea_id')
             idea: Idea = Idea.objects.get(id=from_global_id(idea_id)[1])
-            idea.delete()
+            with transaction.atomic():
+                topics.remove_idea(idea)
+                idea.delete()
             return DeleteIdeaMutation(idea=idea)
         except:
             raise
@@ -368,7 +480,7 @@ class CreateMemoMutation(relay.ClientIDMutation):
     def mutate_and_get_payload(root, info, **input):
         try:
             title = input.get('title')
-            user = get_user_model().objects.get(email=info.context.user.email)
+            user = info.context.current_user
             memo = Memo(title=title, memo_creator=user)
             memo.save()
             return CreateMemoMutation(memo=memo)
@@ -474,7 +586,7 @@ class CreateCommentMutation(relay.ClientIDMutation):
             target_thread_id = input.get('target_thread_id')
             content = input.get('content')
 
-            user: User = User.objects.get(email=info.context.user.email)
+            user: User = info.context.current_user
             thread: Thread = Thread.objects.get(
                 id=from_global_id(target_thread_id)[1])
 
@@ -555,21 +667,38 @@ class CreateLikeMutation(relay.ClientIDMutation):
             if not (liked_idea_id or liked_memo_id or liked_comment_id):
                 raise ValueError('Either id is required')
 
-            user = get_user_model().objects.get(email=info.context.user.email)
-            like = Like(liked_user=user, like_target_type=like_target_type)
+            user = info.context.current_user
+            target = {}
 
             if liked_idea_id is not None:
                 idea = Idea.objects.get(id=from_global_id(liked_idea_id)[1])
-                like.liked_idea = idea
+                target['liked_idea'] = idea
             if liked_memo_id is not None:
                 memo = Memo.objects.get(id=from_global_id(liked_memo_id)[1])
-                like.liked_memo = memo
+                target['liked_memo'] = memo
             if liked_comment_id is not None:
                 comment = Comment.objects.get(
                     id=from_global_id(liked_comment_id)[1])
-                like.liked_comment = comment
-
-            like.save()
+                target['liked_comment'] = comment
+
+            with transaction.atomic():
+                # 同じ投稿へのいいねは既存の行を再利用する
+                like, created = Like.objects.select_for_update(
+                ).get_or_create(liked_user=user,
+                                defaults={
+                                    'like_target_type': like_target_type,
+                                    'liked_at': timezone.now()
+                                },
+                                **target)
+                if created:
+                    change_like_count(like, 1)
+                    trending.record_like(like, 1)
+                elif not like.is_liked:
+                    like.is_liked = True
+                    like.liked_at = timezone.now()
+                    like.save()
+                    change_like_count(like, 1)
+                    trending.record_like(like, 1)
             return CreateLikeMutation(like=like)
         except:
             raise
@@ -588,9 +717,18 @@ class UpdateLikeMutation(relay.ClientIDMutation):
             like_id = input.get('like_id')
             is_liked = input.get('is_liked')
 
-            like: Like = Like.objects.get(id=from_global_id(like_id)[1])
-            like.is_liked = is_liked
-            like.save()
+            with transaction.atomic():
+                like: Like = Like.objects.select_for_update().get(
+                    id=from_global_id(like_id)[1])
+                if like.is_liked != is_liked:
+                    like.is_liked = is_liked
+                    # 取り消しはいいねした時刻を残し、加えた時と同じ時刻で換算して減らす
+                    if is_liked:
+                        like.liked_at = timezone.now()
+                    like.save()
+                    delta = 1 if is_liked else -1
+                    change_like_count(like, delta)
+                    trending.record_like(like, delta)
             return UpdateLikeMutation(like=like)
         except:
             raise
@@ -609,8 +747,7 @@ class CreateNotificationMutation(relay.ClientIDMutation):
     @validate_token
     def mutate_and_get_payload(root, info, **input):
         try:
-            notificator = get_user_model().objects.get(
-                email=info.context.user.email)
+            notificator = info.context.current_user
 
             notification_reciever_id = input.get('notification_reciever_id')
             notification_reciever = get_user_model().objects.get(
@@ -645,15 +782,71 @@ class UpdateNotificationMutation(relay.ClientIDMutation):
             notification_id = input.get('notification_id')
             is_checked = input.get('is_checked')
 
-            notification: Notification = Notification(
-                id=from_global_id(notification_id)[1])
-            notification.is_checked = is_checked
-            notification.save()
+            with transaction.atomic():
+                notifications = Notification.objects.select_for_update()
+                notification: Notification = notifications.get(
+                    id=from_global_id(notification_id)[1],
+                    notification_reciever=info.context.current_user)
+                if notification.is_checked != is_checked:
+                    notification.is_checked = is_checked
+                    notification.save(update_fields=['is_checked'])
+                    change_unread_notification_count(
+                        notification.notification_reciever_id,
+                        -1 if is_checked else 1)
             return UpdateNotificationMutation(notification=notification)
         except:
             raise
 
 
+class MarkNotificationsCheckedMutation(relay.ClientIDMutation):
+    class Input:
+        ids = graphene.List(graphene.NonNull(graphene.ID), required=True)
+
+    count = graphene.Int()
+
+    @validate_token
+    def mutate_and_get_payload(root, info, **input):
+        try:
+            notification_ids = [
+                from_global_id(notification_id)[1]
+                for notification_id in input.get('ids')
+            ]
+            user = info.context.current_user
+            with transaction.atomic():
+                # 1回のUPDATEでまとめて既読にする
+                count = Notification.objects.filter(
+                    notification_reciever=user,
+                    id__in=notification_ids,
+                    is_checked=False).update(is_checked=True)
+                change_unread_notification_count(user.id, -count)
+            return MarkNotificationsCheckedMutation(count=count)
+        except:
+            raise
+
+
+class MarkAllNotificationsCheckedMutation(relay.ClientIDMutation):
+    class Input:
+        before = graphene.DateTime(required=False)
+
+    count = graphene.Int()
+
+    @validate_token
+    def mutate_and_get_payload(root, info, **input):
+        try:
+            before = input.get('before')
+            user = info.context.current_user
+            notifications = Notification.objects.filter(
+                notification_reciever=user, is_checked=False)
+            if before is not None:
+                notifications = notifications.filter(created_at__lte=before)
+            with transaction.atomic():
+                count = notifications.update(is_checked=True)
+                change_unread_notification_count(user.id, -count)
+            return MarkAllNotificationsCheckedMutation(count=count)
+        except:
+            raise
+
+
 class CreateReportMutation(relay.ClientIDMutation):
     class Input:
         title = graphene.String(required=True)
@@ -666,7 +859,7 @@ class CreateReportMutation(relay.ClientIDMutation):
         try:
             title = input.get('title')
             content = input.get('content')
-            user = get_user_model().objects.get(email=info.context.user.email)
+            user = info.context.current_user
             report = Report(reporter=user, title=title, content=content)
             return CreateReportMutation(report=report)
         except:
@@ -709,6 +902,9 @@ class Mutation(graphene.ObjectType):
     # notification
     create_notification = CreateNotificationMutation.Field()
     update_notification = UpdateNotificationMutation.Field()
+    mark_notifications_checked = MarkNotificationsCheckedMutation.Field()
+    mark_all_notifications_checked = MarkAllNotificationsCheckedMutation.Field(
+    )
 
     # report
     create_report = CreateReportMutation.Field()
@@ -729,6 +925,8 @@ class Query(graphene.ObjectType):
     topic = graphene.Field(TopicNode,
                            topic_name=graphene.NonNull(graphene.String))
     all_topics = DjangoFilterConnectionField(TopicNode)
+    ideas_by_topic = relay.ConnectionField(
+        IdeaNode._meta.connection, topic_name=graphene.String(required=True))
 
     # like
     my_like_ideas = DjangoFilterConnectionField(LikeNode)
@@ -736,16 +934,23 @@ class Query(graphene.ObjectType):
 
     # idea
     idea = graphene.Field(IdeaNode, id=graphene.NonNull(graphene.ID))
-    all_ideas = DjangoFilterConnectionField(IdeaNode)
+    all_ideas = KeysetConnectionField(IdeaNode)
     my_all_ideas = DjangoFilterConnectionField(IdeaNode)
+    search_ideas = relay.ConnectionField(
+        IdeaNode._meta.connection, query=graphene.String(required=True))
+    my_timeline = relay.ConnectionField(IdeaNode._meta.connection)
+    trending_ideas = relay.ConnectionField(IdeaNode._meta.connection)
 
     # memo
     memo = graphene.Field(MemoNode, id=graphene.NonNull(graphene.ID))
-    all_memos = DjangoFilterConnectionField(MemoNode)
+    all_memos = KeysetConnectionField(MemoNode)
     my_all_memos = DjangoFilterConnectionField(MemoNode)
+    search_memos = relay.ConnectionField(
+        MemoNode._meta.connection, query=graphene.String(required=True))
 
     # notification
-    all_my_notifications = DjangoFilterConnectionField(NotificationNode)
+    all_my_notifications = KeysetConnectionField(NotificationNode)
+    my_unread_notification_count = graphene.Int()
 
     # annouce
     all_announce = DjangoFilterConnectionField(AnnounceNode)
@@ -760,8 +965,7 @@ class Query(graphene.ObjectType):
 
     @validate_token
     def resolve_my_user_info(self, info):
-        email = info.context.user.email
-        return get_user_model().objects.get(email=email)
+        return info.context.current_user
 
     def resolve_all_profiles(self, info, **kwargs):
         return Profile.objects.all()
@@ -769,7 +973,7 @@ class Query(graphene.ObjectType):
     # follow
     @validate_token
     def resolve_my_followings(self, info, **kwargs):
-        user = get_user_model().objects.get(email=info.context.user.email)
+        user = info.context.current_user
         return Follow.objects.filter(following_user=user)
 
     # topic
@@ -781,16 +985,30 @@ class Query(graphene.ObjectType):
     def resolve_all_topics(self, info, **kwargs):
         return Topic.objects.all()
 
+    def resolve_ideas_by_topic(self, info, topic_name, **kwargs):
+        reject_backward_paging(kwargs)
+        first = get_page_size(kwargs.get('first'))
+        after = kwargs.get('after')
+        if after:
+            after = IdKeysetConnectionField.decode_cursor(Idea, after)[0]
+        # 次のページの有無を知るために1件多く取得する
+        ideas = topics.get_topic_ideas(topic_name, first + 1, after)
+        return IdKeysetConnectionField.connection_from_rows(
+            IdeaNode._meta.connection,
+            ideas[:first],
+            has_previous_page=bool(after),
+            has_next_page=len(ideas) > first)
+
     # like
     @validate_token
     def resolve_my_like_ideas(self, info, **kwargs):
-        user = get_user_model().objects.get(email=info.context.user.email)
+        user = info.context.current_user
         likes = Like.objects.filter(liked_user=user, like_target_type='Idea')
         return likes
 
     @validate_token
     def resolve_my_like_memos(self, info, **kwargs):
-        user = get_user_model().objects.get(email=info.context.user.email)
+        user = info.context.current_user
         likes = Like.objects.filter(liked_user=user, like_target_type='Memo')
         return likes
 
@@ -805,10 +1023,46 @@ class Query(graphene.ObjectType):
 
     @validate_token
     def resolve_my_all_ideas(self, info, **kwargs):
-        user = get_user_model().objects.get(email=info.context.user.email)
+        user = info.context.current_user
         ideas = Idea.objects.filter(idea_creator=user)
         return ideas
 
+    @validate_token
+    def resolve_my_timeline(self, info, **kwargs):
+        reject_backward_paging(kwargs)
+        first = get_page_size(kwargs.get('first'))
+        after = kwargs.get('after')
+        if after:
+            after = KeysetConnectionField.decode_cursor(Idea, after)
+        # 次のページの有無を知るために1件多く取得する
+        ideas = timeline.get_timeline(info.context.current_user.id,
+                                      first + 1, after)
+        return KeysetConnectionField.connection_from_rows(
+            IdeaNode._meta.connection,
+            ideas[:first],
+            has_previous_page=bool(after),
+            has_next_page=len(ideas) > first)
+
+    def resolve_trending_ideas(self, info, **kwargs):
+        reject_backward_paging(kwargs)
+        first = get_page_size(kwargs.get('first'))
+        after = kwargs.get('after')
+        if after:
+            after = ScoreKeysetConnectionField.decode_cursor(
+                TrendingScore, after)
+        # 次のページの有無を知るために1件多く取得する
+        rows = trending.get_trending(first + 1, after)
+        return ScoreKeysetConnectionField.connection_from_rows(
+            IdeaNode._meta.connection,
+            rows[:first],
+            has_previous_page=bool(after),
+            has_next_page=len(rows) > first)
+
+    def resolve_search_ideas(self, info, query, **kwargs):
+        return resolve_search_connection(IdeaNode._meta.connection, Idea,
+                                         search.search_idea_ids, query,
+                                         **kwargs)
+
     # memo
     def resolve_memo(self, info, **kwargs):
         id = kwargs.get('id')
@@ -820,17 +1074,26 @@ class Query(graphene.ObjectType):
 
     @validate_token
     def resolve_my_all_memos(self, info, **kwargs):
-        user = get_user_model().objects.get(email=info.context.user.email)
+        user = info.context.current_user
         memos = Memo.objects.filter(memo_creator=user)
         return memos
 
+    def resolve_search_memos(self, info, query, **kwargs):
+        return resolve_search_connection(MemoNode._meta.connection, Memo,
+                                         search.search_memo_ids, query,
+                                         **kwargs)
+
     # notification
     @validate_token
     def resolve_all_my_notifications(self, info, **kwargs):
-        user: User = get_user_model().objects.get(email=kwargs.get('email'))
+        user: User = info.context.current_user
         notifications = Notification.objects.filter(notification_reciever=user)
         return notifications
 
+    @validate_token
+    def resolve_my_unread_notification_count(self, info, **kwargs):
+        return get_unread_notification_count(info.context.current_user.id)
+
     # announce
     def resolve_all_announces(self, info, **kwargs):
         announces = Announce.objects.all()
@@ -846,26 +1109,10 @@ class Subscription(graphene.ObjectType):
             await asyncio.sleep(1.)
         yield up_to
 
-    new_notifications = DjangoFilterConnectionField(
-        NotificationNode, user_id=graphene.ID(required=True))
+    new_notifications = graphene.Field(NotificationNode)
 
-    async def resolve_new_notifications(root, info, **kwargs):
-        # from asgiref.sync import sync_to_async
-        notifications = Notification.objects.all()
-        # notifications = sync_to_async(Notification.objects.all())
-        print(notifications)
-        return notifications
-        # ideas = sync_to_async(Idea.objects.all())
-        # print(ideas)
-        # messages = asyncio.get_event_loop()
-        # print(messages)
-        # user_id = await kwargs.get('user_id')
-        # print(user_id)
-        # user = await get_user_model().objects.get(id=from_global_id(user_id)[1]
-        #   )
-        # await print(user)
-        # while True:
-        #     print('hoge')
-        #     await asyncio.sleep(1)
-        #     yield Notification.objects.filter(notofication_reciever=user,
-        #                                       is_checked=False)
+    # 接続時に検証したトークンのユーザー宛ての通知だけを配信する
+    def resolve_new_notifications(root, info):
+        if info.context.current_user is None:
+            raise ValueError(info.context.auth_error)
+        return subscribe_notifications(info.context.current_user.id)
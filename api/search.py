@@ -0,0 +1,231 @@
+import re
+import unicodedata
+
+from django.db import connections
+
+# 日本語は分かち書きされないため、文字のbigramを索引の単位にする
+_SEGMENT_RE = re.compile(r'[^\W_]+')
+
+# titleをcontentより重く評価する
+TITLE_WEIGHT = 2.0
+CONTENT_WEIGHT = 1.0
+
+IDEA_INDEX_TABLE = 'api_idea_search'
+MEMO_INDEX_TABLE = 'api_memo_search'
+
+
+def _segments(text):
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    return _SEGMENT_RE.findall(text)
+
+
+def _bigrams(segment):
+    if len(segment) == 1:
+        return [segment]
+    return [segment[i:i + 2] for i in range(len(segment) - 1)]
+
+
+# 索引に保存するためにテキストをbigramの列に変換する
+def tokenize(text):
+    return ' '.join(token for segment in _segments(text)
+                    for token in _bigrams(segment))
+
+
+# 検索語をFTS5のMATCH式に変換する(語ごとにbigramのフレーズで連続を保証する)
+def build_match_query(query):
+    phrases = []
+    for segment in _segments(query):
+        if len(segment) == 1:
+            phrases.append('"%s"*' % segment)
+        else:
+            phrases.append('"%s"' % ' '.join(_bigrams(segment)))
+    return ' AND '.join(phrases)
+
+
+def _like_pattern(term):
+    term = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return '%' + term + '%'
+
+
+def _vendor(using):
+    return connections[using].vendor
+
+
+# 索引の作成・削除(マイグレーションから呼ぶ)
+def create_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5("
+            "title, content, tokenize='unicode61')" % IDEA_INDEX_TABLE)
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5("
+            "title, tokenize='unicode61')" % MEMO_INDEX_TABLE)
+    elif vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table, column in (('api_idea', 'title'), ('api_idea', 'content'),
+                              ('api_memo', 'title')):
+            schema_editor.execute(
+                'CREATE INDEX IF NOT EXISTS %s_%s_trgm ON %s '
+                'USING gin (%s gin_trgm_ops)' % (table, column, table, column))
+
+
+def drop_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS %s' % IDEA_INDEX_TABLE)
+        schema_editor.execute('DROP TABLE IF EXISTS %s' % MEMO_INDEX_TABLE)
+    elif vendor == 'postgresql':
+        for table, column in (('api_idea', 'title'), ('api_idea', 'content'),
+                              ('api_memo', 'title')):
+            schema_editor.execute('DROP INDEX IF EXISTS %s_%s_trgm' %
+                                  (table, column))
+
+
+# 公開されているアイデア・メモから索引を作り直す(bulk_create後などに使う)
+def rebuild_index(idea_model, memo_model, using='default', batch_size=2000):
+    if _vendor(using) != 'sqlite':
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute('DELETE FROM %s' % IDEA_INDEX_TABLE)
+        cursor.execute('DELETE FROM %s' % MEMO_INDEX_TABLE)
+        ideas = idea_model.objects.using(using).filter(
+            is_published=True).values_list('id', 'title', 'content')
+        rows = []
+        for id, title, content in ideas.iterator(chunk_size=batch_size):
+            rows.append((id, tokenize(title), tokenize(content)))
+            if len(rows) >= batch_size:
+                cursor.executemany(
+                    'INSERT INTO %s (rowid, title, content) '
+                    'VALUES (%%s, %%s, %%s)' % IDEA_INDEX_TABLE, rows)
+                rows = []
+        if rows:
+            cursor.executemany(
+                'INSERT INTO %s (rowid, title, content) VALUES (%%s, %%s, %%s)'
+                % IDEA_INDEX_TABLE, rows)
+
+        memos = memo_model.objects.using(using).filter(
+            is_published=True).values_list('id', 'title')
+        rows = [(id, tokenize(title))
+                for id, title in memos.iterator(chunk_size=batch_size)]
+        cursor.executemany(
+            'INSERT INTO %s (rowid, title) VALUES (%%s, %%s)' %
+            MEMO_INDEX_TABLE, rows)
+
+
+# 保存時に索引を更新する(非公開になったものは索引から外す)
+def update_idea_index(idea, using='default'):
+    if _vendor(using) != 'sqlite':
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % IDEA_INDEX_TABLE,
+                       [idea.id])
+        if idea.is_published:
+            cursor.execute(
+                'INSERT INTO %s (rowid, title, content) VALUES (%%s, %%s, %%s)'
+                % IDEA_INDEX_TABLE,
+                [idea.id, tokenize(idea.title),
+                 tokenize(idea.content)])
+
+
+def delete_idea_index(idea_id, using='default'):
+    if _vendor(using) != 'sqlite':
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % IDEA_INDEX_TABLE,
+                       [idea_id])
+
+
+def update_memo_index(memo, using='default'):
+    if _vendor(using) != 'sqlite':
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % MEMO_INDEX_TABLE,
+                       [memo.id])
+        if memo.is_published:
+            cursor.execute(
+                'INSERT INTO %s (rowid, title) VALUES (%%s, %%s)' %
+                MEMO_INDEX_TABLE, [memo.id, tokenize(memo.title)])
+
+
+def delete_memo_index(memo_id, using='default'):
+    if _vendor(using) != 'sqlite':
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % MEMO_INDEX_TABLE,
+                       [memo_id])
+
+
+def _search_sqlite(cursor, table, weights, query, offset, limit):
+    match = build_match_query(query)
+    if not match:
+        return []
+    cursor.execute(
+        'SELECT rowid FROM {table} WHERE {table} MATCH %s '
+        'ORDER BY bm25({table}, {weights}), rowid DESC '
+        'LIMIT %s OFFSET %s'.format(table=table, weights=weights),
+        [match, limit, offset])
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _search_postgresql(cursor, table, columns, query, offset, limit):
+    terms = query.split()
+    if not terms:
+        return []
+    conditions = []
+    params = []
+    for term in terms:
+        conditions.append('(' + ' OR '.join('%s ILIKE %%s' % column
+                                            for column in columns) + ')')
+        params.extend([_like_pattern(term)] * len(columns))
+    rank = ' + '.join(
+        '%s * word_similarity(%%s, %s)' % (weight, column)
+        for column, weight in zip(columns, (TITLE_WEIGHT, CONTENT_WEIGHT)))
+    params.extend([query] * len(columns))
+    cursor.execute(
+        'SELECT id FROM {table} WHERE is_published AND {conditions} '
+        'ORDER BY {rank} DESC, id DESC LIMIT %s OFFSET %s'.format(
+            table=table, conditions=' AND '.join(conditions), rank=rank),
+        params + [limit, offset])
+    return [row[0] for row in cursor.fetchall()]
+
+
+# 関連度順にアイデアのidを返す
+def search_idea_ids(query, offset=0, limit=20, using='default'):
+    vendor = _vendor(using)
+    with connections[using].cursor() as cursor:
+        if vendor == 'sqlite':
+            return _search_sqlite(cursor, IDEA_INDEX_TABLE,
+                                  '%s, %s' % (TITLE_WEIGHT, CONTENT_WEIGHT),
+                                  query, offset, limit)
+        if vendor == 'postgresql':
+            return _search_postgresql(cursor, 'api_idea',
+                                      ('title', 'content'), query, offset,
+                                      limit)
+    from .models import Idea
+    ideas = Idea.objects.using(using).filter(is_published=True)
+    for term in query.split():
+        ideas = ideas.filter(title__icontains=term) | ideas.filter(
+            content__icontains=term)
+    return list(
+        ideas.order_by('-created_at').values_list(
+            'id', flat=True)[offset:offset + limit])
+
+
+# 関連度順にメモのidを返す
+def search_memo_ids(query, offset=0, limit=20, using='default'):
+    vendor = _vendor(using)
+    with connections[using].cursor() as cursor:
+        if vendor == 'sqlite':
+            return _search_sqlite(cursor, MEMO_INDEX_TABLE, TITLE_WEIGHT,
+                                  query, offset, limit)
+        if vendor == 'postgresql':
+            return _search_postgresql(cursor, 'api_memo', ('title', ),
+                                      query, offset, limit)
+    from .models import Memo
+    memos = Memo.objects.using(using).filter(is_published=True)
+    for term in query.split():
+        memos = memos.filter(title__icontains=term)
+    return list(
+        memos.order_by('-created_at').values_list(
+            'id', flat=True)[offset:offset + limit])
@@ -0,0 +1,331 @@
+import itertools
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+
+from . import search, timeline, trending
+from .counters import RECONCILERS
+from .models import (Announce, Comment, Follow, Idea, Like, Memo,
+                     Notification, Profile, Thread, Topic)
+
+WORDS = [
+    'アイデア', '共有', 'アプリ', '料理', 'レシピ', '旅行', '写真', '音楽', '学習', '機械学習',
+    'プログラミング', 'Python', 'デザイン', '健康', '運動', '読書', '映画', '地図', '天気',
+    '家計簿', '日記', 'ゲーム', '子育て', '農業', '翻訳', '配達', '通知', '予約', '在庫'
+]
+
+
+# 順位の-exponent乗に比例する累積の重み(random.choicesのcum_weightsに渡す)
+def power_law_weights(n, exponent=1.0):
+    return list(
+        itertools.accumulate(1 / (rank + 1)**exponent for rank in range(n)))
+
+
+def _text(rng, n_words):
+    return ''.join(rng.choice(WORDS) for _ in range(n_words))
+
+
+def _last_id(model):
+    return model.objects.order_by('-id').values_list('id',
+                                                     flat=True).first() or 0
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Seeder:
+    """
+    合成データをチャンクごとのbulk_createで作成する
+    行は生成しながら書き込むので、件数が増えてもメモリに載せるのはidの一覧だけになる
+    投稿する人・フォローされる人・反応される投稿の偏りは順位のべき乗分布にする
+    (exponentが大きいほど先頭に集中する)
+    """
+    def __init__(self,
+                 rng,
+                 batch_size=5000,
+                 progress=None,
+                 email_prefix='seed',
+                 author_exponent=1.0,
+                 follow_exponent=1.0,
+                 popularity_exponent=1.0):
+        self.rng = rng
+        self.batch_size = batch_size
+        self.progress = progress
+        self.email_prefix = email_prefix
+        self.author_exponent = author_exponent
+        self.follow_exponent = follow_exponent
+        self.popularity_exponent = popularity_exponent
+        self.user_ids = []
+        self.author_weights = []
+        self.topic_ids = []
+        self.idea_ids = []
+        self.memo_ids = []
+        self.comment_ids = []
+        self.idea_weights = []
+        self.memo_weights = []
+        self.comment_weights = []
+
+    def _report(self, label, done, total, started):
+        if self.progress is not None:
+            self.progress(label, done, total, time.perf_counter() - started)
+
+    # 行をチャンクごとに書き込み、チャンクごとに作成した行のidを返す
+    def _insert(self, model, rows, total, label, ignore_conflicts=False):
+        started = time.perf_counter()
+        done = 0
+        for chunk in _chunks(rows, self.batch_size):
+            last_id = _last_id(model) if not ignore_conflicts else None
+            model.objects.bulk_create(chunk,
+                                      ignore_conflicts=ignore_conflicts)
+            done += len(chunk)
+            self._report(label, done, total, started)
+            if ignore_conflicts:
+                yield []
+            else:
+                # bulk_createで主キーが返らないDBでもidを取得する
+                yield list(
+                    model.objects.filter(id__gt=last_id).order_by(
+                        'id').values_list('id', flat=True))
+
+    def _insert_all(self, model, rows, total, label, ignore_conflicts=False):
+        return list(
+            itertools.chain.from_iterable(
+                self._insert(model, rows, total, label, ignore_conflicts)))
+
+    def _choose(self, ids, cum_weights, k=1):
+        return self.rng.choices(ids, cum_weights=cum_weights, k=k)
+
+    def users(self, n):
+        User = get_user_model()
+        # create_userはユーザーごとにハッシュ化して保存するので使わず、
+        # 1回だけ計算した使えないパスワードを全員に設定する
+        password = make_password(None)
+        rows = (User(email='%s%d@example.com' % (self.email_prefix, i),
+                     username='%s%d' % (self.email_prefix, i),
+                     password=password) for i in range(n))
+        user_ids = self._insert_all(User, rows, n, 'users')
+        self._insert_all(
+            Profile,
+            (Profile(related_user_id=user_id,
+                     profile_name='%s%d' % (self.email_prefix[:10], i))
+             for i, user_id in enumerate(user_ids)), n, 'profiles')
+        self.user_ids = user_ids
+        self.author_weights = power_law_weights(len(user_ids),
+                                                self.author_exponent)
+        return user_ids
+
+    def follows(self, n):
+        weights = power_law_weights(len(self.user_ids), self.follow_exponent)
+
+        def rows():
+            for _ in range(n):
+                follower_id = self.rng.choice(self.user_ids)
+                followed_id = self._choose(self.user_ids, weights)[0]
+                if follower_id != followed_id:
+                    yield Follow(following_user_id=follower_id,
+                                 followed_user_id=followed_id)
+
+        # 同じ組み合わせは一意制約で捨てる
+        self._insert_all(Follow, rows(), n, 'follows', ignore_conflicts=True)
+
+    def topics(self, n):
+        prefix = self.email_prefix[:6]
+        self.topic_ids = self._insert_all(
+            Topic, (Topic(name='%s%d' % (prefix, i),
+                          display_name='%s topic %d' % (prefix, i))
+                    for i in range(n)), n, 'topics')
+        return self.topic_ids
+
+    def ideas(self, n, published_ratio=0.9):
+        rows = (Idea(idea_creator_id=creator_id,
+                     title=_text(self.rng, 3)[:30],
+                     content=_text(self.rng, self.rng.randint(10, 100)),
+                     is_published=self.rng.random() < published_ratio)
+                for creator_id in (self._choose(self.user_ids,
+                                                self.author_weights)[0]
+                                   for _ in range(n)))
+        Through = Idea.topics.through
+        self.idea_ids = []
+        for ids in self._insert(Idea, rows, n, 'ideas'):
+            self.idea_ids.extend(ids)
+            Through.objects.bulk_create([
+                Through(idea_id=idea_id, topic_id=topic_id)
+                for idea_id in ids for topic_id in self.rng.sample(
+                    self.topic_ids, min(len(self.topic_ids),
+                                        self.rng.randint(0, 3)))
+            ])
+        self.idea_weights = power_law_weights(len(self.idea_ids),
+                                              self.popularity_exponent)
+        return self.idea_ids
+
+    def memos(self, n, published_ratio=0.9):
+        rows = (Memo(memo_creator_id=creator_id,
+                     title=_text(self.rng, 3)[:50],
+                     is_published=self.rng.random() < published_ratio)
+                for creator_id in (self._choose(self.user_ids,
+                                                self.author_weights)[0]
+                                   for _ in range(n)))
+        self.memo_ids = self._insert_all(Memo, rows, n, 'memos')
+        self.memo_weights = power_law_weights(len(self.memo_ids),
+                                              self.popularity_exponent)
+        return self.memo_ids
+
+    # コメントの対象(アイデアかメモ)を人気の偏りに従って選ぶ
+    def _target(self, idea_ratio=0.8):
+        if self.memo_ids and (not self.idea_ids
+                              or self.rng.random() >= idea_ratio):
+            return 'Memo', self._choose(self.memo_ids, self.memo_weights)[0]
+        return 'Idea', self._choose(self.idea_ids, self.idea_weights)[0]
+
+    def comments(self, n):
+        threads = {}
+        self.comment_ids = []
+        if not (self.idea_ids or self.memo_ids):
+            n = 0
+        started = time.perf_counter()
+        for chunk in _chunks((self._target() for _ in range(n)),
+                             self.batch_size):
+            # コメントが付いた投稿にだけスレッドを作る
+            new_targets = sorted(set(chunk) - set(threads))
+            last_id = _last_id(Thread)
+            Thread.objects.bulk_create([
+                Thread(thread_target_type=target_type,
+                       target_idea_id=target_id
+                       if target_type == 'Idea' else None,
+                       target_memo_id=target_id
+                       if target_type == 'Memo' else None)
+                for target_type, target_id in new_targets
+            ])
+            threads.update(
+                zip(
+                    new_targets,
+                    Thread.objects.filter(id__gt=last_id).order_by(
+                        'id').values_list('id', flat=True)))
+            last_id = _last_id(Comment)
+            Comment.objects.bulk_create([
+                Comment(commentor_id=self.rng.choice(self.user_ids),
+                        target_thread_id=threads[target],
+                        content=_text(self.rng, self.rng.randint(2, 20)))
+                for target in chunk
+            ])
+            self.comment_ids.extend(
+                Comment.objects.filter(id__gt=last_id).order_by(
+                    'id').values_list('id', flat=True))
+            self._report('comments', len(self.comment_ids), n, started)
+        self.comment_weights = power_law_weights(len(self.comment_ids),
+                                                 self.popularity_exponent)
+        return self.comment_ids
+
+    def likes(self, n):
+        targets = [
+            ('Idea', 'liked_idea_id', self.idea_ids, self.idea_weights),
+            ('Memo', 'liked_memo_id', self.memo_ids, self.memo_weights),
+            ('Comment', 'liked_comment_id', self.comment_ids,
+             self.comment_weights),
+        ]
+        targets = [target for target in targets if target[2]]
+        if not targets:
+            return
+        # アイデア・メモ・コメントへのいいねを7:2:1の割合にする
+        target_weights = {'Idea': 7, 'Memo': 2, 'Comment': 1}
+
+        def rows():
+            for _ in range(n):
+                target_type, field_name, ids, weights = self.rng.choices(
+                    targets,
+                    weights=[target_weights[t[0]] for t in targets])[0]
+                yield Like(liked_user_id=self.rng.choice(self.user_ids),
+                           like_target_type=target_type,
+                           **{field_name: self._choose(ids, weights)[0]})
+
+        # 同じ投稿への2回目のいいねは一意制約で捨てる
+        self._insert_all(Like, rows(), n, 'likes', ignore_conflicts=True)
+
+    def notifications(self, n, checked_ratio=0.7):
+        def rows():
+            for reciever_id in (self._choose(self.user_ids,
+                                             self.author_weights)[0]
+                                for _ in range(n)):
+                notification_type = self.rng.choice(
+                    ['Like', 'Comment', 'Follow'])
+                if not self.idea_ids:
+                    notification_type = 'Follow'
+                if notification_type == 'Follow':
+                    item_type, item_id = 'FollowedUser', reciever_id
+                else:
+                    item_type = 'Idea'
+                    item_id = self._choose(self.idea_ids, self.idea_weights)[0]
+                yield Notification(
+                    notificator_id=self.rng.choice(self.user_ids),
+                    notification_reciever_id=reciever_id,
+                    notification_type=notification_type,
+                    notified_item_type=item_type,
+                    notified_item_id=item_id,
+                    is_checked=self.rng.random() < checked_ratio)
+
+        self._insert_all(Notification, rows(), n, 'notifications')
+
+    def announces(self, n):
+        self._insert_all(
+            Announce, (Announce(title=_text(self.rng, 2)[:100],
+                                content=_text(self.rng, 20)[:1000],
+                                is_important=self.rng.random() < 0.1)
+                       for _ in range(n)), n, 'announces')
+
+    # bulk_createはシグナルを送らないので、検索の索引・カウンタ・タイムライン・話題度を作り直す
+    def rebuild_derived(self):
+        started = time.perf_counter()
+        search.rebuild_index(Idea, Memo, batch_size=self.batch_size)
+        self._report('search index', 1, 1, started)
+        for name, reconcile in RECONCILERS.items():
+            started = time.perf_counter()
+            reconcile(self.batch_size)
+            self._report(name, 1, 1, started)
+        started = time.perf_counter()
+        timeline.rebuild(self.batch_size)
+        self._report('timeline', 1, 1, started)
+        started = time.perf_counter()
+        trending.reset()
+        trending.refresh(self.batch_size)
+        self._report('trending', 1, 1, started)
+
+
+def seed_dataset(rng,
+                 users=1000,
+                 followings=20,
+                 topics=20,
+                 ideas=10000,
+                 memos=0,
+                 comments=20000,
+                 likes=50000,
+                 notifications=20000,
+                 announces=0,
+                 batch_size=5000,
+                 progress=None,
+                 **kwargs):
+    """ベンチマーク用のデータを作成し、作成した行のidを返す"""
+    seeder = Seeder(rng, batch_size=batch_size, progress=progress, **kwargs)
+    seeder.users(users)
+    seeder.follows(users * followings)
+    seeder.topics(topics)
+    seeder.ideas(ideas)
+    seeder.memos(memos)
+    seeder.comments(comments)
+    seeder.likes(likes)
+    seeder.notifications(notifications)
+    seeder.announces(announces)
+    seeder.rebuild_derived()
+    return {
+        'users': seeder.user_ids,
+        'topics': seeder.topic_ids,
+        'ideas': seeder.idea_ids,
+        'memos': seeder.memo_ids,
+        'comments': seeder.comment_ids,
+    }
@@ -0,0 +1,73 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import response_cache, search, trending
+from .counters import change_unread_notification_count
+from .models import (Announce, Comment, Idea, Memo, Notification, Profile,
+                     Topic, User)
+from .notifications import publish_notification_on_commit
+
+
+# 全文検索の索引を保存・削除に合わせて更新する
+@receiver(post_save, sender=Idea)
+def update_idea_search_index(sender, instance, using, **kwargs):
+    search.update_idea_index(instance, using=using)
+
+
+@receiver(post_delete, sender=Idea)
+def delete_idea_search_index(sender, instance, using, **kwargs):
+    search.delete_idea_index(instance.id, using=using)
+
+
+@receiver(post_save, sender=Memo)
+def update_memo_search_index(sender, instance, using, **kwargs):
+    search.update_memo_index(instance, using=using)
+
+
+@receiver(post_delete, sender=Memo)
+def delete_memo_search_index(sender, instance, using, **kwargs):
+    search.delete_memo_index(instance.id, using=using)
+
+
+# 話題度の次の集計で加えるように、アイデアの投稿とコメントの作成・削除を記録する
+@receiver(post_save, sender=Idea)
+def record_trending_idea(sender, instance, created, **kwargs):
+    if created:
+        trending.record_idea(instance)
+
+
+@receiver(post_save, sender=Comment)
+def record_trending_comment(sender, instance, created, **kwargs):
+    if created:
+        trending.record_comment(instance, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def record_trending_comment_deletion(sender, instance, **kwargs):
+    trending.record_comment(instance, -1)
+
+
+# 作成された通知を未読数に加え、受け取るユーザーに配信する
+@receiver(post_save, sender=Notification)
+def publish_created_notification(sender, instance, created, **kwargs):
+    if created:
+        if not instance.is_checked:
+            change_unread_notification_count(
+                instance.notification_reciever_id, 1)
+        publish_notification_on_commit(instance)
+
+
+# 未ログインのクエリのレスポンスキャッシュを無効にする
+def invalidate_response_cache(sender, using, **kwargs):
+    response_cache.invalidate_on_commit(sender.__name__, using=using)
+
+
+def invalidate_topics_response_cache(sender, using, **kwargs):
+    response_cache.invalidate_on_commit('Idea', 'Topic', using=using)
+
+
+for model in (Idea, Memo, Topic, Announce, User, Profile):
+    post_save.connect(invalidate_response_cache, sender=model)
+    post_delete.connect(invalidate_response_cache, sender=model)
+m2m_changed.connect(invalidate_topics_response_cache,
+                    sender=Idea.topics.through)
@@ -0,0 +1,106 @@
+from types import SimpleNamespace
+
+from channels.db import database_sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ObjectDoesNotExist
+from django.urls import path
+from graphene_django.settings import graphene_settings
+from graphql_ws.constants import WS_PROTOCOL
+from graphql_ws.django.consumers import GraphQLSubscriptionConsumer
+from graphql_ws.django.subscriptions import ChannelsSubscriptionServer
+
+from . import validation
+
+# 接続時に認証情報が送られなかった場合のエラー
+UNAUTHORIZED = '401 Unauthorized'
+
+
+class SubscriptionContext:
+    """
+    購読のリゾルバのinfo.context
+    接続時に検証したユーザーをcurrent_userに、検証できなかった理由をauth_errorに持たせる
+    """
+    def __init__(self, current_user=None, auth_error=UNAUTHORIZED):
+        self.current_user = current_user
+        self.auth_error = auth_error
+        self.user = SimpleNamespace(
+            email=current_user.email if current_user else None)
+
+
+def get_authorization(scope, connection_params=None):
+    """
+    接続時のconnectionParamsのauthorization、
+    無ければWebSocketのハンドシェイクのAuthorizationヘッダーを返す
+    """
+    if isinstance(connection_params, dict):
+        for key in ('authorization', 'Authorization'):
+            if connection_params.get(key):
+                return str(connection_params[key])
+    for name, value in (scope or {}).get('headers', []):
+        if name.lower() == b'authorization':
+            return value.decode('latin1')
+    return ''
+
+
+def authenticate(authorization):
+    """
+    Bearerトークンを検証し、トークンのユーザーを返す
+    検証できない場合はvalidate_tokenと同じメッセージのValueErrorを送出する
+    """
+    if authorization == '':
+        raise ValueError(UNAUTHORIZED)
+    if authorization[:6] != 'Bearer':
+        raise ValueError('Not Bearer Token!')
+    email = validation.verify_token(authorization[7:])['email']
+    return get_user_model().objects.get(email=email)
+
+
+class AuthenticatedSubscriptionServer(ChannelsSubscriptionServer):
+    async def on_connect(self, connection_context, payload):
+        authorization = get_authorization(connection_context.request_context,
+                                          payload)
+        # 証明書の取得やユーザーの取得でイベントループを止めないよう、
+        # 接続時に1度だけ別スレッドで検証し、購読ごとには検証しない
+        try:
+            connection_context.user = await database_sync_to_async(
+                authenticate)(authorization)
+            connection_context.auth_error = None
+        except (ValueError, ObjectDoesNotExist) as error:
+            connection_context.user = None
+            connection_context.auth_error = str(error)
+
+    def get_graphql_params(self, connection_context, payload):
+        params = super().get_graphql_params(connection_context, payload)
+        # クライアントが送ったcontextは使わず、接続時に検証したユーザーだけから作る
+        params['context_value'] = SubscriptionContext(
+            getattr(connection_context, 'user', None),
+            getattr(connection_context, 'auth_error', UNAUTHORIZED))
+        return params
+
+
+subscription_server = AuthenticatedSubscriptionServer(
+    schema=graphene_settings.SCHEMA)
+
+
+class SubscriptionConsumer(GraphQLSubscriptionConsumer):
+    async def connect(self):
+        self.connection_context = None
+        if WS_PROTOCOL in self.scope['subprotocols']:
+            self.connection_context = await subscription_server.handle(
+                ws=self, request_context=self.scope)
+            await self.accept(subprotocol=WS_PROTOCOL)
+        else:
+            await self.close()
+
+    async def disconnect(self, code):
+        if self.connection_context:
+            self.connection_context.socket_closed = True
+            await subscription_server.on_close(self.connection_context)
+
+    async def receive_json(self, content):
+        subscription_server.on_message(self.connection_context, content)
+
+
+websocket_urlpatterns = [
+    path('subscriptions', SubscriptionConsumer.as_asgi()),
+]
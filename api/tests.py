@@ -1,3 +1,1638 @@
-from django.test import TestCase
+import asyncio
+import base64
+import io
+import json
+import random
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+from django.utils import timezone
+from graphql_relay import to_global_id
+from PIL import Image
+
+from api.counters import (change_like_count, change_topic_idea_counts,
+                          change_unread_notification_count,
+                          get_unread_notification_count)
+from api import (images, jobs, notifications, persisted, response_cache,
+                 routers, timeline, topics, tracing, trending, uploads,
+                 validation)
+from api.models import (Comment, Follow, Idea, Job, Like, Notification,
+                        NotificationCounter, PersistedQuery, Profile, Thread,
+                        TimelineEntry, Topic, TrendingEvent, TrendingScore)
+from api.pagination import KeysetConnectionField
+from api.seed import seed_dataset
+from api.subscriptions import SubscriptionConsumer
+from api.views import GraphQLView, async_graphql_view
+from project.asgi import application
+from project.schema import schema
+
+NEW_NOTIFICATIONS = 'subscription { newNotifications { notificationType } }'
+
+
+def create_user(name):
+    return get_user_model().objects.create_user(email='%s@example.com' % name,
+                                                username=name,
+                                                password=None)
+
+
+def create_idea(creator, **kwargs):
+    return Idea.objects.create(idea_creator=creator,
+                               title=kwargs.pop('title', 'title'),
+                               content='content',
+                               **kwargs)
+
+
+def base64_json(value):
+    return base64.b64encode(json.dumps(value).encode()).decode()
+
+
+def create_notification(notificator, receiver, **kwargs):
+    return Notification.objects.create(notificator=notificator,
+                                       notification_reciever=receiver,
+                                       notification_type='Like',
+                                       notified_item_type='Idea',
+                                       notified_item_id=1,
+                                       **kwargs)
+
+
+# トークンの文字列をそのままメールアドレスとして検証済みにする
+def fake_verify_token(token):
+    return {'email': token}
+
+
+class GraphQLTestCase(TestCase):
+    """/graphql/にPOSTするテスト(Bearerのトークンはユーザーのメールアドレスにする)"""
+    def setUp(self):
+        caches['default'].clear()
+        patcher = mock.patch('api.validation.verify_token', fake_verify_token)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def query(self, query, variables=None, user=None):
+        headers = {}
+        if user is not None:
+            headers['HTTP_AUTHORIZATION'] = 'Bearer ' + user.email
+        response = self.client.post('/graphql/',
+                                    json.dumps({
+                                        'query': query,
+                                        'variables': variables
+                                    }),
+                                    content_type='application/json',
+                                    **headers)
+        return response.json()
+
+    def assertErrorMessage(self, result, message):
+        self.assertIn(message,
+                      [error['message'] for error in result.get('errors', [])])
+
+
+class TokenCacheTest(TestCase):
+    CERTS_URL = 'https://www.googleapis.com/oauth2/v1/certs'
+
+    def setUp(self):
+        self.certs_request = validation.CachedCertsRequest()
+        self.fetch = mock.Mock()
+        self.certs_request._request = self.fetch
+
+    def respond(self, status, data):
+        self.fetch.return_value = mock.Mock(
+            status=status,
+            headers={'cache-control': 'public, max-age=60'},
+            data=data)
+
+    def get_certs(self, now):
+        with mock.patch('api.validation.time.monotonic', return_value=now):
+            return self.certs_request(self.CERTS_URL)
+
+    def test_certs_are_reused_within_max_age(self):
+        self.respond(200, b'first')
+        self.assertEqual(self.get_certs(100).data, b'first')
+        self.respond(200, b'second')
+        self.assertEqual(self.get_certs(159).data, b'first')
+        self.assertEqual(self.fetch.call_count, 1)
+        self.assertEqual(self.get_certs(160).data, b'second')
+        self.assertEqual(self.fetch.call_count, 2)
+
+    def test_stale_certs_are_used_when_the_fetch_fails(self):
+        self.respond(200, b'good')
+        self.get_certs(100)
+        self.respond(500, b'error')
+        self.assertEqual(self.get_certs(200).data, b'good')
+        # 一度も取得できていない場合は失敗したレスポンスをそのまま返す
+        self.certs_request.clear()
+        self.assertEqual(self.get_certs(300).status, 500)
+
+    def test_least_recently_used_token_is_evicted(self):
+        tokens = validation.VerifiedTokenCache(maxsize=2)
+        exp = time.time() + 60
+        for token in ('a', 'b'):
+            tokens.set(token, {'email': token, 'exp': exp})
+        tokens.get('a')
+        tokens.set('c', {'email': 'c', 'exp': exp})
+        self.assertIsNone(tokens.get('b'))
+        self.assertEqual(tokens.get('a')['email'], 'a')
+        self.assertEqual(tokens.get('c')['email'], 'c')
+
+    def test_token_expires_at_exp(self):
+        tokens = validation.VerifiedTokenCache()
+        exp = time.time() + 60
+        tokens.set('token', {'email': 'a', 'exp': exp})
+        with mock.patch('api.validation.time.time', return_value=exp - 1):
+            self.assertIsNotNone(tokens.get('token'))
+        with mock.patch('api.validation.time.time', return_value=exp):
+            self.assertIsNone(tokens.get('token'))
+        # 期限切れのトークンは保持しない
+        tokens.set('expired', {'email': 'a', 'exp': time.time() - 1})
+        self.assertIsNone(tokens.get('expired'))
+
+    def test_verified_token_is_not_verified_again(self):
+        claims = {'email': 'a@example.com', 'exp': time.time() + 60}
+        with mock.patch.object(validation, 'verified_tokens',
+                               validation.VerifiedTokenCache()):
+            with mock.patch('api.validation.id_token.verify_oauth2_token',
+                            return_value=claims) as verify:
+                self.assertEqual(validation.verify_token('token'), claims)
+                self.assertEqual(validation.verify_token('token'), claims)
+        verify.assert_called_once()
+
+
+class CurrentUserTest(GraphQLTestCase):
+    QUERY = '''
+    query {
+      myUserInfo { username }
+      myAllIdeas { edges { node { title } } }
+      myAllMemos { edges { node { title } } }
+    }'''
+
+    def test_user_is_loaded_once_per_request(self):
+        user = create_user('author')
+        create_idea(user)
+        # ユーザーを引くのは1回だけで、残りは各リゾルバの件数と行の取得
+        with self.assertNumQueries(4):
+            result = self.query(self.QUERY, user=user)
+        self.assertEqual(result['data']['myUserInfo'], {'username': 'author'})
+        self.assertEqual(len(result['data']['myAllIdeas']['edges']), 1)
+
+
+class RelationLoaderTest(GraphQLTestCase):
+    ALL_IDEAS = '''
+    query AllIdeas($first: Int) {
+      allIdeas(first: $first) {
+        edges {
+          node {
+            title
+            ideaCreator { username relatedUser { profileName } }
+            topics { edges { node { name } } }
+          }
+        }
+      }
+    }'''
+
+    def setUp(self):
+        super().setUp()
+        topic = Topic.objects.create(name='topic', display_name='Topic')
+        for i in range(10):
+            user = create_user('author%d' % i)
+            Profile.objects.create(related_user=user, profile_name='p%d' % i)
+            create_idea(user, is_published=True).topics.add(topic)
+
+    def test_query_count_does_not_grow_with_the_page_size(self):
+        with CaptureQueriesContext(connection) as queries:
+            result = self.query(self.ALL_IDEAS, {'first': 2})
+        self.assertEqual(len(result['data']['allIdeas']['edges']), 2)
+        # 関連はページの大きさによらず、階層ごとに1回のクエリでまとめて引く
+        with self.assertNumQueries(len(queries)):
+            result = self.query(self.ALL_IDEAS, {'first': 10})
+        creators = [
+            edge['node']['ideaCreator']
+            for edge in result['data']['allIdeas']['edges']
+        ]
+        self.assertCountEqual(
+            [creator['relatedUser']['profileName'] for creator in creators],
+            ['p%d' % i for i in range(10)])
+        for edge in result['data']['allIdeas']['edges']:
+            self.assertEqual(edge['node']['topics']['edges'],
+                             [{'node': {'name': 'topic'}}])
+
+
+class LikeCountTest(GraphQLTestCase):
+    CREATE_LIKE = '''
+    mutation CreateLike($ideaId: ID!) {
+      createLike(input: {likeTargetType: "Idea", likedIdeaId: $ideaId}) {
+        like { id }
+      }
+    }'''
+    UPDATE_LIKE = '''
+    mutation UpdateLike($likeId: ID!, $isLiked: Boolean!) {
+      updateLike(input: {likeId: $likeId, isLiked: $isLiked}) {
+        like { isLiked }
+      }
+    }'''
+
+    def setUp(self):
+        super().setUp()
+        self.user = create_user('liker')
+        self.idea = create_idea(self.user, is_published=True)
+        self.like = Like.objects.create(liked_user=self.user,
+                                        like_target_type='Idea',
+                                        liked_idea=self.idea)
+
+    def like_count(self):
+        self.idea.refresh_from_db()
+        return self.idea.like_count
+
+    def create_like(self, user):
+        result = self.query(self.CREATE_LIKE,
+                            {'ideaId': to_global_id('IdeaNode', self.idea.id)},
+                            user)
+        return result['data']['createLike']['like']['id']
+
+    def set_liked(self, user, like_id, is_liked):
+        result = self.query(self.UPDATE_LIKE, {
+            'likeId': like_id,
+            'isLiked': is_liked
+        }, user)
+        self.assertNotIn('errors', result)
+
+    def test_increments_and_decrements(self):
+        change_like_count(self.like, 1)
+        change_like_count(self.like, 1)
+        self.assertEqual(self.like_count(), 2)
+        change_like_count(self.like, -1)
+        self.assertEqual(self.like_count(), 1)
+
+    def test_like_mutations_change_the_count(self):
+        other = create_user('other')
+        like_id = self.create_like(other)
+        self.assertEqual(self.like_count(), 1)
+        self.set_liked(other, like_id, False)
+        # 同じ状態への更新では数えない
+        self.set_liked(other, like_id, False)
+        self.assertEqual(self.like_count(), 0)
+        self.set_liked(other, like_id, True)
+        self.assertEqual(self.like_count(), 1)
+
+    def test_liking_again_reuses_the_like(self):
+        other = create_user('other')
+        like_id = self.create_like(other)
+        self.assertEqual(self.create_like(other), like_id)
+        self.set_liked(other, like_id, False)
+        self.assertEqual(self.create_like(other), like_id)
+        self.assertEqual(Like.objects.filter(liked_user=other).count(), 1)
+        self.assertEqual(self.like_count(), 1)
+
+    def test_reconcile_counters_fixes_drift(self):
+        Idea.objects.filter(id=self.idea.id).update(like_count=5)
+        call_command('reconcile_counters',
+                     '--counter=like_count',
+                     stdout=mock.Mock())
+        self.assertEqual(self.like_count(), 1)
+
+    def test_decrement_below_zero_is_clamped(self):
+        Idea.objects.filter(id=self.idea.id).update(like_count=1)
+        change_like_count(self.like, -3)
+        self.assertEqual(self.like_count(), 0)
+
+
+class SearchTest(GraphQLTestCase):
+    SEARCH = '''
+    query Search($first: Int) {
+      searchIdeas(query: "graphql", first: $first) {
+        edges { node { title } }
+        pageInfo { hasNextPage }
+      }
+    }'''
+
+    def setUp(self):
+        super().setUp()
+        user = create_user('author')
+        for i in range(3):
+            create_idea(user, title='graphql %d' % i, is_published=True)
+
+    def test_title_matches_rank_first(self):
+        author = create_user('ramen')
+        for title, content, is_published in (
+            ('昼ごはん', '駅前でラーメンを食べた', True),
+            ('ラーメン屋', '昼に行った', True),
+            ('ラーメン', '下書き', False),
+        ):
+            Idea.objects.create(idea_creator=author,
+                                title=title,
+                                content=content,
+                                is_published=is_published)
+        result = self.query(
+            'query { searchIdeas(query: "ラーメン") '
+            '{ edges { node { title } } } }')
+        self.assertEqual([
+            edge['node']['title']
+            for edge in result['data']['searchIdeas']['edges']
+        ], ['ラーメン屋', '昼ごはん'])
+
+    def test_first_limits_the_page(self):
+        result = self.query(self.SEARCH, {'first': 2})
+        connection = result['data']['searchIdeas']
+        self.assertEqual(len(connection['edges']), 2)
+        self.assertTrue(connection['pageInfo']['hasNextPage'])
+
+    def test_first_zero_returns_no_rows(self):
+        result = self.query(self.SEARCH, {'first': 0})
+        self.assertEqual(result['data']['searchIdeas']['edges'], [])
+
+    def test_negative_first_is_rejected(self):
+        result = self.query(self.SEARCH, {'first': -1})
+        self.assertErrorMessage(result, 'first must not be negative')
+
+    def test_backward_paging_is_rejected(self):
+        result = self.query('query { searchIdeas(query: "graphql", last: 1) '
+                            '{ edges { cursor } } }')
+        self.assertErrorMessage(
+            result, 'last and before are not supported on this connection')
+
+
+class KeysetPaginationTest(GraphQLTestCase):
+    ALL_IDEAS = '''
+    query AllIdeas($first: Int, $after: String, $last: Int, $before: String) {
+      allIdeas(first: $first, after: $after, last: $last, before: $before) {
+        edges { cursor node { title } }
+        pageInfo { hasNextPage hasPreviousPage endCursor }
+      }
+    }'''
+
+    def setUp(self):
+        super().setUp()
+        user = create_user('author')
+        # 作成日時が同じ行もidで順番が決まる
+        self.ideas = [
+            create_idea(user, title='idea %d' % i, is_published=True)
+            for i in range(5)
+        ]
+        Idea.objects.filter(id=self.ideas[1].id).update(
+            created_at=self.ideas[0].created_at)
+
+    def titles(self, connection):
+        return [edge['node']['title'] for edge in connection['edges']]
+
+    def test_pages_follow_each_other(self):
+        first_page = self.query(self.ALL_IDEAS,
+                                {'first': 2})['data']['allIdeas']
+        self.assertEqual(self.titles(first_page), ['idea 4', 'idea 3'])
+        self.assertTrue(first_page['pageInfo']['hasNextPage'])
+        self.assertFalse(first_page['pageInfo']['hasPreviousPage'])
+
+        titles = self.titles(first_page)
+        after = first_page['pageInfo']['endCursor']
+        while after:
+            page = self.query(self.ALL_IDEAS, {
+                'first': 2,
+                'after': after
+            })['data']['allIdeas']
+            self.assertTrue(page['pageInfo']['hasPreviousPage'])
+            titles += self.titles(page)
+            after = page['pageInfo']['hasNextPage'] and \
+                page['pageInfo']['endCursor']
+        self.assertEqual(titles, ['idea %d' % i for i in range(4, -1, -1)])
+
+    def test_last_before_returns_the_previous_rows(self):
+        before = KeysetConnectionField.encode_cursor(self.ideas[1])
+        page = self.query(self.ALL_IDEAS, {
+            'last': 2,
+            'before': before
+        })['data']['allIdeas']
+        self.assertEqual(self.titles(page), ['idea 3', 'idea 2'])
+        self.assertTrue(page['pageInfo']['hasPreviousPage'])
+        self.assertTrue(page['pageInfo']['hasNextPage'])
+
+    def test_first_zero_returns_no_rows(self):
+        page = self.query(self.ALL_IDEAS, {'first': 0})['data']['allIdeas']
+        self.assertEqual(page['edges'], [])
+        self.assertTrue(page['pageInfo']['hasNextPage'])
+
+    def test_negative_page_size_is_rejected(self):
+        self.assertErrorMessage(self.query(self.ALL_IDEAS, {'first': -1}),
+                                'first must not be negative')
+        self.assertErrorMessage(self.query(self.ALL_IDEAS, {'last': -1}),
+                                'last must not be negative')
+
+    def test_invalid_cursors_are_rejected(self):
+        for cursor in ('not a cursor', base64_json(['not a date', 1]),
+                       base64_json(['2021-13-40T00:00:00', 1]),
+                       base64_json([None, 1]), base64_json({'id': 1})):
+            with self.subTest(cursor=cursor):
+                result = self.query(self.ALL_IDEAS, {'after': cursor})
+                self.assertErrorMessage(result, 'invalid cursor')
+
+
+class FollowTest(GraphQLTestCase):
+    CREATE_FOLLOW = '''
+    mutation CreateFollow($userId: ID!) {
+      createFollow(input: {followedUserId: $userId}) {
+        follow { id isFollowing }
+      }
+    }'''
+
+    def test_following_again_reuses_the_follow(self):
+        follower = create_user('follower')
+        variables = {'userId': to_global_id('UserNode', create_user('a').id)}
+        result = self.query(self.CREATE_FOLLOW, variables, follower)
+        follow = result['data']['createFollow']['follow']
+        Follow.objects.update(is_following=False)
+        result = self.query(self.CREATE_FOLLOW, variables, follower)
+        self.assertEqual(result['data']['createFollow']['follow'], {
+            'id': follow['id'],
+            'isFollowing': True
+        })
+        self.assertEqual(Follow.objects.count(), 1)
+
+
+class NewNotificationsSubscriptionTest(TransactionTestCase):
+    def setUp(self):
+        self.receiver = create_user('receiver')
+        self.other = create_user('other')
+
+    async def _subscribe(self, connection_params):
+        communicator = WebsocketCommunicator(SubscriptionConsumer.as_asgi(),
+                                             '/subscriptions',
+                                             subprotocols=['graphql-ws'])
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.send_json_to({
+            'type': 'connection_init',
+            'payload': connection_params
+        })
+        self.assertEqual((await communicator.receive_json_from())['type'],
+                         'connection_ack')
+        await communicator.send_json_to({
+            'id': '1',
+            'type': 'start',
+            'payload': {
+                'query': NEW_NOTIFICATIONS,
+                # クライアントが送ったcontextは使われない
+                'context': {
+                    'headers': {
+                        'authorization': 'Bearer other@example.com'
+                    }
+                }
+            }
+        })
+        return communicator
+
+    def test_rejects_without_token(self):
+        async def run():
+            communicator = await self._subscribe({})
+            message = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return message
+
+        message = async_to_sync(run)()
+        self.assertEqual(message['type'], 'data')
+        self.assertIn('401 Unauthorized',
+                      message['payload']['errors'][0]['message'])
+
+    @mock.patch('api.validation.verify_token', fake_verify_token)
+    def test_streams_only_the_token_users_notifications(self):
+        def notify(receiver, notification_type):
+            Notification.objects.create(notificator=self.other,
+                                        notification_reciever=receiver,
+                                        notification_type=notification_type,
+                                        notified_item_type='Idea',
+                                        notified_item_id=1)
+
+        async def run():
+            communicator = await self._subscribe(
+                {'authorization': 'Bearer receiver@example.com'})
+            # 購読の開始を待ってから通知を作る
+            self.assertTrue(await communicator.receive_nothing(0.2))
+            await database_sync_to_async(notify)(self.other, 'Follow')
+            await database_sync_to_async(notify)(self.receiver, 'Like')
+            message = await communicator.receive_json_from(timeout=5)
+            await communicator.disconnect()
+            return message
+
+        message = async_to_sync(run)()
+        self.assertEqual(message['payload']['data'],
+                         {'newNotifications': {
+                             'notificationType': 'LIKE'
+                         }})
+
+    def test_token_is_verified_once_per_connection(self):
+        verify_token = mock.Mock(side_effect=fake_verify_token)
+
+        async def run():
+            communicator = await self._subscribe(
+                {'authorization': 'Bearer receiver@example.com'})
+            await communicator.send_json_to({
+                'id': '2',
+                'type': 'start',
+                'payload': {
+                    'query': NEW_NOTIFICATIONS
+                }
+            })
+            self.assertTrue(await communicator.receive_nothing(0.2))
+            await database_sync_to_async(create_notification)(self.other,
+                                                              self.receiver)
+            messages = [
+                await communicator.receive_json_from(timeout=5)
+                for _ in range(2)
+            ]
+            await communicator.disconnect()
+            return messages
+
+        with mock.patch('api.validation.verify_token', verify_token):
+            messages = async_to_sync(run)()
+        # 購読を2つ始めても、トークンの検証は接続時の1回だけ
+        self.assertCountEqual([message['id'] for message in messages],
+                              ['1', '2'])
+        verify_token.assert_called_once_with('receiver@example.com')
+
+    def test_saved_notification_is_sent_to_the_receivers_group(self):
+        channel_layer = get_channel_layer()
+        group = notifications.notification_group(self.receiver.id)
+
+        async def run():
+            channel_name = await channel_layer.new_channel()
+            await channel_layer.group_add(group, channel_name)
+            notification = await database_sync_to_async(create_notification)(
+                self.other, self.receiver)
+            message = await asyncio.wait_for(
+                channel_layer.receive(channel_name), 5)
+            return notification, message
+
+        notification, message = async_to_sync(run)()
+        self.assertEqual(message, {
+            'type': 'notification.created',
+            'notification_id': notification.id
+        })
+
+
+class UnreadNotificationCountTest(GraphQLTestCase):
+    UPDATE_NOTIFICATION = '''
+    mutation Update($id: ID!, $isChecked: Boolean!) {
+      updateNotification(input: {notificationId: $id, isChecked: $isChecked}) {
+        notification { isChecked }
+      }
+    }'''
+
+    def setUp(self):
+        super().setUp()
+        self.receiver = create_user('receiver')
+        self.sender = create_user('sender')
+
+    def unread_count(self):
+        return get_unread_notification_count(self.receiver.id)
+
+    def test_created_notifications_are_counted(self):
+        create_notification(self.sender, self.receiver)
+        create_notification(self.sender, self.receiver)
+        create_notification(self.sender, self.receiver, is_checked=True)
+        self.assertEqual(self.unread_count(), 2)
+
+    def test_query_returns_the_users_count(self):
+        create_notification(self.sender, self.receiver)
+        for user, count in ((self.receiver, 1), (self.sender, 0)):
+            result = self.query('query { myUnreadNotificationCount }',
+                                user=user)
+            self.assertEqual(result['data'],
+                             {'myUnreadNotificationCount': count})
+
+    def test_checking_and_unchecking_changes_the_count(self):
+        notification = create_notification(self.sender, self.receiver)
+        create_notification(self.sender, self.receiver)
+        node_id = to_global_id('NotificationNode', notification.id)
+        self.query(self.UPDATE_NOTIFICATION, {
+            'id': node_id,
+            'isChecked': True
+        }, self.receiver)
+        self.assertEqual(self.unread_count(), 1)
+        # 同じ状態への更新では数えない
+        self.query(self.UPDATE_NOTIFICATION, {
+            'id': node_id,
+            'isChecked': True
+        }, self.receiver)
+        self.assertEqual(self.unread_count(), 1)
+        self.query(self.UPDATE_NOTIFICATION, {
+            'id': node_id,
+            'isChecked': False
+        }, self.receiver)
+        self.assertEqual(self.unread_count(), 2)
+
+    def test_decrement_below_zero_is_clamped(self):
+        create_notification(self.sender, self.receiver)
+        NotificationCounter.objects.filter(user=self.receiver).update(
+            unread_count=2)
+        change_unread_notification_count(self.receiver.id, -5)
+        self.assertEqual(self.unread_count(), 0)
+
+
+class MarkNotificationsCheckedTest(GraphQLTestCase):
+    MARK = '''
+    mutation Mark($ids: [ID!]!) {
+      markNotificationsChecked(input: {ids: $ids}) { count }
+    }'''
+    MARK_ALL = '''
+    mutation MarkAll {
+      markAllNotificationsChecked(input: {}) { count }
+    }'''
+
+    def setUp(self):
+        super().setUp()
+        self.receiver = create_user('receiver')
+        self.sender = create_user('sender')
+        self.notifications = [
+            create_notification(self.sender, self.receiver) for _ in range(5)
+        ]
+        self.others = create_notification(self.receiver, self.sender)
+
+    def node_ids(self, notifications):
+        return [
+            to_global_id('NotificationNode', notification.id)
+            for notification in notifications
+        ]
+
+    def test_marks_only_the_users_unread_notifications(self):
+        ids = self.node_ids(self.notifications[:3] + [self.others])
+        result = self.query(self.MARK, {'ids': ids}, self.receiver)
+        self.assertEqual(result['data']['markNotificationsChecked'],
+                         {'count': 3})
+        self.assertEqual(get_unread_notification_count(self.receiver.id), 2)
+        self.assertEqual(get_unread_notification_count(self.sender.id), 1)
+        # 既読のものは数えない
+        result = self.query(self.MARK, {'ids': ids}, self.receiver)
+        self.assertEqual(result['data']['markNotificationsChecked'],
+                         {'count': 0})
+
+    def test_mark_all_stops_at_before(self):
+        old = timezone.now() - timedelta(days=1)
+        Notification.objects.filter(
+            id__in=[notification.id
+                    for notification in self.notifications[:2]]).update(
+                        created_at=old)
+        result = self.query(
+            'mutation MarkAll($before: DateTime) { '
+            'markAllNotificationsChecked(input: {before: $before}) '
+            '{ count } }', {'before': old.isoformat()}, self.receiver)
+        self.assertEqual(result['data']['markAllNotificationsChecked'],
+                         {'count': 2})
+        self.assertEqual(get_unread_notification_count(self.receiver.id), 3)
+
+    def test_drifted_counter_is_clamped(self):
+        NotificationCounter.objects.filter(user=self.receiver).update(
+            unread_count=2)
+        result = self.query(self.MARK_ALL, user=self.receiver)
+        self.assertEqual(result['data']['markAllNotificationsChecked'],
+                         {'count': 5})
+        self.assertEqual(get_unread_notification_count(self.receiver.id), 0)
+
+
+class TimelineTest(GraphQLTestCase):
+    MY_TIMELINE = '''
+    query MyTimeline($first: Int, $last: Int) {
+      myTimeline(first: $first, last: $last) {
+        edges { node { title } }
+      }
+    }'''
+
+    def setUp(self):
+        super().setUp()
+        self.author = create_user('author')
+        self.readers = [create_user('reader%d' % i) for i in range(2)]
+        for reader in self.readers:
+            Follow.objects.create(following_user=reader,
+                                  followed_user=self.author)
+
+    def publish(self, title):
+        idea = create_idea(self.author, title=title, is_published=True)
+        timeline.fan_out_idea(idea)
+        return idea
+
+    def titles(self, user):
+        result = self.query(self.MY_TIMELINE, {'first': 10}, user)
+        return [
+            edge['node']['title']
+            for edge in result['data']['myTimeline']['edges']
+        ]
+
+    def test_fan_out_writes_followers_timelines(self):
+        self.publish('first')
+        self.publish('second')
+        for reader in self.readers:
+            self.assertEqual(self.titles(reader), ['second', 'first'])
+        self.assertEqual(self.titles(self.author), [])
+
+    def test_following_backfills_and_unfollowing_removes(self):
+        self.publish('published')
+        reader = create_user('late')
+        timeline.follow(reader.id, self.author.id)
+        self.assertEqual(self.titles(reader), ['published'])
+        timeline.unfollow(reader.id, self.author.id)
+        self.assertEqual(self.titles(reader), [])
+
+    def test_pull_author_ideas_are_merged_without_duplicates(self):
+        self.publish('fanned out')
+        with override_settings(TIMELINE_FANOUT_MAX_FOLLOWERS=1):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.publish('pulled')
+        # 書き込み済みのエントリは残っていても、重複せずに読み込み時の取得と合わせて返す
+        self.assertTrue(TimelineEntry.objects.exists())
+        self.assertEqual(self.titles(self.readers[0]),
+                         ['pulled', 'fanned out'])
+
+        job = Job.objects.get(name='delete_timeline_entries')
+        Job.objects.filter(id=job.id).update(run_at=job.created_at)
+        self.assertEqual(jobs.run(jobs.claim('test')[0], 'test'), jobs.DONE)
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.titles(self.readers[0]),
+                         ['pulled', 'fanned out'])
+
+    def test_backward_paging_is_rejected(self):
+        result = self.query(self.MY_TIMELINE, {'last': 5}, self.readers[0])
+        self.assertErrorMessage(
+            result, 'last and before are not supported on this connection')
+
+
+@override_settings(GRAPHQL_MAX_COST=50)
+class CostAnalysisTest(GraphQLTestCase):
+    EXPENSIVE = ('expensive: allIdeas(first: 100) '
+                 '{ edges { node { ideaCreator { username } } } }')
+
+    def test_expensive_query_is_rejected(self):
+        result = self.query('query { %s }' % self.EXPENSIVE)
+        self.assertNotIn('expensive', result.get('data') or {})
+        self.assertErrorMessage(result,
+                                'query cost 101 exceeds the maximum cost 50')
+
+    def test_cheap_query_is_executed(self):
+        result = self.query(
+            'query { allIdeas(first: 10) '
+            '{ edges { node { ideaCreator { username } } } } }')
+        self.assertNotIn('errors', result)
+        self.assertEqual(result['data']['allIdeas']['edges'], [])
+
+    @override_settings(GRAPHQL_MAX_DEPTH=4)
+    def test_deep_query_is_rejected(self):
+        result = self.query(
+            'query { allIdeas(first: 1) '
+            '{ edges { node { ideaCreator { username } } } } }')
+        self.assertIsNone(result.get('data'))
+        self.assertErrorMessage(result,
+                                'query depth 5 exceeds the maximum depth 4')
+
+    def test_negative_first_cannot_offset_the_cost(self):
+        # 別名で負のfirstを付けたフィールドを並べても、高いコストを打ち消せない
+        result = self.query(
+            'query Offset($first: Int) { %s cheap: allIdeas(first: $first) '
+            '{ edges { node { ideaCreator { username } } } } }' %
+            self.EXPENSIVE, {'first': -100000})
+        self.assertIsNone(result.get('data'))
+        self.assertErrorMessage(result, 'first must not be negative')
+        self.assertErrorMessage(result,
+                                'query cost 102 exceeds the maximum cost 50')
+
+
+@override_settings(GRAPHQL_PERSISTED_QUERIES_ONLY=True)
+class PersistedQueryTest(GraphQLTestCase):
+    QUERY = 'query { allTopics { edges { node { id } } } }'
+
+    def setUp(self):
+        super().setUp()
+        persisted.clear_persisted_queries()
+        self.addCleanup(persisted.clear_persisted_queries)
+        self.register([self.QUERY])
+
+    def register(self, queries, *args):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as manifest:
+            json.dump({persisted.query_hash(q): q for q in queries}, manifest)
+            manifest.flush()
+            call_command('register_persisted_queries',
+                         manifest.name,
+                         *args,
+                         stdout=mock.Mock())
+
+    def post(self, query):
+        return self.client.post('/graphql/',
+                                json.dumps({'query': query}),
+                                content_type='application/json')
+
+    def test_only_registered_queries_are_allowed(self):
+        self.assertEqual(self.post(self.QUERY).status_code, 200)
+        response = self.post('query { allTopics { edges { cursor } } }')
+        self.assertEqual(response.status_code, 400)
+
+    def test_pruned_query_is_rejected(self):
+        self.assertEqual(self.post(self.QUERY).status_code, 200)
+        self.register([], '--prune')
+        self.assertEqual(self.post(self.QUERY).status_code, 400)
+
+    def test_registered_query_is_sent_by_hash(self):
+        response = self.client.post('/graphql/',
+                                    json.dumps({
+                                        'extensions': {
+                                            'persistedQuery': {
+                                                'version': 1,
+                                                'sha256Hash':
+                                                persisted.query_hash(
+                                                    self.QUERY)
+                                            }
+                                        }
+                                    }),
+                                    content_type='application/json')
+        self.assertEqual(response.json()['data'],
+                         {'allTopics': {
+                             'edges': []
+                         }})
+
+    def test_pruned_query_expires_in_other_processes(self):
+        sha256_hash = persisted.query_hash(self.QUERY)
+        self.assertEqual(persisted.get_persisted_query(sha256_hash),
+                         self.QUERY)
+        # 別のプロセスで削除された場合は、保持する期限までは残る
+        PersistedQuery.objects.all().delete()
+        self.assertEqual(persisted.get_persisted_query(sha256_hash),
+                         self.QUERY)
+        expired = time.monotonic() + persisted.PERSISTED_QUERY_CACHE_TIMEOUT
+        with mock.patch('api.persisted.time.monotonic',
+                        return_value=expired):
+            self.assertIsNone(persisted.get_persisted_query(sha256_hash))
+
+    def test_unknown_hash_is_cached(self):
+        sha256_hash = '0' * 64
+        self.assertIsNone(persisted.get_persisted_query(sha256_hash))
+        with self.assertNumQueries(0):
+            self.assertIsNone(persisted.get_persisted_query(sha256_hash))
+
+
+class ResponseCacheTest(GraphQLTestCase):
+    ALL_IDEAS = 'query { allIdeas(first: 10) { edges { node { title } } } }'
+
+    def setUp(self):
+        super().setUp()
+        self.author = create_user('author')
+        create_idea(self.author, title='first', is_published=True)
+
+    def titles(self, user=None):
+        result = self.query(self.ALL_IDEAS, user=user)
+        edges = result['data']['allIdeas']['edges']
+        return [edge['node']['title'] for edge in edges]
+
+    def test_anonymous_response_is_cached(self):
+        self.assertEqual(self.titles(), ['first'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.titles(), ['first'])
+        self.assertEqual(response_cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_saving_a_model_invalidates_after_commit(self):
+        self.titles()
+        with self.captureOnCommitCallbacks() as callbacks:
+            create_idea(self.author, title='second', is_published=True)
+        self.assertEqual(self.titles(), ['first'])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.titles(), ['second', 'first'])
+
+    def test_like_mutation_invalidates_the_like_count(self):
+        query = ('query { allIdeas(first: 10) '
+                 '{ edges { node { likeCount } } } }')
+        create_like = '''
+        mutation CreateLike($ideaId: ID!) {
+          createLike(input: {likeTargetType: "Idea", likedIdeaId: $ideaId}) {
+            like { id }
+          }
+        }'''
+
+        def like_counts():
+            edges = self.query(query)['data']['allIdeas']['edges']
+            return [edge['node']['likeCount'] for edge in edges]
+
+        self.assertEqual(like_counts(), [0])
+        idea = Idea.objects.get()
+        # いいね数はupdateで増やすのでpost_saveは送られないが、コミット後に無効にする
+        with self.captureOnCommitCallbacks(execute=True):
+            self.query(create_like,
+                       {'ideaId': to_global_id('IdeaNode', idea.id)},
+                       self.author)
+        self.assertEqual(like_counts(), [1])
+        self.assertEqual(response_cache.stats(), {'hits': 0, 'misses': 2})
+
+    def test_authenticated_requests_are_not_cached(self):
+        self.titles(self.author)
+        self.titles(self.author)
+        self.assertEqual(response_cache.stats(), {'hits': 0, 'misses': 0})
+
+
+class TracingTest(GraphQLTestCase):
+    QUERY = 'query Topics { allTopics { edges { node { id } } } }'
+
+    def setUp(self):
+        super().setUp()
+        tracing.summary.reset()
+        self.staff = create_user('staff')
+        self.staff.is_staff = True
+        self.staff.save()
+        self.user = create_user('user')
+
+    def traced(self, user=None):
+        headers = {'HTTP_X_GRAPHQL_TRACING': '1'}
+        if user is not None:
+            headers['HTTP_AUTHORIZATION'] = 'Bearer ' + user.email
+        response = self.client.post('/graphql/',
+                                    json.dumps({'query': self.QUERY}),
+                                    content_type='application/json',
+                                    **headers)
+        return response.json().get('extensions', {}).get('tracing')
+
+    def test_staff_gets_resolver_timings(self):
+        # トークンを検証するリゾルバが無いクエリでも、ヘッダのトークンで判定する
+        result = self.traced(self.staff)
+        self.assertIn('Query.allTopics', [
+            resolver['parentType'] + '.' + resolver['fieldName']
+            for resolver in result['execution']['resolvers']
+        ])
+
+    @override_settings(DEBUG=True)
+    def test_debug_requests_get_resolver_timings(self):
+        result = self.traced()
+        self.assertIn('Query.allTopics', [
+            resolver['parentType'] + '.' + resolver['fieldName']
+            for resolver in result['execution']['resolvers']
+        ])
+
+    def test_other_users_do_not_get_timings(self):
+        self.assertIsNone(self.traced(self.user))
+        self.assertIsNone(self.traced())
+
+    def test_requests_are_not_traced_by_default(self):
+        with mock.patch.object(tracing.Tracer, 'start_span') as start_span:
+            self.assertNotIn('errors', self.query(self.QUERY))
+        start_span.assert_not_called()
+        # ヘッダで計測したリクエストも集計には含めない
+        self.traced(self.staff)
+        self.assertEqual(tracing.summary.as_dict()['operations'], {})
+
+    @override_settings(GRAPHQL_TRACING=True)
+    def test_enabled_tracing_is_summarized(self):
+        self.query(self.QUERY)
+        operations = tracing.summary.as_dict()['operations']
+        # operationNameを送らないリクエストは名前無しで集計する
+        operation = operations['(anonymous)']
+        self.assertEqual(operation['count'], 1)
+        self.assertIn('Query.allTopics', operation['fields'])
+
+
+class SeedTest(TestCase):
+    def test_counters_match_the_seeded_rows(self):
+        seed_dataset(random.Random(0),
+                     users=30,
+                     followings=3,
+                     topics=2,
+                     ideas=40,
+                     comments=20,
+                     likes=40,
+                     notifications=20,
+                     batch_size=7)
+        # bulk_createはシグナルを送らないので、最後に数え直してある
+        for idea in Idea.objects.all():
+            self.assertEqual(
+                idea.like_count,
+                Like.objects.filter(liked_idea=idea, is_liked=True).count())
+        for user in get_user_model().objects.all():
+            self.assertEqual(
+                get_unread_notification_count(user.id),
+                Notification.objects.filter(notification_reciever=user,
+                                            is_checked=False).count())
+
+    def test_same_seed_gives_same_data(self):
+        options = ['--users=20', '--follows=2', '--topics=2', '--ideas=30',
+                   '--memos=10', '--comments=20', '--likes=40',
+                   '--notifications=10', '--announces=2', '--batch-size=7']
+        for prefix in ('first', 'second'):
+            call_command('seed_data',
+                         *options,
+                         '--email-prefix=' + prefix,
+                         stdout=mock.Mock())
+        first, second = [
+            list(
+                Idea.objects.filter(
+                    idea_creator__email__startswith=prefix).order_by(
+                        'id').values_list('title', 'is_published'))
+            for prefix in ('first', 'second')
+        ]
+        self.assertEqual(len(first), 30)
+        self.assertEqual(first, second)
+
+    def test_rebuilds_timelines_and_trending(self):
+        ids = seed_dataset(random.Random(0),
+                           users=30,
+                           followings=3,
+                           topics=2,
+                           ideas=40,
+                           comments=20,
+                           likes=40,
+                           notifications=5,
+                           batch_size=7)
+        ideas = Idea.objects.filter(is_published=True)
+        self.assertTrue(ideas.exists())
+        for idea in ideas:
+            followers = Follow.objects.filter(
+                followed_user_id=idea.idea_creator_id,
+                is_following=True).values_list('following_user_id',
+                                               flat=True)
+            self.assertCountEqual(
+                TimelineEntry.objects.filter(idea=idea).values_list(
+                    'owner_id', flat=True), followers)
+        self.assertEqual(TrendingScore.objects.count(), len(ids['ideas']))
+
+
+# ASGIで/graphql/を非同期のビューで配信する場合のURLconf
+urlpatterns = [
+    path('graphql/', async_graphql_view(GraphQLView.as_view(schema=schema))),
+]
+
+
+@override_settings(ROOT_URLCONF='api.tests')
+class AsgiGraphQLTest(TransactionTestCase):
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_query_is_served_through_the_asgi_application(self):
+        Topic.objects.create(name='cooking', display_name='料理')
+        communicator = HttpCommunicator(
+            application,
+            'POST',
+            '/graphql/',
+            body=json.dumps({
+                'query': 'query { allTopics { edges { node { name } } } }'
+            }).encode(),
+            headers=[(b'content-type', b'application/json')])
+        response = async_to_sync(communicator.get_response)()
+        self.assertEqual(response['status'], 200)
+        self.assertEqual(
+            json.loads(response['body'])['data'],
+            {'allTopics': {
+                'edges': [{
+                    'node': {
+                        'name': 'cooking'
+                    }
+                }]
+            }})
+
+
+class ReplicaRouterTest(TestCase):
+    def test_replica_is_chosen_once_per_request(self):
+        router = routers.ReplicaRouter()
+        with mock.patch('api.routers.choose_replica',
+                        side_effect=['replica1', 'replica2']) as choose:
+            with routers.request_scope():
+                self.assertEqual(router.db_for_read(Idea), 'replica1')
+                self.assertEqual(router.db_for_read(Like), 'replica1')
+            with routers.request_scope():
+                self.assertEqual(router.db_for_read(Idea), 'replica2')
+        self.assertEqual(choose.call_count, 2)
+
+    def test_reads_after_write_use_primary(self):
+        router = routers.ReplicaRouter()
+        with mock.patch('api.routers.choose_replica',
+                        return_value='replica1'):
+            with routers.request_scope():
+                self.assertEqual(router.db_for_read(Idea), 'replica1')
+                router.db_for_write(Idea)
+                self.assertEqual(router.db_for_read(Idea), 'default')
+            self.assertEqual(router.db_for_read(Idea), 'default')
+
+    @override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+    def test_unhealthy_replicas_are_skipped(self):
+        with mock.patch.object(routers.health,
+                               'is_healthy',
+                               side_effect=lambda alias: alias == 'replica2'):
+            self.assertEqual(routers.choose_replica(), 'replica2')
+            self.assertEqual(routers.choose_replica(), 'replica2')
+        with mock.patch.object(routers.health,
+                               'is_healthy',
+                               return_value=False):
+            self.assertIsNone(routers.choose_replica())
+
+
+class TopicIdeaCountTest(GraphQLTestCase):
+    IDEAS_BY_TOPIC = '''
+    query IdeasByTopic($first: Int, $after: String, $last: Int) {
+      ideasByTopic(topicName: "cooking", first: $first, after: $after,
+                   last: $last) {
+        edges { node { title } }
+        pageInfo { hasNextPage endCursor }
+      }
+    }'''
+
+    def setUp(self):
+        super().setUp()
+        self.topic = Topic.objects.create(name='cooking',
+                                          display_name='料理')
+        self.author = create_user('author')
+
+    def publish(self, title):
+        idea = create_idea(self.author, title=title, is_published=True)
+        topics.update_idea_topics(idea, {self.topic.id}, created=True)
+        return idea
+
+    def idea_count(self):
+        self.topic.refresh_from_db()
+        return self.topic.idea_count
+
+    def titles(self, connection):
+        return [edge['node']['title'] for edge in connection['edges']]
+
+    def test_publish_and_unpublish_change_the_count(self):
+        idea = self.publish('first')
+        self.publish('second')
+        self.assertEqual(self.idea_count(), 2)
+        idea.is_published = False
+        idea.save()
+        topics.update_idea_topics(idea, was_published=True)
+        self.assertEqual(self.idea_count(), 1)
+
+    def test_decrement_is_clamped_at_zero(self):
+        self.publish('only')
+        # ずれて実際より小さくなっていても、減らす分だけ0未満にはしない
+        change_topic_idea_counts({self.topic.id}, -3)
+        self.assertEqual(self.idea_count(), 0)
+        change_topic_idea_counts({self.topic.id}, 1)
+        self.assertEqual(self.idea_count(), 1)
+
+    def test_pages_in_id_order(self):
+        for title in ('a', 'b', 'c'):
+            self.publish(title)
+        result = self.query(self.IDEAS_BY_TOPIC, {'first': 2})
+        connection = result['data']['ideasByTopic']
+        self.assertEqual(self.titles(connection), ['c', 'b'])
+        self.assertTrue(connection['pageInfo']['hasNextPage'])
+        result = self.query(self.IDEAS_BY_TOPIC, {
+            'first': 2,
+            'after': connection['pageInfo']['endCursor']
+        })
+        connection = result['data']['ideasByTopic']
+        self.assertEqual(self.titles(connection), ['a'])
+        self.assertFalse(connection['pageInfo']['hasNextPage'])
+
+    def test_invalid_paging_is_rejected(self):
+        result = self.query(self.IDEAS_BY_TOPIC, {'first': -1})
+        self.assertErrorMessage(result, 'first must not be negative')
+        result = self.query(self.IDEAS_BY_TOPIC, {'last': 1})
+        self.assertErrorMessage(
+            result, 'last and before are not supported on this connection')
+
+
+class TrendingTest(GraphQLTestCase):
+    CREATE_LIKE = '''
+    mutation CreateLike($ideaId: ID!) {
+      createLike(input: {likeTargetType: "Idea", likedIdeaId: $ideaId}) {
+        like { id }
+      }
+    }'''
+    UPDATE_LIKE = '''
+    mutation UpdateLike($likeId: ID!, $isLiked: Boolean!) {
+      updateLike(input: {likeId: $likeId, isLiked: $isLiked}) {
+        like { isLiked }
+      }
+    }'''
+    TRENDING = '''
+    query Trending($first: Int, $last: Int) {
+      trendingIdeas(first: $first, last: $last) {
+        edges { node { title } }
+      }
+    }'''
+
+    def setUp(self):
+        super().setUp()
+        self.liker = create_user('liker')
+        author = create_user('author')
+        self.idea = create_idea(author, title='liked', is_published=True)
+        self.other = create_idea(author, title='other', is_published=True)
+        trending.refresh()
+
+    def score(self, idea):
+        return TrendingScore.objects.get(idea=idea).score
+
+    def like(self):
+        result = self.query(self.CREATE_LIKE,
+                            {'ideaId': to_global_id('IdeaNode', self.idea.id)},
+                            self.liker)
+        return result['data']['createLike']['like']['id']
+
+    def set_liked(self, like_id, is_liked):
+        result = self.query(self.UPDATE_LIKE, {
+            'likeId': like_id,
+            'isLiked': is_liked
+        }, self.liker)
+        self.assertNotIn('errors', result)
+
+    def titles(self):
+        result = self.query(self.TRENDING, {'first': 10})
+        edges = result['data']['trendingIdeas']['edges']
+        return [edge['node']['title'] for edge in edges]
+
+    def test_likes_raise_the_rank(self):
+        self.assertEqual(self.titles(), ['other', 'liked'])
+        before = self.score(self.idea)
+        self.like()
+        trending.refresh()
+        liked = self.score(self.idea)
+        self.assertGreater(liked, before)
+        self.assertEqual(self.titles(), ['liked', 'other'])
+        # 集計済みのいいねは次の集計で数えない
+        trending.refresh()
+        self.assertAlmostEqual(self.score(self.idea), liked)
+
+    def test_unlike_subtracts_the_like(self):
+        before = self.score(self.idea)
+        like_id = self.like()
+        trending.refresh()
+        self.assertGreater(self.score(self.idea), before)
+        self.assertEqual(self.titles(), ['liked', 'other'])
+
+        self.set_liked(like_id, False)
+        trending.refresh()
+        self.assertAlmostEqual(self.score(self.idea), before)
+
+    def test_relike_after_refresh_is_counted(self):
+        before = self.score(self.idea)
+        like_id = self.like()
+        trending.refresh()
+        liked = self.score(self.idea)
+        self.set_liked(like_id, False)
+        trending.refresh()
+        # 集計済みの行をいいねし直しても数える
+        self.set_liked(like_id, True)
+        trending.refresh()
+        self.assertGreater(self.score(self.idea), before)
+        self.assertAlmostEqual(self.score(self.idea), liked, places=3)
+
+    def test_toggle_between_refreshes_cancels_out(self):
+        before = self.score(self.idea)
+        like_id = self.like()
+        self.set_liked(like_id, False)
+        trending.refresh()
+        self.assertAlmostEqual(self.score(self.idea), before)
+
+    def test_rebuild_counts_current_likes(self):
+        like_id = self.like()
+        trending.refresh()
+        liked = self.score(self.idea)
+        self.set_liked(like_id, False)
+        self.set_liked(like_id, True)
+        trending.reset()
+        trending.refresh()
+        self.assertAlmostEqual(self.score(self.idea), liked, places=3)
+
+    def comment(self, idea):
+        thread = Thread.objects.create(thread_target_type='Idea',
+                                       target_idea=idea)
+        return Comment.objects.create(commentor=self.liker,
+                                      target_thread=thread,
+                                      content='comment')
+
+    def test_idea_committed_with_a_lower_id_is_counted(self):
+        author = self.idea.idea_creator
+        later = Idea.objects.create(id=self.other.id + 10,
+                                    idea_creator=author,
+                                    title='later',
+                                    content='content',
+                                    is_published=True)
+        trending.refresh()
+        # 集計の後に、先に採番されていた小さいidの行がコミットされた場合
+        earlier = Idea.objects.create(id=self.other.id + 5,
+                                      idea_creator=author,
+                                      title='earlier',
+                                      content='content',
+                                      is_published=True)
+        trending.refresh()
+        self.assertGreater(self.score(later), 0)
+        self.assertGreater(self.score(earlier), 0)
+
+    def test_deleted_comment_is_subtracted(self):
+        before = self.score(self.idea)
+        comment = self.comment(self.idea)
+        trending.refresh()
+        self.assertGreater(self.score(self.idea), before)
+        self.assertEqual(self.titles(), ['liked', 'other'])
+
+        comment.delete()
+        trending.refresh()
+        self.assertAlmostEqual(self.score(self.idea), before)
+
+    def test_comments_of_a_deleted_idea_are_discarded(self):
+        self.comment(self.other)
+        self.other.delete()
+        trending.refresh()
+        self.assertFalse(TrendingEvent.objects.exists())
+        self.assertEqual(self.titles(), ['liked'])
+
+    def test_backward_paging_is_rejected(self):
+        result = self.query(self.TRENDING, {'last': 1})
+        self.assertErrorMessage(
+            result, 'last and before are not supported on this connection')
+
+
+def png(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (300, 200), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class ProfileImageTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings = override_settings(MEDIA_ROOT=media_root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def upload(self, profile, data):
+        profile.refresh_from_db()
+        profile.profile_image.save('image.png', ContentFile(data))
+        return images.process_profile_image(profile.id,
+                                            profile.profile_image.name)
+
+    def create_profile(self, name):
+        return Profile.objects.create(related_user=create_user(name),
+                                      profile_name=name)
+
+    def names(self, variants):
+        return {
+            name
+            for formats in variants.values() for name in formats.values()
+        }
+
+    def test_variants_are_chosen_by_size(self):
+        profile = self.create_profile('alice')
+        profile.google_image_url = 'https://example.com/google.png'
+        profile.save()
+        self.assertEqual(images.profile_image_url(profile, 100),
+                         'https://example.com/google.png')
+        variants = self.upload(profile, png('red'))
+        self.assertEqual(set(variants), {'64', '128', '256'})
+        profile.refresh_from_db()
+        self.assertEqual(images.profile_image_url(profile, 100),
+                         default_storage.url(variants['128']['webp']))
+        self.assertEqual(images.profile_image_url(profile, 1000, 'jpeg'),
+                         default_storage.url(variants['256']['jpeg']))
+
+    def test_same_image_is_not_shared_between_profiles(self):
+        alice = self.create_profile('alice')
+        bob = self.create_profile('bob')
+        alice_names = self.names(self.upload(alice, png('red')))
+        bob_names = self.names(self.upload(bob, png('red')))
+        self.assertFalse(alice_names & bob_names)
+
+        # 別の画像にしたプロフィールの前の縮小画像だけを、コミット後に消す
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.upload(alice, png('blue'))
+        for name in alice_names:
+            self.assertTrue(default_storage.exists(name))
+        for callback in callbacks:
+            callback()
+        for name in alice_names:
+            self.assertFalse(default_storage.exists(name))
+        for name in bob_names:
+            self.assertTrue(default_storage.exists(name))
+
+    def test_legacy_shared_variants_are_kept(self):
+        profile = self.create_profile('alice')
+        legacy = default_storage.save('profiles/variants/legacy_64.webp',
+                                      ContentFile(b'shared'))
+        profile.profile_image_variants = {'64': {'webp': legacy}}
+        profile.save()
+        self.upload(profile, png('red'))
+        self.assertTrue(default_storage.exists(legacy))
+
+
+@override_settings(GRAPHQL_UPLOAD_MAX_FILE_SIZE=1000,
+                   GRAPHQL_UPLOAD_MAX_REQUEST_SIZE=5000)
+class UploadLimitTest(TestCase):
+    OPERATIONS = json.dumps({
+        'query': 'mutation ($file: Upload!) { uploadFile(file: $file) }',
+        'variables': {
+            'file': None
+        }
+    })
+
+    def post(self, *files):
+        data = {
+            'operations': self.OPERATIONS,
+            'map': json.dumps({str(i): ['variables.file']
+                               for i in range(len(files))}),
+        }
+        for i, content in enumerate(files):
+            data[str(i)] = ContentFile(content, name='%d.png' % i)
+        return self.client.post('/graphql/', data)
+
+    def assertTooLarge(self, response, message):
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.json()['errors'][0]['message'], message)
+
+    def test_file_over_the_limit_is_rejected(self):
+        self.assertTooLarge(self.post(b'x' * 2000), uploads.FILE_TOO_LARGE)
+
+    def test_request_over_the_limit_is_rejected_before_reading(self):
+        with mock.patch.object(uploads.LimitedUploadHandler,
+                               'receive_data_chunk') as receive:
+            response = self.post(*[b'x' * 900] * 6)
+        self.assertTooLarge(response, uploads.REQUEST_TOO_LARGE)
+        receive.assert_not_called()
+
+    def test_request_without_content_length_stops_while_reading(self):
+        # Content-Lengthの確認を通った後も、受け取った量が上限を超えた時点で止める
+        with mock.patch('api.uploads.max_request_size',
+                        side_effect=[10**6, 5000]):
+            response = self.post(*[b'x' * 900] * 6)
+        self.assertTooLarge(response, uploads.REQUEST_TOO_LARGE)
+
+    def test_asgi_middleware_rejects_large_bodies(self):
+        received = []
+
+        # Djangoと同じく、切断された場合はレスポンスを返さない
+        async def app(scope, receive, send):
+            message = await receive()
+            received.append(message)
+            if message['type'] == 'http.disconnect':
+                return
+            await send({'type': 'http.response.start', 'status': 200})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        async def request(headers, chunks):
+            sent = []
+            messages = iter([{
+                'type': 'http.request',
+                'body': chunk,
+                'more_body': True
+            } for chunk in chunks])
+
+            async def receive():
+                return next(messages)
+
+            async def send(message):
+                sent.append(message)
+
+            await uploads.UploadLimitMiddleware(app)(
+                {
+                    'type': 'http',
+                    'path': '/graphql/',
+                    'headers': headers
+                }, receive, send)
+            return sent[0]['status']
+
+        self.assertEqual(
+            async_to_sync(request)([(b'content-length', b'6000')], []), 413)
+        self.assertEqual(received, [])
+        # Content-Lengthが無い場合は受け取った量で判定し、アプリには切断として渡す
+        self.assertEqual(async_to_sync(request)([], [b'x' * 6000]), 413)
+        self.assertEqual(received, [{'type': 'http.disconnect'}])
+        self.assertEqual(async_to_sync(request)([], [b'x' * 100]), 200)
+
+
+# 書き込んでから失敗するジョブ(書き込みはロールバックされる)
+def failing_job(idea_id):
+    Idea.objects.filter(id=idea_id).update(title='changed')
+    raise RuntimeError('failed')
+
+
+@mock.patch.dict(jobs.HANDLERS, {'failing': 'api.tests.failing_job'})
+class JobQueueTest(TestCase):
+    def setUp(self):
+        self.idea = create_idea(create_user('author'), title='original')
+
+    def test_key_prevents_duplicates(self):
+        self.assertIsNotNone(jobs.enqueue('failing', key='once'))
+        self.assertIsNone(jobs.enqueue('failing', key='once'))
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_claim_takes_due_jobs_once(self):
+        due = jobs.enqueue('failing', {'idea_id': self.idea.id})
+        jobs.enqueue('failing',
+                     run_at=timezone.now() + timedelta(minutes=1))
+        claimed = jobs.claim('worker-1', limit=5)
+        self.assertEqual([job.id for job in claimed], [due.id])
+        self.assertEqual(claimed[0].status, jobs.RUNNING)
+        self.assertEqual(claimed[0].locked_by, 'worker-1')
+        self.assertEqual(claimed[0].attempts, 1)
+        self.assertEqual(jobs.claim('worker-2', limit=5), [])
+
+    def test_failed_job_is_retried_then_failed(self):
+        jobs.enqueue('failing', {'idea_id': self.idea.id}, max_attempts=2)
+        job = jobs.claim('worker')[0]
+        self.assertEqual(jobs.run(job, 'worker'), 'retry')
+        job.refresh_from_db()
+        self.assertEqual(job.status, jobs.QUEUED)
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('RuntimeError', job.last_error)
+        # ハンドラの書き込みはロールバックされる
+        self.idea.refresh_from_db()
+        self.assertEqual(self.idea.title, 'original')
+        self.assertEqual(jobs.claim('worker'), [])
+
+        Job.objects.filter(id=job.id).update(run_at=timezone.now())
+        job = jobs.claim('worker')[0]
+        self.assertEqual(jobs.run(job, 'worker'), jobs.FAILED)
+        job.refresh_from_db()
+        self.assertEqual(job.status, jobs.FAILED)
+
+    def test_release_stale_requeues_or_fails(self):
+        jobs.enqueue('failing', key='retry', max_attempts=2)
+        jobs.enqueue('failing', key='exhausted', max_attempts=1)
+        jobs.claim('stopped-worker', limit=2)
+        self.assertEqual(jobs.release_stale(timeout=60), 0)
+        Job.objects.update(locked_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(jobs.release_stale(timeout=60), 2)
+        retry = Job.objects.get(key='retry')
+        self.assertEqual((retry.status, retry.locked_by), (jobs.QUEUED, ''))
+        self.assertEqual(Job.objects.get(key='exhausted').status, jobs.FAILED)
+        self.assertEqual([job.key for job in jobs.claim('worker')],
+                         ['retry'])
+
+    def test_fan_out_removes_entries_of_unpublished_idea(self):
+        follower = create_user('follower')
+        Follow.objects.create(following_user=follower,
+                              followed_user=self.idea.idea_creator)
+        # ジョブがアイデアを読んだ後に非公開にされた場合
+        self.idea.is_published = True
+        self.assertEqual(timeline.fan_out_idea(self.idea), 0)
+        self.assertFalse(TimelineEntry.objects.exists())
+
+        Idea.objects.filter(id=self.idea.id).update(is_published=True)
+        self.assertEqual(timeline.fan_out_idea(self.idea), 1)
+        self.assertTrue(TimelineEntry.objects.exists())
+
+
+class NotifyFollowersTest(TestCase):
+    def setUp(self):
+        self.author = create_user('author')
+        self.followers = [create_user('follower%d' % i) for i in range(3)]
+        for follower in self.followers:
+            Follow.objects.create(following_user=follower,
+                                  followed_user=self.author)
+        self.idea = create_idea(self.author, is_published=True)
+
+    def unread_counts(self):
+        return [
+            get_unread_notification_count(follower.id)
+            for follower in self.followers
+        ]
+
+    def test_notifies_each_follower_once(self):
+        self.assertEqual(notifications.notify_followers(self.idea,
+                                                        batch_size=2), 3)
+        self.assertEqual(self.unread_counts(), [1, 1, 1])
+        # やり直したジョブや、非公開にしてから公開し直した場合も重複しない
+        self.assertEqual(notifications.notify_followers(self.idea), 0)
+        self.assertEqual(
+            Notification.objects.filter(notification_type='Idea').count(), 3)
+        self.assertEqual(self.unread_counts(), [1, 1, 1])
+
+    def test_each_batch_is_sent_to_the_receivers_after_commit(self):
+        channel_layer = get_channel_layer()
+        channel_names = []
+        for follower in self.followers:
+            channel_name = async_to_sync(channel_layer.new_channel)()
+            async_to_sync(channel_layer.group_add)(
+                notifications.notification_group(follower.id), channel_name)
+            channel_names.append(channel_name)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            notifications.notify_followers(self.idea, batch_size=2)
+        # 2件と1件の書き込みをそれぞれコミットしてから配信する
+        self.assertEqual(len(callbacks), 2)
+        for follower, channel_name in zip(self.followers, channel_names):
+            message = async_to_sync(asyncio.wait_for)(
+                channel_layer.receive(channel_name), 5)
+            notification = Notification.objects.get(
+                notification_reciever=follower)
+            self.assertEqual(message, {
+                'type': 'notification.created',
+                'notification_id': notification.id
+            })
+
+    def test_job_is_enqueued_once(self):
+        key = 'notify_followers:%d' % self.idea.id
+        payload = {'idea_id': self.idea.id}
+        self.assertIsNotNone(jobs.enqueue('notify_followers', payload, key))
+        self.assertIsNone(jobs.enqueue('notify_followers', payload, key))
+        job = jobs.claim('worker')[0]
+        self.assertEqual(jobs.run(job, 'worker'), jobs.DONE)
+        # 止まったワーカーのジョブとして実行し直されても重複しない
+        self.assertEqual(jobs.run(job, 'worker'), jobs.DONE)
+        self.assertEqual(self.unread_counts(), [1, 1, 1])
+
+    def test_unpublished_idea_is_not_notified(self):
+        self.idea.is_published = False
+        self.assertEqual(notifications.notify_followers(self.idea), 0)
+        self.assertFalse(Notification.objects.exists())
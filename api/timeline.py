@@ -0,0 +1,232 @@
+import heapq
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Follow, Idea, TimelineEntry, TimelinePullAuthor
+
+# タイムラインへまとめて書き込む件数
+FANOUT_BATCH_SIZE = 1000
+# フォローした時にタイムラインへ追加する過去のアイデアの件数
+BACKFILL_SIZE = 50
+# 読み込み時に取得するユーザーのidをキャッシュする秒数
+PULL_AUTHORS_CACHE_KEY = 'timeline:pull_authors'
+PULL_AUTHORS_CACHE_TIMEOUT = 60
+# 読み込み時に取得するようになったユーザーのエントリを1回のジョブで消す件数
+DELETE_BATCH_SIZE = 5000
+
+
+def _max_followers():
+    return getattr(settings, 'TIMELINE_FANOUT_MAX_FOLLOWERS', 10000)
+
+
+def _followers(user_id):
+    return Follow.objects.filter(followed_user_id=user_id, is_following=True)
+
+
+def _entries(owner_ids, idea):
+    return [
+        TimelineEntry(owner_id=owner_id,
+                      idea_id=idea.id,
+                      idea_creator_id=idea.idea_creator_id,
+                      created_at=idea.created_at) for owner_id in owner_ids
+    ]
+
+
+# 公開されたアイデアをフォロワーのタイムラインに書き込む
+# フォロワーが多すぎるユーザーは書き込まず、読み込み時に取得する
+def fan_out_idea(idea: Idea, batch_size=FANOUT_BATCH_SIZE):
+    if not idea.is_published:
+        return 0
+    written = _write_entries(idea, batch_size)
+    # 書き込み中に非公開にされた場合は、非公開にした時の削除の後に書いた分を消す
+    # 行をロックして確かめるので、この後に非公開にする更新はこちらのコミットを待ってから消す
+    if not written:
+        return 0
+    with transaction.atomic():
+        is_published = Idea.objects.select_for_update().filter(
+            id=idea.id).values_list('is_published', flat=True).first()
+        if not is_published:
+            remove_idea(idea.id)
+            return 0
+    return written
+
+
+def _write_entries(idea, batch_size):
+    author_id = idea.idea_creator_id
+    if TimelinePullAuthor.objects.filter(user_id=author_id).exists():
+        return 0
+    followers = _followers(author_id)
+    if followers.count() > _max_followers():
+        promote_pull_author(author_id)
+        return 0
+
+    written = 0
+    owner_ids = []
+    for owner_id in followers.values_list('following_user_id',
+                                          flat=True).iterator(
+                                              chunk_size=batch_size):
+        owner_ids.append(owner_id)
+        if len(owner_ids) >= batch_size:
+            TimelineEntry.objects.bulk_create(_entries(owner_ids, idea),
+                                              ignore_conflicts=True)
+            written += len(owner_ids)
+            owner_ids = []
+    TimelineEntry.objects.bulk_create(_entries(owner_ids, idea),
+                                      ignore_conflicts=True)
+    return written + len(owner_ids)
+
+
+def rebuild(batch_size=FANOUT_BATCH_SIZE):
+    """
+    公開済みの全てのアイデアからタイムラインを作り直し、書き込んだ件数を返す
+    fan_out_ideaを通さずに作成したアイデア(合成データなど)に使う
+    フォロワーはユーザーごとに1回だけ取得する
+    """
+    TimelineEntry.objects.all().delete()
+    pull_authors = set(
+        TimelinePullAuthor.objects.values_list('user_id', flat=True))
+    ideas = Idea.objects.filter(is_published=True).exclude(
+        idea_creator_id__in=pull_authors).order_by('idea_creator_id').only(
+            'id', 'idea_creator_id', 'created_at')
+    written = 0
+    author_id = None
+    owner_ids = []
+    entries = []
+    for idea in ideas.iterator(chunk_size=batch_size):
+        if idea.idea_creator_id != author_id:
+            author_id = idea.idea_creator_id
+            owner_ids = list(
+                _followers(author_id).values_list('following_user_id',
+                                                  flat=True))
+            if len(owner_ids) > _max_followers():
+                promote_pull_author(author_id)
+                owner_ids = []
+        entries.extend(_entries(owner_ids, idea))
+        if len(entries) >= batch_size:
+            TimelineEntry.objects.bulk_create(entries,
+                                              batch_size=batch_size,
+                                              ignore_conflicts=True)
+            written += len(entries)
+            entries = []
+    TimelineEntry.objects.bulk_create(entries,
+                                      batch_size=batch_size,
+                                      ignore_conflicts=True)
+    return written + len(entries)
+
+
+def pull_author_ids():
+    """
+    読み込み時に取得するユーザーのidの集合
+    少ないユーザーしか含まれないので、キャッシュしてタイムラインの読み込みごとに引かない
+    """
+    ids = cache.get(PULL_AUTHORS_CACHE_KEY)
+    if ids is None:
+        ids = frozenset(
+            TimelinePullAuthor.objects.values_list('user_id', flat=True))
+        cache.set(PULL_AUTHORS_CACHE_KEY, ids, PULL_AUTHORS_CACHE_TIMEOUT)
+    return ids
+
+
+def promote_pull_author(author_id):
+    """
+    フォロワーが多すぎるユーザーのアイデアを読み込み時に取得するようにする
+    書き込み済みのエントリは読み込み時の取得と重なるが、get_timelineで重複を除くので、
+    他のプロセスのキャッシュが切れてからジョブで少しずつ消す
+    """
+    _, created = TimelinePullAuthor.objects.get_or_create(user_id=author_id)
+    if not created:
+        return
+    from .jobs import enqueue
+    transaction.on_commit(lambda: cache.delete(PULL_AUTHORS_CACHE_KEY))
+    enqueue('delete_timeline_entries', {'author_id': author_id},
+            run_at=timezone.now() +
+            timedelta(seconds=PULL_AUTHORS_CACHE_TIMEOUT))
+
+
+# ユーザーのエントリをbatch_size件消し、まだ残っているかを返す
+def delete_author_entries(author_id, batch_size=DELETE_BATCH_SIZE):
+    ids = list(
+        TimelineEntry.objects.filter(idea_creator_id=author_id).values_list(
+            'id', flat=True)[:batch_size])
+    TimelineEntry.objects.filter(id__in=ids).delete()
+    return len(ids) >= batch_size
+
+
+# 非公開・削除されたアイデアをタイムラインから外す
+def remove_idea(idea_id):
+    TimelineEntry.objects.filter(idea_id=idea_id).delete()
+
+
+# フォローした時に、フォローしたユーザーの最近のアイデアを追加する
+def follow(owner_id, author_id):
+    if TimelinePullAuthor.objects.filter(user_id=author_id).exists():
+        return
+    ideas = Idea.objects.filter(
+        idea_creator_id=author_id,
+        is_published=True).order_by('-created_at')[:BACKFILL_SIZE]
+    TimelineEntry.objects.bulk_create([
+        TimelineEntry(owner_id=owner_id,
+                      idea_id=idea.id,
+                      idea_creator_id=author_id,
+                      created_at=idea.created_at) for idea in ideas
+    ],
+                                      ignore_conflicts=True)
+
+
+# フォローを外した時に、そのユーザーのアイデアをタイムラインから外す
+def unfollow(owner_id, author_id):
+    TimelineEntry.objects.filter(owner_id=owner_id,
+                                 idea_creator_id=author_id).delete()
+
+
+def _keyset(values, created_at_field, id_field):
+    created_at, id = values
+    return Q(**{created_at_field + '__lt': created_at}) | Q(
+        **{
+            created_at_field: created_at,
+            id_field + '__lt': id
+        })
+
+
+def _merge_unique(*rows):
+    # (created_at, id)の降順の列をマージし、両方にあるアイデアは1つにする
+    seen = set()
+    for idea in heapq.merge(*rows,
+                            key=lambda idea: (idea.created_at, idea.id),
+                            reverse=True):
+        if idea.id not in seen:
+            seen.add(idea.id)
+            yield idea
+
+
+# タイムラインを(created_at, id)の降順でlimit件返す
+# 書き込まれたエントリと、フォロワーの多いユーザーのアイデアをマージする
+def get_timeline(owner_id, limit, after=None):
+    # エントリの索引の順に読み、アイデアは同じクエリのJOINで取得する
+    # (複数値の関連なので、条件は1つのfilterにまとめて同じJOINを使う)
+    condition = Q(timeline_idea__owner_id=owner_id)
+    if after is not None:
+        condition &= _keyset(after, 'timeline_idea__created_at',
+                             'timeline_idea__idea_id')
+    ideas = list(
+        Idea.objects.filter(condition).order_by(
+            '-timeline_idea__created_at', '-timeline_idea__idea_id')[:limit])
+
+    # 読み込み時に取得するユーザーがいなければ、クエリはエントリの1回だけにする
+    pull_authors = pull_author_ids()
+    if not pull_authors:
+        return ideas
+    pulled = Idea.objects.filter(
+        is_published=True,
+        idea_creator_id__in=pull_authors,
+        idea_creator__followed_user__following_user_id=owner_id,
+        idea_creator__followed_user__is_following=True)
+    if after is not None:
+        pulled = pulled.filter(_keyset(after, 'created_at', 'id'))
+    pulled = list(pulled.order_by('-created_at', '-id')[:limit])
+    return list(_merge_unique(ideas, pulled))[:limit]
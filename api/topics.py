@@ -0,0 +1,80 @@
+from graphql_relay import from_global_id
+
+from . import response_cache
+from .counters import change_topic_idea_counts
+from .models import Idea, Topic
+
+IdeaTopic = Idea.topics.through
+
+
+# TopicNodeのIDの一覧をトピックのidにする(存在しないトピックはエラー)
+def parse_topic_ids(global_ids):
+    topic_ids = {int(from_global_id(global_id)[1]) for global_id in global_ids}
+    found = set(
+        Topic.objects.filter(id__in=topic_ids).values_list('id', flat=True))
+    if found != topic_ids:
+        raise ValueError('topic not found')
+    return topic_ids
+
+
+def _topic_ids(idea_id):
+    return set(
+        IdeaTopic.objects.filter(idea_id=idea_id).values_list('topic_id',
+                                                              flat=True))
+
+
+def _invalidate():
+    response_cache.invalidate_on_commit('Idea', 'Topic')
+
+
+def update_idea_topics(idea, topic_ids=None, was_published=False,
+                       created=False):
+    """
+    アイデアのトピックを差分だけ中間テーブルに一括で追加・削除し、
+    トピックの公開されたアイデア数を公開状態の変化と合わせて増減する
+    topic_idsがNoneの場合はトピックを変えずに件数だけ更新する
+    """
+    if topic_ids is None and was_published == idea.is_published:
+        return
+    current = set() if created else _topic_ids(idea.id)
+    topic_ids = current if topic_ids is None else set(topic_ids)
+    removed = current - topic_ids
+    added = topic_ids - current
+    if removed:
+        IdeaTopic.objects.filter(idea_id=idea.id,
+                                 topic_id__in=removed).delete()
+    if added:
+        IdeaTopic.objects.bulk_create([
+            IdeaTopic(idea_id=idea.id, topic_id=topic_id)
+            for topic_id in added
+        ])
+
+    counted_before = current if was_published else set()
+    counted_after = topic_ids if idea.is_published else set()
+    change_topic_idea_counts(counted_after - counted_before, 1)
+    change_topic_idea_counts(counted_before - counted_after, -1)
+    # 中間テーブルへの直接の書き込みではm2m_changedが送られないので無効化する
+    if added or removed or counted_before != counted_after:
+        _invalidate()
+
+
+# 削除するアイデアを件数から除く(削除の前に呼ぶ)
+def remove_idea(idea):
+    if idea.is_published:
+        change_topic_idea_counts(_topic_ids(idea.id), -1)
+        _invalidate()
+
+
+def get_topic_ideas(topic_name, limit, after_id=None):
+    """
+    トピックの公開されたアイデアをidの降順に返す
+    中間テーブルの(topic_id, idea_id)の索引を降順にたどるので並べ替えが要らない
+    """
+    links = IdeaTopic.objects.filter(topic__name=topic_name,
+                                     idea__is_published=True)
+    if after_id is not None:
+        links = links.filter(idea_id__lt=after_id)
+    return [
+        link.idea
+        for link in links.select_related('idea').order_by('-idea_id')[:limit]
+    ]
@@ -0,0 +1,298 @@
+import copy
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.utils import timezone
+from promise import Promise, is_thenable
+
+from . import validation
+
+logger = logging.getLogger(__name__)
+
+# 実行中のリクエストのTracer
+current_tracer = ContextVar('current_tracer', default=None)
+
+
+def _ns(seconds):
+    return int(seconds * 1e9)
+
+
+class Span:
+    """1つのリゾルバ(またはDataLoaderのまとめた取得)の計測結果"""
+    def __init__(self,
+                 key,
+                 start_offset,
+                 path=None,
+                 parent_type=None,
+                 field_name=None,
+                 return_type=None):
+        self.key = key
+        self.path = path
+        self.parent_type = parent_type
+        self.field_name = field_name
+        self.return_type = return_type
+        self.start_offset = start_offset
+        self.duration = 0
+        self.sql_count = 0
+        self.sql_duration = 0
+
+    def as_dict(self):
+        return {
+            'path': self.path or [self.key],
+            'parentType': self.parent_type,
+            'fieldName': self.field_name or self.key,
+            'returnType': self.return_type,
+            'startOffset': _ns(self.start_offset),
+            'duration': _ns(self.duration),
+            'sqlCount': self.sql_count,
+            'sqlDuration': _ns(self.sql_duration),
+        }
+
+
+class Tracer:
+    """
+    1件のリクエストの各リゾルバの実行時間と、その中で発行されたSQLの件数・時間を記録する
+    SQLはその時点で実行中のリゾルバに加算する
+    """
+    def __init__(self, operation_name=None):
+        self.operation_name = operation_name or '(anonymous)'
+        self.start_time = timezone.now()
+        self.started = time.perf_counter()
+        self.duration = 0
+        self.spans = []
+        self.sql_count = 0
+        self.sql_duration = 0
+        self._stack = []
+
+    def offset(self):
+        return time.perf_counter() - self.started
+
+    def start_span(self, key, **kwargs):
+        span = Span(key, self.offset(), **kwargs)
+        self.spans.append(span)
+        self._stack.append(span)
+        return span
+
+    def end_span(self, span):
+        if self._stack and self._stack[-1] is span:
+            self._stack.pop()
+        span.duration = self.offset() - span.start_offset
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.sql_count += 1
+            self.sql_duration += duration
+            if self._stack:
+                self._stack[-1].sql_count += 1
+                self._stack[-1].sql_duration += duration
+
+    def finish(self):
+        self.duration = self.offset()
+
+    def as_extensions(self):
+        return {
+            'tracing': {
+                'version': 1,
+                'startTime': self.start_time.isoformat(),
+                'endTime': (self.start_time + timedelta(
+                    seconds=self.duration)).isoformat(),
+                'duration': _ns(self.duration),
+                'sqlCount': self.sql_count,
+                'sqlDuration': _ns(self.sql_duration),
+                'execution': {
+                    'resolvers': [span.as_dict() for span in self.spans]
+                },
+            }
+        }
+
+
+class TraceSummary:
+    """オペレーション名ごと・フィールドごとに計測結果を集計する"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._operations = {}
+            self.since = timezone.now()
+
+    def add(self, tracer):
+        with self._lock:
+            operation = self._operations.setdefault(
+                tracer.operation_name, {
+                    'count': 0,
+                    'duration': 0,
+                    'sql_count': 0,
+                    'sql_duration': 0,
+                    'fields': {},
+                })
+            operation['count'] += 1
+            operation['duration'] += tracer.duration
+            operation['sql_count'] += tracer.sql_count
+            operation['sql_duration'] += tracer.sql_duration
+            for span in tracer.spans:
+                field = operation['fields'].setdefault(
+                    span.key, {
+                        'count': 0,
+                        'duration': 0,
+                        'max_duration': 0,
+                        'sql_count': 0,
+                        'sql_duration': 0,
+                    })
+                field['count'] += 1
+                field['duration'] += span.duration
+                field['max_duration'] = max(field['max_duration'],
+                                            span.duration)
+                field['sql_count'] += span.sql_count
+                field['sql_duration'] += span.sql_duration
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'since': self.since.isoformat(),
+                'operations': copy.deepcopy(self._operations),
+            }
+
+
+summary = TraceSummary()
+_last_export = time.monotonic()
+_export_lock = threading.Lock()
+
+
+# 集計結果をJSONでログに出力して0に戻す(ダッシュボードはこのログを取り込む)
+def export_summary():
+    data = summary.as_dict()
+    summary.reset()
+    if data['operations']:
+        logger.info(json.dumps(data, sort_keys=True))
+    return data
+
+
+def _maybe_export():
+    global _last_export
+    interval = getattr(settings, 'GRAPHQL_TRACING_EXPORT_INTERVAL', 60)
+    with _export_lock:
+        if time.monotonic() - _last_export < interval:
+            return
+        _last_export = time.monotonic()
+    export_summary()
+
+
+# 全てのリクエストを計測して集計するか
+def is_enabled():
+    return getattr(settings, 'GRAPHQL_TRACING', False)
+
+
+# デバッグ用のヘッダがあり、計測結果をレスポンスに含めてよいか
+def is_requested(request):
+    if not request.META.get('HTTP_X_GRAPHQL_TRACING'):
+        return False
+    if settings.DEBUG:
+        return True
+    # 実行前に判定するので、リゾルバのvalidate_tokenを待たずにトークンを検証する
+    token = validation.get_bearer_token(request)
+    if token is None:
+        return False
+    try:
+        email = validation.verify_token(token)['email']
+    except Exception:
+        return False
+    return get_user_model().objects.filter(email=email,
+                                           is_staff=True).exists()
+
+
+@contextmanager
+def trace(operation_name=None, requested=False):
+    """
+    GRAPHQL_TRACINGが有効な場合か、計測結果を返すリクエストの場合だけ計測する
+    集計するのはGRAPHQL_TRACINGが有効な場合だけにする
+    """
+    enabled = is_enabled()
+    if not enabled and not requested:
+        yield None
+        return
+    tracer = Tracer(operation_name)
+    token = current_tracer.set(tracer)
+    try:
+        with _execute_wrappers(tracer):
+            yield tracer
+    finally:
+        current_tracer.reset(token)
+        tracer.finish()
+        if enabled:
+            summary.add(tracer)
+            _maybe_export()
+
+
+@contextmanager
+def _execute_wrappers(wrapper):
+    wrapped = []
+    try:
+        for connection in connections.all():
+            connection.execute_wrappers.append(wrapper)
+            wrapped.append(connection)
+        yield
+    finally:
+        for connection in wrapped:
+            connection.execute_wrappers.remove(wrapper)
+
+
+# リゾルバ以外の処理(DataLoaderのまとめた取得など)を計測する
+@contextmanager
+def span(key):
+    tracer = current_tracer.get()
+    if tracer is None:
+        yield
+        return
+    record = tracer.start_span(key)
+    try:
+        yield
+    finally:
+        tracer.end_span(record)
+
+
+class TracingMiddleware:
+    """QueryとMutation、各ノードのリゾルバの実行時間とSQLを記録するgrapheneのミドルウェア"""
+    def resolve(self, next, root, info, **args):
+        tracer = current_tracer.get()
+        parent_type = info.parent_type.name
+        # コネクションのedges・nodeなどの受け渡しだけのフィールドは計測しない
+        is_connection = parent_type.endswith(
+            ('Connection', 'Edge')) or parent_type == 'PageInfo'
+        if tracer is None or is_connection:
+            return next(root, info, **args)
+
+        span = tracer.start_span(parent_type + '.' + info.field_name,
+                                 path=list(info.path),
+                                 parent_type=parent_type,
+                                 field_name=info.field_name,
+                                 return_type=str(info.return_type))
+        try:
+            result = next(root, info, **args)
+        finally:
+            tracer.end_span(span)
+        if is_thenable(result):
+            # DataLoaderの結果を待つ時間も含める
+            def resolved(value):
+                span.duration = tracer.offset() - span.start_offset
+                return value
+
+            return Promise.resolve(result).then(resolved)
+        return result
+
+
+# 計測するリクエストだけに加えるミドルウェア(api.views.GraphQLView.get_middleware)
+middleware = TracingMiddleware()
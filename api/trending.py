@@ -0,0 +1,215 @@
+import math
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
+
+from .models import (Comment, Idea, Like, Thread, TrendingCheckpoint,
+                     TrendingEvent, TrendingScore)
+from .pagination import ScoreKeysetConnectionField
+
+# 1件あたりのスコア(アイデア自体にも投稿した時点の新しさの分のスコアを付ける)
+IDEA_WEIGHT = 3.0
+LIKE_WEIGHT = 1.0
+COMMENT_WEIGHT = 2.0
+# 記録した増減の種類ごとの1件あたりのスコアと、集計した件数のキー
+EVENT_WEIGHTS = {
+    'Idea': (IDEA_WEIGHT, 'ideas'),
+    'Like': (LIKE_WEIGHT, 'likes'),
+    'Comment': (COMMENT_WEIGHT, 'comments'),
+}
+# 基準の時刻から時定数のこの倍数だけ経ったら、全体を換算し直して値が大きくなりすぎないようにする
+REBASE_AFTER = 20
+# 換算し直した時にこれより小さいスコアの行は消す
+MIN_SCORE = 1e-3
+
+
+def _time_constant():
+    # 半減期から指数関数の時定数(秒)を求める
+    hours = getattr(settings, 'TRENDING_HALF_LIFE_HOURS', 24)
+    return hours * 3600 / math.log(2)
+
+
+def _weight(weight, at, epoch, tau):
+    return weight * math.exp((at - epoch).total_seconds() / tau)
+
+
+def get_trending(limit, after=None):
+    """
+    話題度の高い公開されたアイデアのスコアの行を、アイデアを取得して返す
+    afterはScoreKeysetConnectionFieldのカーソルを戻した(score, idea_id)
+    """
+    rows = TrendingScore.objects.filter(idea__is_published=True)
+    if after:
+        rows = rows.filter(
+            ScoreKeysetConnectionField.keyset_filter(after, 'lt'))
+    return list(
+        rows.select_related('idea').order_by('-score', '-idea_id')[:limit])
+
+
+def _rebase(checkpoint, now, tau):
+    elapsed = (now - checkpoint.epoch).total_seconds() / tau
+    if elapsed < REBASE_AFTER:
+        return
+    TrendingScore.objects.update(score=F('score') * math.exp(-elapsed))
+    TrendingScore.objects.filter(score__lt=MIN_SCORE).delete()
+    checkpoint.epoch = now
+
+
+def _batches(queryset, last_id, fields, batch_size):
+    while True:
+        rows = list(
+            queryset.filter(id__gt=last_id).order_by('id').values_list(
+                'id', *fields)[:batch_size])
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def _apply(deltas, batch_size):
+    """
+    アイデアごとのスコアの増分を反映する
+    行ごとのUPDATEは件数が多いと遅いので、既存の値に加えた行をまとめて消して作り直す
+    """
+    idea_ids = list(deltas)
+    for start in range(0, len(idea_ids), batch_size):
+        chunk = idea_ids[start:start + batch_size]
+        scores = dict(
+            TrendingScore.objects.filter(idea_id__in=chunk).values_list(
+                'idea_id', 'score'))
+        TrendingScore.objects.filter(idea_id__in=list(scores)).delete()
+        TrendingScore.objects.bulk_create([
+            # 取り消しを引いた誤差で0未満にはしない
+            TrendingScore(idea_id=idea_id,
+                          score=max(0.0,
+                                    scores.get(idea_id, 0) + deltas[idea_id]))
+            for idea_id in chunk
+        ])
+
+
+# アイデアへのいいね・取り消しを、次のrefreshで加える増減として記録する
+# いいねの変更と同じトランザクションで、liked_atを更新した後に呼ぶ
+def record_like(like, delta):
+    if like.like_target_type != 'Idea' or like.liked_idea_id is None:
+        return
+    TrendingEvent.objects.create(idea_id=like.liked_idea_id,
+                                 kind='Like',
+                                 delta=delta,
+                                 occurred_at=like.liked_at)
+
+
+# 作成されたアイデアを、次のrefreshで加えるように記録する
+def record_idea(idea):
+    TrendingEvent.objects.create(idea_id=idea.id,
+                                 kind='Idea',
+                                 delta=1,
+                                 occurred_at=idea.created_at)
+
+
+# アイデアへのコメントの作成・削除を、次のrefreshで加える増減として記録する
+def record_comment(comment, delta):
+    idea_id = Thread.objects.filter(id=comment.target_thread_id).values_list(
+        'target_idea_id', flat=True).first()
+    if idea_id is None:
+        return
+    TrendingEvent.objects.create(idea_id=idea_id,
+                                 kind='Comment',
+                                 delta=delta,
+                                 occurred_at=comment.created_at)
+
+
+# いいねした時刻が無い以前からのいいねは、アイデアの作成時刻で換算する
+def _occurred_at(occurred_at, created_at, now):
+    return min(occurred_at or created_at, now)
+
+
+def _rebuild(deltas, counts, epoch, tau, now, batch_size):
+    """
+    記録された増減を捨てて、今あるアイデア・いいね・コメントの行から数える
+    """
+    TrendingEvent.objects.all().delete()
+    for rows in _batches(Idea.objects.all(), 0, ('created_at', ),
+                         batch_size):
+        for idea_id, created_at in rows:
+            deltas[idea_id] += _weight(IDEA_WEIGHT, created_at, epoch, tau)
+        counts['ideas'] += len(rows)
+
+    likes = Like.objects.filter(like_target_type='Idea',
+                                is_liked=True,
+                                liked_idea__isnull=False)
+    for rows in _batches(likes, 0, ('liked_idea_id', 'liked_at',
+                                    'liked_idea__created_at'), batch_size):
+        for _, idea_id, liked_at, created_at in rows:
+            deltas[idea_id] += _weight(
+                LIKE_WEIGHT, _occurred_at(liked_at, created_at, now), epoch,
+                tau)
+        counts['likes'] += len(rows)
+
+    comments = Comment.objects.filter(
+        target_thread__target_idea__isnull=False)
+    for rows in _batches(comments, 0,
+                         ('target_thread__target_idea_id', 'created_at'),
+                         batch_size):
+        for _, idea_id, created_at in rows:
+            deltas[idea_id] += _weight(COMMENT_WEIGHT, created_at, epoch,
+                                       tau)
+        counts['comments'] += len(rows)
+
+
+def _apply_events(deltas, counts, epoch, tau, now, batch_size):
+    """
+    記録された増減を加えて消す
+    idの順ではなく読んだ行を消すので、後からコミットされた小さいidの行も次の集計で拾える
+    """
+    for rows in _batches(TrendingEvent.objects.all(), 0,
+                         ('kind', 'idea_id', 'delta', 'occurred_at',
+                          'idea__created_at'), batch_size):
+        for _, kind, idea_id, delta, occurred_at, created_at in rows:
+            weight, key = EVENT_WEIGHTS[kind]
+            deltas[idea_id] += delta * _weight(
+                weight, _occurred_at(occurred_at, created_at, now), epoch,
+                tau)
+            counts[key] += 1
+        TrendingEvent.objects.filter(id__in=[row[0]
+                                             for row in rows]).delete()
+    # アイデアと一緒に消えたコメントの記録は、アイデアとJOINできずに残るので消す
+    TrendingEvent.objects.filter(
+        ~Exists(Idea.objects.filter(id=OuterRef('idea_id')))).delete()
+
+
+def refresh(batch_size=2000, now=None):
+    """
+    記録されたアイデアの投稿・いいね・コメントの増減だけをスコアに加え、集計した件数を返す
+    初回(resetの後)は記録された増減を捨てて、今ある行から数える
+    """
+    now = now or timezone.now()
+    tau = _time_constant()
+    counts = {'ideas': 0, 'likes': 0, 'comments': 0}
+    # 同じアイデアへの増分は合計してから1回だけ書き込む
+    deltas = defaultdict(float)
+    with transaction.atomic():
+        checkpoint, _ = TrendingCheckpoint.objects.select_for_update(
+        ).get_or_create(id=1)
+        if checkpoint.epoch is None:
+            checkpoint.epoch = now
+        _rebase(checkpoint, now, tau)
+        if checkpoint.refreshed_at is None:
+            _rebuild(deltas, counts, checkpoint.epoch, tau, now, batch_size)
+        else:
+            _apply_events(deltas, counts, checkpoint.epoch, tau, now,
+                          batch_size)
+        _apply(deltas, batch_size)
+        checkpoint.refreshed_at = now
+        checkpoint.save()
+    return counts
+
+
+# 集計の状態とスコアを消して、次のrefreshで全体から作り直す
+def reset():
+    with transaction.atomic():
+        TrendingCheckpoint.objects.all().delete()
+        TrendingScore.objects.all().delete()
+        TrendingEvent.objects.all().delete()
@@ -0,0 +1,128 @@
+import json
+
+from django.conf import settings
+from django.core.files.uploadhandler import (StopUpload,
+                                             TemporaryFileUploadHandler)
+from django.http import HttpResponse
+from graphene_django.views import HttpError
+
+REQUEST_TOO_LARGE = 'request body too large'
+FILE_TOO_LARGE = 'uploaded file too large'
+
+
+def max_file_size():
+    return getattr(settings, 'GRAPHQL_UPLOAD_MAX_FILE_SIZE', 20 * 1024 * 1024)
+
+
+def max_request_size():
+    return getattr(settings, 'GRAPHQL_UPLOAD_MAX_REQUEST_SIZE',
+                   25 * 1024 * 1024)
+
+
+class LimitedUploadHandler(TemporaryFileUploadHandler):
+    """
+    アップロードされたファイルを大きさに関わらずチャンクごとに一時ファイルへ書き込み、
+    ファイルごと・リクエスト全体の上限を超えた時点で残りの本文を読まずに止める
+    """
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.max_file_size = max_file_size()
+        self.max_request_size = max_request_size()
+        self.received = 0
+        self.error = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file_size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file_size += len(raw_data)
+        self.received += len(raw_data)
+        if self.file_size > self.max_file_size:
+            self.error = FILE_TOO_LARGE
+        elif self.received > self.max_request_size:
+            self.error = REQUEST_TOO_LARGE
+        if self.error:
+            # 書き込み途中の一時ファイルはDjangoが閉じて消す
+            raise StopUpload(connection_reset=True)
+        return super().receive_data_chunk(raw_data, start)
+
+
+def _too_large(message):
+    return HttpError(HttpResponse(status=413), message)
+
+
+def parse_multipart(request):
+    """
+    multipart/form-dataの本文を上限付きで解析する
+    Content-Lengthが上限を超える場合は本文を読まずに413を返す
+    request.POSTやrequest.FILESを参照する前に呼ぶ
+    """
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        content_length = 0
+    if content_length > max_request_size():
+        raise _too_large(REQUEST_TOO_LARGE)
+    handler = LimitedUploadHandler(request)
+    request.upload_handlers = [handler]
+    # ここで本文を読み込み、ファイルは一時ファイルのまま渡す
+    request.POST
+    if handler.error:
+        raise _too_large(handler.error)
+
+
+class UploadLimitMiddleware:
+    """
+    ASGIではDjangoがビューの前に本文をすべて読み込むので、
+    その前にContent-Lengthと受け取った量を上限と比べて413を返す
+    daphneは本文を受け取り終えてからアプリを呼ぶので、前段のプロキシでも上限を設定する
+    """
+    def __init__(self, app, paths=('/graphql/', )):
+        self.app = app
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] not in self.paths:
+            return await self.app(scope, receive, send)
+        limit = max_request_size()
+        content_length = dict(scope['headers']).get(b'content-length')
+        if content_length and content_length.isdigit() and \
+                int(content_length) > limit:
+            return await self._reject(send)
+
+        received = 0
+        exceeded = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            received += len(message.get('body', b''))
+            if received > limit:
+                # 切断として扱わせ、Djangoに残りを読み込ませない
+                exceeded = True
+                return {'type': 'http.disconnect'}
+            return message
+
+        async def tracked_send(message):
+            nonlocal started
+            if message['type'] == 'http.response.start':
+                started = True
+            await send(message)
+
+        await self.app(scope, limited_receive, tracked_send)
+        if exceeded and not started:
+            await self._reject(send)
+
+    async def _reject(self, send):
+        body = json.dumps({'errors': [{'message': REQUEST_TOO_LARGE}]})
+        await send({
+            'type':
+            'http.response.start',
+            'status':
+            413,
+            'headers': [(b'content-type', b'application/json'),
+                        (b'connection', b'close')],
+        })
+        await send({'type': 'http.response.body', 'body': body.encode()})
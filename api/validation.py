@@ -1,10 +1,172 @@
+import functools
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.contrib.auth import get_user_model
+from django.utils.functional import SimpleLazyObject
+from google.auth import transport
 from google.auth.transport import requests
 from google.oauth2 import id_token
 
+# 検証済みトークンを保持する最大件数
+VERIFIED_TOKEN_CACHE_SIZE = 10000
+# Cache-Controlにmax-ageが無い場合の証明書のキャッシュ秒数
+DEFAULT_CERTS_MAX_AGE = 300
+
+_MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+
+class _CachedResponse(transport.Response):
+    def __init__(self, status, headers, data):
+        self._status = status
+        self._headers = headers
+        self._data = data
+
+    @property
+    def status(self):
+        return self._status
+
+    @property
+    def headers(self):
+        return self._headers
+
+    @property
+    def data(self):
+        return self._data
+
+
+class CachedCertsRequest(transport.Request):
+    """Googleの証明書のレスポンスをmax-ageの間だけプロセス内に保持するRequest"""
+    def __init__(self):
+        # セッションを使い回してTLS接続を再利用する
+        self._request = requests.Request()
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, url, method='GET', **kwargs):
+        if method != 'GET':
+            return self._request(url, method=method, **kwargs)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(url)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        response = self._request(url, method=method, **kwargs)
+        if response.status == 200:
+            cached_response = _CachedResponse(response.status,
+                                              response.headers,
+                                              response.data)
+            expires_at = now + _get_max_age(response.headers)
+            with self._lock:
+                self._cache[url] = (expires_at, cached_response)
+            return cached_response
+        # 取得に失敗した場合は期限切れでも直前の証明書で検証を続ける
+        if cached is not None:
+            return cached[1]
+        return response
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+class VerifiedTokenCache:
+    """検証済みトークンのclaimsをトークンのハッシュをキーにexpまで保持するLRU"""
+    def __init__(self, maxsize=VERIFIED_TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        key = _hash_token(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry['exp'] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, token, id_info):
+        exp = id_info.get('exp')
+        if exp is None or exp <= time.time():
+            return
+        key = _hash_token(token)
+        with self._lock:
+            self._entries[key] = id_info
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _get_max_age(headers):
+    match = _MAX_AGE_RE.search(headers.get('cache-control', ''))
+    if match is None:
+        return DEFAULT_CERTS_MAX_AGE
+    return int(match.group(1))
+
+
+def _hash_token(token):
+    if isinstance(token, str):
+        token = token.encode('utf-8')
+    return hashlib.sha256(token).hexdigest()
+
+
+certs_request = CachedCertsRequest()
+verified_tokens = VerifiedTokenCache()
+
+
+def verify_token(token):
+    # 検証済みのトークンであれば署名の検証を省略する
+    id_info = verified_tokens.get(token)
+    if id_info is None:
+        # Specify the CLIENT_ID of the app that accesses the backend:
+        id_info = id_token.verify_oauth2_token(token, certs_request)
+        # Or, if multiple clients access the backend server:
+        # id_info = id_token.verify_oauth2_token(token, requests.Request())
+        # if id_info['aud'] not in [CLIENT_ID_1, CLIENT_ID_2, CLIENT_ID_3]:
+        #     raise ValueError('Could not verify audience.')
+
+        # If auth request is from a G Suite domain:
+        # if id_info['hd'] != GSUITE_DOMAIN_NAME:
+        #     raise ValueError('Wrong hosted domain.')
+        verified_tokens.set(token, id_info)
+    return id_info
+
+
+# リクエストのAuthorizationヘッダーのBearerトークン(無い場合はNone)
+def get_bearer_token(request):
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if authorization[:6] != 'Bearer':
+        return None
+    return authorization[7:] or None
+
+
+# 認証済みのユーザーをリクエスト単位で1度だけ取得し、info.context.current_userに保持する
+def set_current_user(context, email):
+    current_user = getattr(context, 'current_user', None)
+    if current_user is not None and getattr(context, 'current_user_email',
+                                            None) == email:
+        return
+    context.current_user_email = email
+    context.current_user = SimpleLazyObject(
+        lambda: get_user_model().objects.get(email=email))
+
 
 # フロントからのリクエストを受け取り、headersのauthorizationからid_token（idToken）を受け取る。
 # 受け取ったトークンを解析して、トークンが有効であるかを調べる。
 def validate_token(function):
+    @functools.wraps(function)
     def validate(root, info, **kwargs):
         # print(kwargs)
         # Bearer token... の形式でトークンを受け取る。
@@ -17,23 +179,14 @@ def validate_token(function):
             raise ValueError('Not Bearer Token!')
         token = authorization[7:]
         try:
-            # Specify the CLIENT_ID of the app that accesses the backend:
-            id_info = id_token.verify_oauth2_token(token, requests.Request())
-            # print(id_info)
-            # Or, if multiple clients access the backend server:
-            # id_info = id_token.verify_oauth2_token(token, requests.Request())
-            # if id_info['aud'] not in [CLIENT_ID_1, CLIENT_ID_2, CLIENT_ID_3]:
-            #     raise ValueError('Could not verify audience.')
-
-            # If auth request is from a G Suite domain:
-            # if id_info['hd'] != GSUITE_DOMAIN_NAME:
-            #     raise ValueError('Wrong hosted domain.')
+            id_info = verify_token(token)
 
             # ID token is valid. Get the user's Google Account ID from the decoded token.
             # userid = id_info['sub']
 
             # キーワード引数にemailを追加
             info.context.user.email = id_info['email']
+            set_current_user(info.context, id_info['email'])
             return function(root, info, **kwargs)
         except ValueError:
             raise
@@ -1,3 +1,222 @@
-from django.shortcuts import render
+import asyncio
+import functools
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-# Create your views here.
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.http.response import HttpResponseBadRequest
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.utils.utils import set_rollback
+from graphene_django.views import HttpError
+from graphene_file_upload.django import FileUploadGraphQLView
+
+from . import response_cache, routers, tracing, uploads
+from .persisted import (CachedDocumentBackend, get_persisted_query,
+                        is_registered, query_hash)
+from .validation import get_bearer_token, verified_tokens, verify_token
+
+# 非同期のビューからGraphQLを実行するスレッドプール
+# スレッドごとにDBの接続を持つので、スレッド数がプロセスの接続数の上限になる
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _persisted_query_hash(request, data):
+    extensions = request.GET.get('extensions') or data.get('extensions')
+    if isinstance(extensions, str):
+        try:
+            extensions = json.loads(extensions)
+        except ValueError:
+            raise HttpError(HttpResponseBadRequest('invalid extensions'))
+    if not isinstance(extensions, dict):
+        return None
+    persisted_query = extensions.get('persistedQuery') or {}
+    return persisted_query.get('sha256Hash')
+
+
+class GraphQLView(FileUploadGraphQLView):
+    """
+    実行前にクエリの深さとコストを見積もり、
+    見積もったコストをレスポンスのextensionsに含めるビュー
+    クライアントは登録済みのクエリをextensions.persistedQuery.sha256Hashで指定できる
+    未ログインの公開クエリのレスポンスはキャッシュする
+    X-GraphQL-Tracingヘッダがある場合はリゾルバごとの計測結果をextensionsに含める
+    クエリの読み込みはレプリカで、ミューテーションはプライマリで行う
+    アップロードはファイルごと・リクエスト全体の上限を超えると413を返す
+    """
+    def __init__(self, backend=None, **kwargs):
+        super().__init__(backend=backend or CachedDocumentBackend(),
+                         **kwargs)
+
+    def parse_body(self, request):
+        # アップロードは上限付きで一時ファイルに書き込む
+        if self.get_content_type(request) == 'multipart/form-data':
+            uploads.parse_multipart(request)
+        return super().parse_body(request)
+
+    def get_graphql_params(self, request, data):
+        query, variables, operation_name, id = super().get_graphql_params(
+            request, data)
+        sha256_hash = _persisted_query_hash(request, data)
+        if sha256_hash:
+            if query and query_hash(query) != sha256_hash:
+                raise HttpError(
+                    HttpResponseBadRequest(
+                        'provided sha does not match query'))
+            query = get_persisted_query(sha256_hash)
+            if query is None:
+                raise HttpError(
+                    HttpResponseBadRequest('PersistedQueryNotFound'))
+        elif query and getattr(settings, 'GRAPHQL_PERSISTED_QUERIES_ONLY',
+                               False) and not is_registered(query):
+            raise HttpError(
+                HttpResponseBadRequest('only persisted queries are allowed'))
+        return query, variables, operation_name, id
+
+    # extensionsを返すためにGraphQLView.get_responseを置き換える
+    def get_response(self, request, data, show_graphiql=False):
+        query, variables, operation_name, id = self.get_graphql_params(
+            request, data)
+
+        cache_entry = None
+        if query and not self.batch and not show_graphiql and \
+                response_cache.is_cacheable_request(request) and \
+                not request.META.get('HTTP_X_GRAPHQL_TRACING'):
+            cache_entry = self.get_cache_entry(request, query, variables,
+                                               operation_name)
+        if cache_entry is not None:
+            cached = cache_entry.get()
+            if cached is not None:
+                return cached, 200
+
+        execution_result = self.execute_graphql_request(
+            request, data, query, variables, operation_name, show_graphiql)
+
+        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+            set_rollback()
+
+        if not execution_result:
+            return None, 200
+
+        status_code = 200
+        response = {}
+        if execution_result.errors:
+            set_rollback()
+            response['errors'] = [
+                self.format_error(e) for e in execution_result.errors
+            ]
+        if execution_result.invalid:
+            status_code = 400
+        else:
+            response['data'] = execution_result.data
+        if execution_result.extensions:
+            response['extensions'] = execution_result.extensions
+        if self.batch:
+            response['id'] = id
+            response['status'] = status_code
+
+        result = self.json_encode(request, response, pretty=show_graphiql)
+        if cache_entry is not None and status_code == 200 and \
+                not execution_result.errors:
+            cache_entry.set(result)
+        return result, status_code
+
+    def execute_graphql_request(self,
+                                request,
+                                data,
+                                query,
+                                variables,
+                                operation_name,
+                                show_graphiql=False):
+        document = self.get_document(request, query)
+        primary = document is None or \
+            document.get_operation_type(operation_name) != 'query'
+        requested = tracing.is_requested(request)
+        with routers.request_scope(primary), \
+                tracing.trace(operation_name, requested) as tracer:
+            result = super().execute_graphql_request(request, data, query,
+                                                     variables,
+                                                     operation_name,
+                                                     show_graphiql)
+        # デバッグ用のヘッダがある場合はリゾルバごとの計測結果を返す
+        if requested and tracer is not None and result is not None:
+            result.extensions.update(tracer.as_extensions())
+        return result
+
+    def get_middleware(self, request):
+        # 計測するリクエストだけ、リゾルバを計測するミドルウェアを加える
+        middleware = list(super().get_middleware(request) or [])
+        if tracing.current_tracer.get() is not None:
+            middleware.append(tracing.middleware)
+        return middleware
+
+    def get_document(self, request, query):
+        if not query:
+            return None
+        try:
+            return self.get_backend(request).document_from_string(
+                self.schema, query)
+        except Exception:
+            # 構文エラーはexecute_graphql_requestでエラーとして返す
+            return None
+
+    def get_cache_entry(self, request, query, variables, operation_name):
+        document = self.get_document(request, query)
+        if document is None:
+            return None
+        return response_cache.get_entry(document, variables, operation_name)
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'GRAPHQL_ASYNC_WORKERS', 8),
+                thread_name_prefix='graphql')
+        return _executor
+
+
+def _run_view(view, request, *args, **kwargs):
+    # WSGIのリクエストの開始・終了時と同じく、期限切れや壊れた接続を閉じる
+    close_old_connections()
+    try:
+        return view(request, *args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def async_graphql_view(view):
+    """
+    同期のビューをASGIで動かす非同期のビューにする
+    リクエストの受信とレスポンスの送信はイベントループで行い、
+    ORMを含むGraphQLの実行だけを上限付きのスレッドプールで行う
+    """
+    # ATOMIC_REQUESTSのトランザクションはスレッドプールの中で張る
+    atomic_aliases = {
+        db.alias
+        for db in connections.all() if db.settings_dict['ATOMIC_REQUESTS']
+    }
+    for alias in atomic_aliases:
+        view = transaction.atomic(using=alias)(view)
+
+    async def graphql_view(request, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        token = get_bearer_token(request)
+        if token and verified_tokens.get(token) is None:
+            # Googleの証明書の取得と署名の検証はイベントループの外で先に行い、
+            # リゾルバでは検証済みトークンのキャッシュを使う
+            try:
+                await loop.run_in_executor(None, verify_token, token)
+            except Exception:
+                # 無効なトークンのエラーはリゾルバで返す
+                pass
+        return await loop.run_in_executor(
+            get_executor(),
+            functools.partial(_run_view, view, request, *args, **kwargs))
+
+    graphql_view.csrf_exempt = True
+    graphql_view._non_atomic_requests = atomic_aliases
+    return graphql_view
@@ -9,11 +9,21 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from channels.routing import ProtocolTypeRouter
+from channels.routing import ProtocolTypeRouter, URLRouter
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+# ASGIでは/graphql/を非同期のビューで処理する
+os.environ.setdefault('GRAPHQL_ASYNC', 'True')
+
+# アプリの読み込みが終わってからコンシューマをimportする
+django_application = get_asgi_application()
+
+from api.subscriptions import websocket_urlpatterns  # noqa: E402
+from api.uploads import UploadLimitMiddleware  # noqa: E402
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    # 上限を超えるアップロードはDjangoが本文を読み込む前に返す
+    "http": UploadLimitMiddleware(django_application),
+    "websocket": URLRouter(websocket_urlpatterns),
 })
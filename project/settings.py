@@ -12,7 +12,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 
 from pathlib import Path
 
-from decouple import config
+from decouple import Csv, config
 from dj_database_url import parse as dburl
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -71,7 +71,26 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'project.wsgi.application'
-ASGI_APPLICATION = 'graphql_ws.django.routing.application'
+ASGI_APPLICATION = 'project.asgi.application'
+
+# 通知の配信に使うチャネルレイヤー
+# 複数プロセスで配信する場合はREDIS_URLを設定する(channels_redisが必要)
+REDIS_URL = config('REDIS_URL', default='')
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [REDIS_URL],
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
@@ -91,8 +110,129 @@ default_dburl = "sqlite:///" + str(BASE_DIR / "db.sqlite3")
 DATABASES = {
     'default': config("DATABASE_URL", default=default_dburl, cast=dburl)
 }
+# 読み込み用のレプリカ(DATABASE_URLと同じ形式をカンマ区切りで指定する)
+# GraphQLのクエリの読み込みをレプリカに振り分ける(api/routers.py)
+DATABASE_REPLICAS = []
+for i, replica_url in enumerate(
+        config('DATABASE_REPLICA_URLS', default='', cast=Csv())):
+    DATABASES['replica%d' % (i + 1)] = dict(dburl(replica_url),
+                                            TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append('replica%d' % (i + 1))
+DATABASE_ROUTERS = ['api.routers.ReplicaRouter']
+# レプリカに接続できるかを確認する間隔の秒数(停止中のレプリカはこの間選ばない)
+DATABASE_REPLICA_CHECK_INTERVAL = config('DATABASE_REPLICA_CHECK_INTERVAL',
+                                         default=10,
+                                         cast=int)
+
+# 既定はプロセス内のキャッシュ
+# 複数プロセスで共有する場合はMEMCACHED_LOCATIONを設定する(pymemcacheが必要)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+MEMCACHED_LOCATION = config('MEMCACHED_LOCATION', default='')
+if MEMCACHED_LOCATION:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': MEMCACHED_LOCATION,
+        }
+    }
+
+GRAPHENE = {
+    'SCHEMA': 'project.schema.schema',
+}
+
+# リゾルバごとの実行時間とSQLの計測(api/tracing.py)
+# 有効にすると全てのリクエストを計測し、
+# 集計結果はGRAPHQL_TRACING_EXPORT_INTERVAL秒ごとにapi.tracingのログへ出力する
+# 無効でもX-GraphQL-Tracingヘッダのあるリクエスト(DEBUGかスタッフのみ)は計測して返す
+GRAPHQL_TRACING = config('GRAPHQL_TRACING', default=False, cast=bool)
+GRAPHQL_TRACING_EXPORT_INTERVAL = config('GRAPHQL_TRACING_EXPORT_INTERVAL',
+                                         default=60,
+                                         cast=int)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['console'],
+            'level': config('API_LOG_LEVEL', default='INFO'),
+        },
+    },
+}
 
-GRAPHENE = {'SCHEMA': 'project.schema.schema'}
+# 実行前に見積もるクエリの深さとコストの上限(api/cost.py)
+GRAPHQL_MAX_DEPTH = config('GRAPHQL_MAX_DEPTH', default=12, cast=int)
+GRAPHQL_MAX_COST = config('GRAPHQL_MAX_COST', default=5000, cast=int)
+# 未ログインのクエリのレスポンスキャッシュ(api/response_cache.py)
+# 使用するCACHESのエイリアスと保持する秒数
+GRAPHQL_RESPONSE_CACHE_ALIAS = config('GRAPHQL_RESPONSE_CACHE_ALIAS',
+                                      default='default')
+GRAPHQL_RESPONSE_CACHE_TIMEOUT = config('GRAPHQL_RESPONSE_CACHE_TIMEOUT',
+                                        default=60,
+                                        cast=int)
+# パース・バリデーション済みのクエリを保持する件数(api/persisted.py)
+GRAPHQL_DOCUMENT_CACHE_SIZE = config('GRAPHQL_DOCUMENT_CACHE_SIZE',
+                                     default=1000,
+                                     cast=int)
+# 登録済みのクエリの有無をプロセス内に保持する秒数(api/persisted.py)
+GRAPHQL_PERSISTED_QUERY_CACHE_TIMEOUT = config(
+    'GRAPHQL_PERSISTED_QUERY_CACHE_TIMEOUT', default=60, cast=int)
+# 登録済みのクエリ(register_persisted_queries)だけを受け付ける
+GRAPHQL_PERSISTED_QUERIES_ONLY = config('GRAPHQL_PERSISTED_QUERIES_ONLY',
+                                        default=False,
+                                        cast=bool)
+# /graphql/を非同期のビューにする(project/asgi.pyで配信する場合は既定で有効)
+GRAPHQL_ASYNC = config('GRAPHQL_ASYNC', default=False, cast=bool)
+# 非同期のビューでGraphQLを実行するスレッド数(プロセスのDBの接続数の上限にもなる)
+GRAPHQL_ASYNC_WORKERS = config('GRAPHQL_ASYNC_WORKERS', default=8, cast=int)
+# /graphql/へのアップロードの上限(api/uploads.py)
+# ファイルごとの大きさとリクエスト全体の大きさ(バイト)
+GRAPHQL_UPLOAD_MAX_FILE_SIZE = config('GRAPHQL_UPLOAD_MAX_FILE_SIZE',
+                                      default=20 * 1024 * 1024,
+                                      cast=int)
+GRAPHQL_UPLOAD_MAX_REQUEST_SIZE = config('GRAPHQL_UPLOAD_MAX_REQUEST_SIZE',
+                                         default=25 * 1024 * 1024,
+                                         cast=int)
+
+# 話題度(api/trending.py)でいいね・コメントの重みが半分になるまでの時間
+TRENDING_HALF_LIFE_HOURS = config('TRENDING_HALF_LIFE_HOURS',
+                                  default=24,
+                                  cast=float)
+
+# バックグラウンドのジョブ(api/jobs.py、manage.py run_workerで実行する)
+# 1つのワーカーで同時に実行するジョブ数と、実行できるジョブが無い時に待つ秒数
+JOB_WORKER_CONCURRENCY = config('JOB_WORKER_CONCURRENCY', default=4, cast=int)
+JOB_POLL_INTERVAL = config('JOB_POLL_INTERVAL', default=1.0, cast=float)
+# 失敗したジョブをやり直すまでの秒数(失敗するたびに2倍にする)とその上限
+JOB_RETRY_BASE_DELAY = config('JOB_RETRY_BASE_DELAY', default=10, cast=int)
+JOB_RETRY_MAX_DELAY = config('JOB_RETRY_MAX_DELAY', default=3600, cast=int)
+# 実行中のままこの秒数を過ぎたジョブは、止まったワーカーのものとしてやり直す
+JOB_LOCK_TIMEOUT = config('JOB_LOCK_TIMEOUT', default=600, cast=int)
+# 完了したジョブを残しておく時間
+JOB_RETENTION_HOURS = config('JOB_RETENTION_HOURS', default=168, cast=int)
+# 話題度の集計とカウンタの補正のジョブを追加する間隔(秒、0の場合は追加しない)
+TRENDING_REFRESH_INTERVAL = config('TRENDING_REFRESH_INTERVAL',
+                                   default=300,
+                                   cast=int)
+COUNTER_RECONCILE_INTERVAL = config('COUNTER_RECONCILE_INTERVAL',
+                                    default=3600,
+                                    cast=int)
+# ユーザー作成時に本登録のお知らせのメールを送る
+SEND_WELCOME_EMAIL = config('SEND_WELCOME_EMAIL', default=False, cast=bool)
+
+# フォロワー数がこれを超えるユーザーのアイデアはタイムラインに書き込まず、読み込み時に取得する
+TIMELINE_FANOUT_MAX_FOLLOWERS = config('TIMELINE_FANOUT_MAX_FOLLOWERS',
+                                       default=10000,
+                                       cast=int)
 
 AUTHENTICATION_BACKENDS = [
     'social_core.backends.google.GoogleOAuth2',
@@ -191,7 +331,8 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATIC_ROOT = str(BASE_DIR / 'staticfiles')
 MEDIA_URL = '/media/'
-MEDIA_ROOT = str(BASE_DIR / 'mediafiles')
+# アップロードされたファイルの保存先
+MEDIA_ROOT = config('MEDIA_ROOT', default=str(BASE_DIR / 'mediafiles'))
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
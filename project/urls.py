@@ -1,15 +1,21 @@
 from django.contrib import admin
 from django.urls import path
-from graphene_django.views import GraphQLView
+from api.views import GraphQLView, async_graphql_view
 from project.schema import schema
 from django.views.decorators.csrf import csrf_exempt
-from graphene_file_upload.django import FileUploadGraphQLView
 from django.conf.urls.static import static
 from django.conf import settings
 
+# ASGIで配信する場合は非同期のビューにする
+if settings.GRAPHQL_ASYNC:
+    graphql_view = async_graphql_view(
+        GraphQLView.as_view(graphiql=True, schema=schema))
+else:
+    graphql_view = csrf_exempt(
+        GraphQLView.as_view(graphiql=True, schema=schema))
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('graphql/', csrf_exempt(FileUploadGraphQLView.as_view(graphiql=True, schema=schema))),
+    path('graphql/', graphql_view),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT) \
     + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)